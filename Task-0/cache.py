@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from importlib import metadata
+from typing import Dict, Optional
+
+# Content-addressed store for raw simulator payloads; CACHE_DIR="" disables it
+CACHE_DIR = os.getenv("CACHE_DIR", ".wearipedia_cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_SUFFIX = ".pkl"
+
+
+def wearipedia_version() -> str:
+    try:
+        return metadata.version("wearipedia")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def cache_key(device_cls, seed: int, start_date: str, end_date: str, metrics) -> str:
+    """Hash of everything that determines the generated payload."""
+    identity = {
+        "device": f"{device_cls.__module__}.{device_cls.__qualname__}",
+        "seed": int(seed),
+        "start_date": start_date,
+        "end_date": end_date,
+        "metrics": sorted(metrics),
+        "wearipedia": wearipedia_version(),
+    }
+    encoded = json.dumps(identity, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+
+def load(key: str, cache_dir: str = CACHE_DIR) -> Optional[Dict]:
+    if not cache_dir:
+        return None
+
+    path = _path(key, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[WARNING] Discarding unreadable cache entry {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # Refresh mtime so eviction keeps recently used entries
+    os.utime(path)
+    print(f"[CACHE] Hit {key[:12]}")
+    return payload
+
+
+def store(key: str, payload: Dict, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+    if not cache_dir:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temp file and rename so concurrent generators never see partial entries
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _path(key, cache_dir))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(f"[CACHE] Stored {key[:12]}")
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            print(f"[CACHE] Evicted {os.path.basename(path)}")
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -1,8 +1,11 @@
-import json
+import logging
 import os
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 import numpy as np
 
+import cache
+from writers import OUTPUT_FORMATS, DEFAULT_CHUNK_SIZE, save_records
+
 try:
     import wearipedia
     from wearipedia.devices.fitbit.fitbit_charge_6 import FitbitCharge6
@@ -20,6 +23,12 @@ METRICS = [
     "intraday_active_zone_minute"
 ]
 USER_ID = "synthetic_001"
+SEED = 42
+START_DATE = "2024-01-01"
+END_DATE = "2024-01-31"
+# "json" keeps the original pretty-printed arrays; "ndjson", "npy" and "parquet" stream shards
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "json")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
 
 
 def ensure_output_directory(path: str):
@@ -30,11 +39,16 @@ def ensure_output_directory(path: str):
         print(f"Using existing directory: {path}")
 
 
-def extract_fitbit_data() -> Dict:
+def extract_fitbit_data(seed: int = SEED, start_date: str = START_DATE, end_date: str = END_DATE) -> Dict:
+    key = cache.cache_key(FitbitCharge6, seed, start_date, end_date, METRICS)
+    raw_data = cache.load(key)
+    if raw_data is not None:
+        return raw_data
+
     device = FitbitCharge6(
-        seed=42,
-        synthetic_start_date="2024-01-01",
-        synthetic_end_date="2024-01-31"
+        seed=seed,
+        synthetic_start_date=start_date,
+        synthetic_end_date=end_date
     )
     device._gen_synthetic()
 
@@ -46,13 +60,21 @@ def extract_fitbit_data() -> Dict:
             raw_data[metric] = data
         except Exception as e:
             print(f"Warning: Failed to extract {metric}: {e}")
+
+    # A partial payload would be served from the cache forever; only cache complete ones
+    if len(raw_data) == len(METRICS):
+        cache.store(key, raw_data)
+    else:
+        print(f"Warning: Not caching payload, {len(METRICS) - len(raw_data)} metric(s) failed")
     return raw_data
 
 
-def normalize_intraday(metric: str, raw_list: List[Dict]) -> List[Dict]:
-    records = []
+# Per-metric parsers: (timestamp, value) pairs from one raw payload, with the skip rules
+# for malformed entries. iter_records and fitbit_columns both build on them.
+
+def intraday_points(raw_list: List[Dict]) -> Iterator[Tuple[str, float]]:
     for daily_entry in raw_list:
-        print(f"[DEBUG] Daily Entry Keys: {list(daily_entry.keys())}")
+        logging.debug(f"Daily Entry Keys: {list(daily_entry.keys())}")
 
         if "heart_rate_day" not in daily_entry:
             print(f"[WARNING] 'heart_rate_day' missing from entry: {daily_entry}")
@@ -68,7 +90,7 @@ def normalize_intraday(metric: str, raw_list: List[Dict]) -> List[Dict]:
             intraday_data = day_record.get("activities-heart-intraday", {})
             dataset = intraday_data.get("dataset", [])
 
-            print(f"[DEBUG] Processing {len(dataset)} entries for {base_date}")
+            logging.debug(f"Processing {len(dataset)} entries for {base_date}")
 
             for i, entry in enumerate(dataset):
                 try:
@@ -80,40 +102,30 @@ def normalize_intraday(metric: str, raw_list: List[Dict]) -> List[Dict]:
                     else:
                         value = float(value)
 
-                    record = {
-                        "user_id": USER_ID,
-                        "metric": metric,
-                        "timestamp": timestamp,
-                        "value": value
-                    }
-                    records.append(record)
-
                 except Exception as e:
-                    print(f"[DEBUG] Skipping entry due to error: {e}")
+                    logging.debug(f"Skipping entry due to error: {e}")
                     continue
 
-    print(f"[DEBUG] Total records created for {metric}: {len(records)}")
-    return records
+                yield timestamp, value
 
-def normalize_spo2(data):
-    records = []
+
+def spo2_points(data) -> Iterator[Tuple[str, float]]:
     for entry in data:
         for m in entry.get("minutes", []):
-            timestamp = m["minute"]
-            value = m.get("value")
-            if value is not None:
-                records.append({
-                    "user_id": USER_ID,
-                    "metric": "spo2",
-                    "timestamp": timestamp,
-                    "value": value
-                })
-    print(f"[INFO] Parsed {len(records)} records for spo2")
-    return records
+            try:
+                timestamp = m["minute"]
+                value = m.get("value")
+                if value is None:
+                    continue
+                value = float(value)
+            except Exception as e:
+                print(f"[WARNING] Skipping spo2 entry: {e}")
+                continue
 
+            yield timestamp, value
 
-def normalize_breath_rate(raw_list: List[Dict]) -> List[Dict]:
-    records = []
+
+def breath_rate_points(raw_list: List[Dict]) -> Iterator[Tuple[str, float]]:
     for day_entry in raw_list:
         br_data = day_entry.get("br", [])
         for record in br_data:
@@ -123,24 +135,18 @@ def normalize_breath_rate(raw_list: List[Dict]) -> List[Dict]:
                 value = full_summary.get("breathingRate")
 
                 if date and value is not None:
-                    records.append({
-                        "user_id": USER_ID,
-                        "metric": "breath_rate",
-                        "timestamp": f"{date}T00:00:00",
-                        "value": float(value)
-                    })
+                    point = (f"{date}T00:00:00", float(value))
                 else:
                     print(f"[WARNING] Missing value for breath_rate on {date}")
+                    continue
             except Exception as e:
                 print(f"[WARNING] Skipping breath_rate entry: {e}")
                 continue
 
-    print(f"[INFO] Parsed {len(records)} records for breath_rate")
-    return records
+            yield point
 
 
-def normalize_hrv(raw_list: List[Dict]) -> List[Dict]:
-    records = []
+def hrv_points(raw_list: List[Dict]) -> Iterator[Tuple[str, float]]:
     for day_entry in raw_list:
         hrv_data = day_entry.get("hrv", [])
         for record in hrv_data:
@@ -150,23 +156,18 @@ def normalize_hrv(raw_list: List[Dict]) -> List[Dict]:
                     value = minute_entry.get("value", {}).get("rmssd")
 
                     if timestamp and value is not None:
-                        records.append({
-                            "user_id": USER_ID,
-                            "metric": "hrv",
-                            "timestamp": timestamp,
-                            "value": float(value)
-                        })
+                        point = (timestamp, float(value))
                     else:
                         print(f"[WARNING] Missing value for hrv at {timestamp}")
+                        continue
                 except Exception as e:
                     print(f"[WARNING] Skipping hrv entry: {e}")
                     continue
 
-    print(f"[INFO] Parsed {len(records)} records for hrv")
-    return records
+                yield point
 
-def normalize_active_zone_minute(raw_list: List[Dict]) -> List[Dict]:
-    records = []
+
+def active_zone_minute_points(raw_list: List[Dict]) -> Iterator[Tuple[str, float]]:
     for day_entry in raw_list:
         azm_list = day_entry.get("activities-active-zone-minutes-intraday", [])
         for azm_day in azm_list:
@@ -177,43 +178,146 @@ def normalize_active_zone_minute(raw_list: List[Dict]) -> List[Dict]:
                     value = minute_entry.get("value", {}).get("activeZoneMinutes")
 
                     if base_date and minute and value is not None:
-                        timestamp = f"{base_date}T{minute}"
-                        records.append({
-                            "user_id": USER_ID,
-                            "metric": "active_zone_minute",
-                            "timestamp": timestamp,
-                            "value": float(value)
-                        })
+                        point = (f"{base_date}T{minute}", float(value))
                     else:
                         print(f"[WARNING] Missing value for active_zone_minute at {base_date} {minute}")
+                        continue
                 except Exception as e:
                     print(f"[WARNING] Skipping active_zone_minute entry: {e}")
                     continue
 
-    print(f"[INFO] Parsed {len(records)} records for active_zone_minute")
-    return records
+                yield point
 
-def normalize_activity(raw_list: List[Dict]) -> List[Dict]:
-    records = []
+
+def activity_points(raw_list: List[Dict]) -> Iterator[Tuple[str, float]]:
     for entry in raw_list:
         try:
             date = entry["dateTime"]
             value = entry["value"]
-
-            record = {
-                "user_id": USER_ID,
-                "metric": "activity",
-                "timestamp": f"{date}T00:00:00",
-                "value": float(value)
-            }
-            records.append(record)
+            point = (f"{date}T00:00:00", float(value))
         except Exception as e:
             print(f"[WARNING] Skipping invalid activity entry: {e}")
             continue
 
+        yield point
+
+
+# Raw metric -> (stored metric name, parser)
+PARSERS = {
+    "intraday_heart_rate": ("heart_rate", intraday_points),
+    "intraday_spo2": ("spo2", spo2_points),
+    "intraday_activity": ("activity", activity_points),
+    "intraday_breath_rate": ("breath_rate", breath_rate_points),
+    "intraday_hrv": ("hrv", hrv_points),
+    "intraday_active_zone_minute": ("active_zone_minute", active_zone_minute_points),
+}
+
+
+def _records(metric: str, points: Iterator[Tuple[str, float]], user_id: str) -> Iterator[Dict]:
+    for timestamp, value in points:
+        yield {
+            "user_id": user_id,
+            "metric": metric,
+            "timestamp": timestamp,
+            "value": value
+        }
+
+
+def iter_intraday(metric: str, raw_list: List[Dict], user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records(metric, intraday_points(raw_list), user_id)
+
+
+def normalize_intraday(metric: str, raw_list: List[Dict]) -> List[Dict]:
+    records = list(iter_intraday(metric, raw_list))
+    logging.debug(f"Total records created for {metric}: {len(records)}")
+    return records
+
+
+def iter_spo2(data, user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records("spo2", spo2_points(data), user_id)
+
+
+def normalize_spo2(data):
+    records = list(iter_spo2(data))
+    print(f"[INFO] Parsed {len(records)} records for spo2")
+    return records
+
+
+def iter_breath_rate(raw_list: List[Dict], user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records("breath_rate", breath_rate_points(raw_list), user_id)
+
+
+def normalize_breath_rate(raw_list: List[Dict]) -> List[Dict]:
+    records = list(iter_breath_rate(raw_list))
+    print(f"[INFO] Parsed {len(records)} records for breath_rate")
+    return records
+
+
+def iter_hrv(raw_list: List[Dict], user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records("hrv", hrv_points(raw_list), user_id)
+
+
+def normalize_hrv(raw_list: List[Dict]) -> List[Dict]:
+    records = list(iter_hrv(raw_list))
+    print(f"[INFO] Parsed {len(records)} records for hrv")
+    return records
+
+
+def iter_active_zone_minute(raw_list: List[Dict], user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records("active_zone_minute", active_zone_minute_points(raw_list), user_id)
+
+
+def normalize_active_zone_minute(raw_list: List[Dict]) -> List[Dict]:
+    records = list(iter_active_zone_minute(raw_list))
+    print(f"[INFO] Parsed {len(records)} records for active_zone_minute")
+    return records
+
+
+def iter_activity(raw_list: List[Dict], user_id: str = USER_ID) -> Iterator[Dict]:
+    return _records("activity", activity_points(raw_list), user_id)
+
+
+def normalize_activity(raw_list: List[Dict]) -> List[Dict]:
+    records = list(iter_activity(raw_list))
     print(f"[INFO] Parsed {len(records)} records for activity")
     return records
 
+
+def iter_records(metric: str, data, user_id: str = USER_ID) -> Optional[Iterator[Dict]]:
+    """Lazily normalize one raw metric payload; None for unknown metrics."""
+    if metric not in PARSERS:
+        return None
+    name, points = PARSERS[metric]
+    return _records(name, points(data), user_id)
+
+
+def fitbit_columns(metric: str, data) -> Optional[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Column-wise counterpart of iter_records: (metric name, ISO timestamps, float64 values)
+    for one raw payload from the same parsers, without building a dict per row. None for
+    unknown metrics.
+    """
+    if metric not in PARSERS:
+        return None
+    name, points = PARSERS[metric]
+    pairs = list(points(data))
+    if not pairs:
+        return name, np.array([], dtype=str), np.array([], dtype=np.float64)
+    timestamps, values = zip(*pairs)
+    return name, np.array(timestamps, dtype=str), np.array(values, dtype=np.float64)
+
+
+def record_batch(metric: str, data, user_id: str = USER_ID):
+    """One payload as a common.record_batch.RecordBatch (repo root on PYTHONPATH); None for unknown metrics."""
+    from common.record_batch import RecordBatch
+
+    columns = fitbit_columns(metric, data)
+    if columns is None:
+        return None
+    name, timestamps, values = columns
+    return RecordBatch.from_columns(user_id, name, timestamps, values)
+
+
 def clean_json(obj):
     if isinstance(obj, dict):
         return {k: clean_json(v) for k, v in obj.items()}
@@ -226,39 +330,22 @@ def clean_json(obj):
     return obj
 
 
-def save_json(records: List[Dict], filename: str):
-    with open(filename, 'w') as f:
-        json.dump(records, f, indent=2)
-    print(f"Saved {len(records)} records to {filename}")
-
-
-def run_extraction_pipeline():
+def run_extraction_pipeline(output_format: str = OUTPUT_FORMAT, chunk_size: int = CHUNK_SIZE):
     print("--- Fitbit Synthetic Data Extraction ---")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Choose one of {OUTPUT_FORMATS}")
     ensure_output_directory(OUTPUT_DIR)
 
     raw_data = extract_fitbit_data()
     for metric, data in raw_data.items():
         try:
             short_name = metric.replace("intraday_", "")
-            parsed = []
-
-            if metric == "intraday_heart_rate":
-                parsed = normalize_intraday("heart_rate", data)
-            elif metric == "intraday_spo2":
-                parsed = normalize_spo2(data)
-            elif metric == "intraday_activity":
-                parsed = normalize_activity(data)
-            elif metric == "intraday_breath_rate":
-                parsed = normalize_breath_rate(data)
-            elif metric == "intraday_hrv":
-                parsed = normalize_hrv(data)
-            elif metric == "intraday_active_zone_minute":
-                parsed = normalize_active_zone_minute(data)
-            else:
+            records = iter_records(metric, data)
+            if records is None:
                 print(f"[WARNING] Unknown metric {metric}. Skipping.")
                 continue
 
-            save_json(parsed, os.path.join(OUTPUT_DIR, f"{short_name}.json"))
+            save_records(records, output_format, OUTPUT_DIR, short_name, chunk_size)
 
         except Exception as e:
             print(f"[ERROR] Failed to save {metric}: {e}")
@@ -0,0 +1,149 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from extract import OUTPUT_DIR, SEED, START_DATE, END_DATE, ensure_output_directory, extract_fitbit_data, iter_records
+from writers import OUTPUT_FORMATS, DEFAULT_CHUNK_SIZE, save_records
+
+# Defaults for multi-participant generation; all overridable on the command line
+PARTICIPANTS = int(os.getenv("PARTICIPANTS", "10"))
+WINDOW_DAYS = int(os.getenv("WINDOW_DAYS", "31"))
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+
+
+def participant_id(index: int, total: int) -> str:
+    # participant 1 keeps the historical "synthetic_001" id
+    return f"synthetic_{index:0{max(3, len(str(total)))}d}"
+
+
+def participant_seed(base_seed: int, index: int, window: int) -> int:
+    """Deterministic, well-spread seed for one (participant, date window) task."""
+    return int(np.random.SeedSequence([base_seed, index, window]).generate_state(1)[0])
+
+
+def split_date_range(start_date: str, end_date: str, window_days: int) -> List[Tuple[str, str]]:
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    if end < start:
+        raise ValueError(f"end date {end_date} is before start date {start_date}")
+
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=window_days - 1), end)
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def generate_shard(task: Dict) -> Dict:
+    """Generate and write one participant's data for one date window (runs in a worker process)."""
+    started = time.perf_counter()
+    raw_data = extract_fitbit_data(task["seed"], task["start_date"], task["end_date"])
+
+    directory = os.path.join(task["output_dir"], task["user_id"])
+    os.makedirs(directory, exist_ok=True)
+
+    rows = 0
+    for metric, data in raw_data.items():
+        records = iter_records(metric, data, task["user_id"])
+        if records is None:
+            print(f"[WARNING] Unknown metric {metric}. Skipping.")
+            continue
+        name = f"{metric.replace('intraday_', '')}-{task['start_date']}"
+        rows += save_records(records, task["output_format"], directory, name, task["chunk_size"])
+
+    return {
+        "user_id": task["user_id"],
+        "start_date": task["start_date"],
+        "rows": rows,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def build_tasks(participants: int, start_date: str, end_date: str, window_days: int, base_seed: int,
+                output_dir: str, output_format: str, chunk_size: int) -> List[Dict]:
+    windows = split_date_range(start_date, end_date, window_days)
+    tasks = []
+    for index in range(1, participants + 1):
+        user_id = participant_id(index, participants)
+        for window, (window_start, window_end) in enumerate(windows):
+            tasks.append({
+                "user_id": user_id,
+                "seed": participant_seed(base_seed, index, window),
+                "start_date": window_start,
+                "end_date": window_end,
+                "output_dir": output_dir,
+                "output_format": output_format,
+                "chunk_size": chunk_size,
+            })
+    return tasks
+
+
+def run_generation(participants: int = PARTICIPANTS, start_date: str = START_DATE, end_date: str = END_DATE,
+                   window_days: int = WINDOW_DAYS, workers: int = WORKERS, base_seed: int = SEED,
+                   output_dir: str = OUTPUT_DIR, output_format: str = "ndjson",
+                   chunk_size: int = DEFAULT_CHUNK_SIZE):
+    print("--- Fitbit Synthetic Multi-Participant Generation ---")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Choose one of {OUTPUT_FORMATS}")
+    ensure_output_directory(output_dir)
+
+    tasks = build_tasks(participants, start_date, end_date, window_days, base_seed,
+                        output_dir, output_format, chunk_size)
+    print(f"Generating {len(tasks)} shard(s) for {participants} participant(s) on {workers} worker(s)")
+
+    started = time.perf_counter()
+    total_rows = 0
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_shard, task): task for task in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            task = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[ERROR] {task['user_id']} {task['start_date']}..{task['end_date']} failed: {e}")
+                continue
+            total_rows += result["rows"]
+            print(f"[{done}/{len(tasks)}] {result['user_id']} {result['start_date']}: "
+                  f"{result['rows']} rows in {result['seconds']:.1f}s")
+
+    elapsed = time.perf_counter() - started
+    print(f"Generated {total_rows:,} rows in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):,.0f} rows/s), {failures} failed shard(s)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate sharded synthetic Fitbit data for many participants.")
+    parser.add_argument("--participants", type=int, default=PARTICIPANTS)
+    parser.add_argument("--start-date", default=START_DATE)
+    parser.add_argument("--end-date", default=END_DATE)
+    parser.add_argument("--window-days", type=int, default=WINDOW_DAYS,
+                        help="Split each participant's range into windows of this many days")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--seed", type=int, default=SEED, help="Base seed; per-shard seeds derive from it")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--format", dest="output_format", default="ndjson", choices=OUTPUT_FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_generation(
+        participants=args.participants,
+        start_date=args.start_date,
+        end_date=args.end_date,
+        window_days=args.window_days,
+        workers=args.workers,
+        base_seed=args.seed,
+        output_dir=args.output_dir,
+        output_format=args.output_format,
+        chunk_size=args.chunk_size,
+    )
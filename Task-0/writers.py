@@ -0,0 +1,142 @@
+import json
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+# Supported on-disk formats for normalized records
+OUTPUT_FORMATS = ("json", "ndjson", "npy", "parquet")
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+def _json_default(obj):
+    # NumPy scalars leak through from the simulator (e.g. spo2 values)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def iter_chunks(records: Iterable[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunk_to_columns(chunk: List[Dict]) -> Dict[str, np.ndarray]:
+    """Convert a list of record dicts into int64 epoch-second / float64 arrays."""
+    timestamps = np.array([r["timestamp"] for r in chunk], dtype="datetime64[ms]")
+    return {
+        "timestamp": timestamps.astype("datetime64[s]").astype(np.int64),
+        "value": np.array([float(r["value"]) for r in chunk], dtype=np.float64),
+    }
+
+
+def shard_name(name: str, index: int, suffix: str) -> str:
+    return f"{name}-{index:05d}{suffix}"
+
+
+def write_index(directory: str, name: str, fmt: str, shards: List[Dict]):
+    """Small sidecar describing the shards so loaders never have to list the directory."""
+    index_path = os.path.join(directory, f"{name}.{fmt}.index")
+    with open(index_path, "w") as f:
+        json.dump({"format": fmt, "name": name, "shards": shards}, f)
+
+
+def save_json_array(records: Iterable[Dict], directory: str, name: str, chunk_size: int) -> int:
+    # Legacy single-file output; materializes everything, kept for compatibility
+    records = list(records)
+    filename = os.path.join(directory, f"{name}.json")
+    with open(filename, "w") as f:
+        json.dump(records, f, indent=2, default=_json_default)
+    print(f"Saved {len(records)} records to {filename}")
+    return len(records)
+
+
+def save_ndjson(records: Iterable[Dict], directory: str, name: str, chunk_size: int) -> int:
+    total = 0
+    shards = []
+    for i, chunk in enumerate(iter_chunks(records, chunk_size)):
+        filename = shard_name(name, i, ".ndjson")
+        with open(os.path.join(directory, filename), "w") as f:
+            f.writelines(
+                json.dumps(rec, separators=(",", ":"), default=_json_default) + "\n"
+                for rec in chunk
+            )
+        shards.append({"file": filename, "rows": len(chunk)})
+        total += len(chunk)
+
+    write_index(directory, name, "ndjson", shards)
+    print(f"Saved {total} records to {len(shards)} NDJSON shard(s) for {name}")
+    return total
+
+
+def save_npy(records: Iterable[Dict], directory: str, name: str, chunk_size: int) -> int:
+    """
+    One pair of .npy files (timestamp, value) per shard. Files can be opened with
+    np.load(path, mmap_mode="r") so readers only page in what they touch.
+    """
+    total = 0
+    shards = []
+    for i, chunk in enumerate(iter_chunks(records, chunk_size)):
+        columns = chunk_to_columns(chunk)
+        shard = {
+            "user_id": chunk[0]["user_id"],
+            "metric": chunk[0]["metric"],
+            "rows": len(chunk),
+        }
+        for column, array in columns.items():
+            filename = shard_name(name, i, f".{column}.npy")
+            np.save(os.path.join(directory, filename), array)
+            shard[column] = filename
+        shards.append(shard)
+        total += len(chunk)
+
+    write_index(directory, name, "npy", shards)
+    print(f"Saved {total} records to {len(shards)} NumPy shard(s) for {name}")
+    return total
+
+
+def save_parquet(records: Iterable[Dict], directory: str, name: str, chunk_size: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Please install pyarrow using: pip install pyarrow")
+
+    total = 0
+    shards = []
+    for i, chunk in enumerate(iter_chunks(records, chunk_size)):
+        columns = chunk_to_columns(chunk)
+        table = pa.table({
+            "user_id": pa.array([r["user_id"] for r in chunk]).dictionary_encode(),
+            "metric": pa.array([r["metric"] for r in chunk]).dictionary_encode(),
+            "timestamp": pa.array(columns["timestamp"], type=pa.timestamp("s")),
+            "value": pa.array(columns["value"], type=pa.float64()),
+        })
+        filename = shard_name(name, i, ".parquet")
+        pq.write_table(table, os.path.join(directory, filename), compression="zstd")
+        shards.append({"file": filename, "rows": len(chunk)})
+        total += len(chunk)
+
+    write_index(directory, name, "parquet", shards)
+    print(f"Saved {total} records to {len(shards)} Parquet shard(s) for {name}")
+    return total
+
+
+SAVERS = {
+    "json": save_json_array,
+    "ndjson": save_ndjson,
+    "npy": save_npy,
+    "parquet": save_parquet,
+}
+
+
+def save_records(records: Iterable[Dict], fmt: str, directory: str, name: str,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    if fmt not in SAVERS:
+        raise ValueError(f"Unsupported output format '{fmt}'. Choose one of {OUTPUT_FORMATS}")
+    return SAVERS[fmt](records, directory, name, chunk_size)
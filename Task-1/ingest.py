@@ -1,7 +1,20 @@
 import os
 import json
+import queue
+import threading
+import time
+from itertools import islice
 import psycopg2
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from common.checkpoint import ChunkTracker, begin_file, create_manifest_table, save_checkpoint
+from common.instrumentation import LoaderMetrics, push_metrics, serve_metrics
+from common.notify import notify_ingest
+from common.record_batch import RecordBatch
+from common.rollups import RollupRefresher, plain_rollups, upsert_partials
+from common.series_ids import SeriesIds, check_keyed_table, create_lookup_tables
+from common.sketches import merge_sketches
 
 # Constants from environment or defaults
 DB_NAME = os.getenv("POSTGRES_DB", "wearipedia")
@@ -12,6 +25,30 @@ DB_PORT = os.getenv("TSDB_PORT", "5432")
 DATA_DIR = os.getenv("EXTRACTED_DIR", "./extracted_data")
 
 RAW_TABLE = "raw_data"
+STAGING_TABLE = "raw_data_staging"
+# Name under which this loader's progress is kept in the ingest manifest
+LOADER_NAME = "ingest"
+METRICS = LoaderMetrics(LOADER_NAME)
+
+# "insert" uses execute_values; "copy" streams binary COPY chunks through a staging table
+LOAD_MODE = os.getenv("LOAD_MODE", "insert")
+COPY_CHUNK_SIZE = int(os.getenv("COPY_CHUNK_SIZE", "50000"))
+REQUIRED_KEYS = ("user_id", "metric", "timestamp", "value")
+
+# Every row this loader inserts is merged into data_1m/1h/1d, as ingestion_update and the
+# Kafka worker do, so the rollups are complete whichever writer stored a row first.
+# "auto" skips rollups that are continuous aggregates (Task-3/continuous_aggregates.sql);
+# "continuous" skips all of them.
+ROLLUP_MODE = os.getenv("ROLLUP_MODE", "auto")
+# Quantile sketches (Task-3/sketches.sql) are merged the same way once the tables exist;
+# SKETCHES=0 skips them
+SKETCHES = os.getenv("SKETCHES", "1") == "1"
+
+# Concurrent engine: >1 worker switches ingest_all to pooled, queue-fed loading
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+QUEUE_CHUNKS = int(os.getenv("QUEUE_CHUNKS", str(2 * INGEST_WORKERS)))
+# Skip finished files and resume partial ones from the ingest manifest; RESUME=0 forces a full pass
+RESUME = os.getenv("RESUME", "1") == "1"
 
 def connect_db():
     return psycopg2.connect(
@@ -22,63 +59,367 @@ def connect_db():
         port=DB_PORT,
     )
 
+# user/metric name -> integer key cache, shared by the loader threads; new names are
+# committed on its own connection
+IDS = SeriesIds(connect_db)
+# Range this run wrote, refreshed into the rollups that are continuous aggregates
+ROLLUP_REFRESH = RollupRefresher(connect_db)
+
 def create_table():
     query = f"""
     CREATE TABLE IF NOT EXISTS {RAW_TABLE} (
-        user_id TEXT NOT NULL,
-        metric TEXT NOT NULL,
+        user_key INTEGER NOT NULL,
+        metric_key SMALLINT NOT NULL,
         timestamp TIMESTAMPTZ NOT NULL,
         value DOUBLE PRECISION,
-        PRIMARY KEY (user_id, metric, timestamp)
+        PRIMARY KEY (user_key, metric_key, timestamp)
     );
     """
     with connect_db() as conn:
         with conn.cursor() as cur:
+            create_lookup_tables(cur)
             cur.execute(query)
+            check_keyed_table(cur, RAW_TABLE)
+            create_manifest_table(cur)
             conn.commit()
 
-def insert_records(records):
-    if not records:
+def merge_aggregates(cur, inserted):
+    """Fold rows new to raw_data (user_key, metric_key, timestamp, value) into the rollup and sketch tables."""
+    if not inserted:
         return
+    ROLLUP_REFRESH.add_rows(inserted)
+    with METRICS.stage("rollup"):
+        batch = RecordBatch.from_rows(inserted)
+        for table, width in plain_rollups(cur, ROLLUP_MODE).items():
+            upsert_partials(cur, table, batch.partials(width))
+    if SKETCHES:
+        with METRICS.stage("sketch"):
+            merge_sketches(cur, IDS.decode(batch))
+
+
+def refresh_rollups():
+    """Materialize what this run wrote into continuous-aggregate rollups, once committed."""
+    try:
+        with METRICS.stage("rollup"):
+            ROLLUP_REFRESH.refresh()
+    except psycopg2.Error as e:
+        print(f"[WARNING] Could not refresh continuous aggregates (retried on the next refresh): {e}")
+
+
+def insert_records(records, conn=None, before_commit=None):
+    """Insert records in one transaction; returns how many were new to raw_data."""
+    if not records:
+        return 0
 
     query = f"""
-    INSERT INTO {RAW_TABLE} (user_id, metric, timestamp, value)
+    INSERT INTO {RAW_TABLE} (user_key, metric_key, timestamp, value)
     VALUES %s
-    ON CONFLICT (user_id, metric, timestamp) DO NOTHING;
+    ON CONFLICT (user_key, metric_key, timestamp) DO NOTHING
+    RETURNING user_key, metric_key, timestamp, value;
     """
-    values = [
-        (rec["user_id"], rec["metric"], rec["timestamp"], rec["value"])
-        for rec in records
-        if all(k in rec for k in ["user_id", "metric", "timestamp", "value"])
-    ]
+    started = time.perf_counter()
+    with METRICS.stage("normalize"):
+        valid = [rec for rec in records if all(k in rec for k in REQUIRED_KEYS)]
+    with METRICS.stage("batch_build"):
+        batch = RecordBatch.from_records(valid)
+        ranges = batch.series_ranges()
 
-    with connect_db() as conn:
+    owns_conn = conn is None
+    if owns_conn:
+        conn = connect_db()
+    try:
+        with METRICS.stage("batch_build"):
+            values = IDS.encode(batch).rows()
         with conn.cursor() as cur:
-            execute_values(cur, query, values)
+            with METRICS.stage("db_write"):
+                # RETURNING yields the rows actually inserted across every page
+                inserted = execute_values(cur, query, values, fetch=True)
+                written = len(inserted)
+                notify_ingest(cur, ranges)
+            merge_aggregates(cur, inserted)
+            with METRICS.stage("db_write"):
+                if before_commit is not None:
+                    before_commit(cur)
+        with METRICS.stage("commit"):
             conn.commit()
+    finally:
+        if owns_conn:
+            conn.close()
+    METRICS.batch(len(records), written, len(records) - len(valid), time.perf_counter() - started)
+    return written
 
-def ingest_all():
-    print("-- Ingestion Started --")
-    create_table()
+def create_staging_table(cur):
+    # Temp tables are never WAL-logged (like UNLOGGED) and private to the session,
+    # so concurrent loaders can't merge each other's half-written chunks.
+    cur.execute(f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+        user_key INTEGER,
+        metric_key SMALLINT,
+        timestamp TIMESTAMPTZ,
+        value DOUBLE PRECISION
+    ) ON COMMIT DELETE ROWS;
+    """)
 
-    for filename in os.listdir(DATA_DIR):
-        if not filename.endswith(".json"):
-            continue
 
-        filepath = os.path.join(DATA_DIR, filename)
-        try:
-            with open(filepath, "r") as f:
-                data = json.load(f)
+def copy_records(records, chunk_size=COPY_CHUNK_SIZE, conn=None, before_commit=None):
+    """
+    Stream records into raw_data in bounded chunks: binary COPY into the staging
+    table, then merge with the same ON CONFLICT DO NOTHING semantics as insert_records.
+    `before_commit(cur, rows_read)` runs inside each chunk's transaction.
+    Returns (rows_read, rows_inserted).
+    """
+    merge = f"""
+    INSERT INTO {RAW_TABLE} (user_key, metric_key, timestamp, value)
+    SELECT user_key, metric_key, timestamp, value FROM {STAGING_TABLE}
+    ON CONFLICT (user_key, metric_key, timestamp) DO NOTHING
+    RETURNING user_key, metric_key, timestamp, value;
+    """
+    records = iter(records)
+    rows_read = rows_inserted = 0
+
+    owns_conn = conn is None
+    if owns_conn:
+        conn = connect_db()
+    try:
+        with conn.cursor() as cur:
+            create_staging_table(cur)
+            while True:
+                started = time.perf_counter()
+                with METRICS.stage("parse"):
+                    chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                rows_read += len(chunk)
+                with METRICS.stage("normalize"):
+                    valid = [rec for rec in chunk if all(k in rec for k in REQUIRED_KEYS)]
+                written = 0
+                if valid:
+                    with METRICS.stage("batch_build"):
+                        batch = RecordBatch.from_records(valid)
+                        payload = IDS.encode(batch).copy_binary()
+                    with METRICS.stage("db_write"):
+                        cur.copy_expert(
+                            f"COPY {STAGING_TABLE} (user_key, metric_key, timestamp, value) FROM STDIN WITH (FORMAT binary)",
+                            payload,
+                        )
+                        cur.execute(merge)
+                        inserted = cur.fetchall()
+                        written = len(inserted)
+                        notify_ingest(cur, batch.series_ranges())
+                    merge_aggregates(cur, inserted)
+                if before_commit is not None:
+                    before_commit(cur, rows_read)
+                # Commit per chunk; ON COMMIT DELETE ROWS empties the staging table
+                with METRICS.stage("commit"):
+                    conn.commit()
+                rows_inserted += written
+                METRICS.batch(len(chunk), written, len(chunk) - len(valid), time.perf_counter() - started)
+    finally:
+        if owns_conn:
+            conn.close()
+    return rows_read, rows_inserted
+
+
+def iter_file_records(filepath):
+    """Yield records from a JSON array file or, without loading it whole, an NDJSON shard."""
+    with open(filepath, "r") as f:
+        if filepath.endswith(".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        data = json.load(f)
+    if not (isinstance(data, list) and all(isinstance(item, dict) for item in data)):
+        raise ValueError("unsupported structure")
+    yield from data
+
+
+def iter_data_files(data_dir):
+    # Recursive so per-participant shard directories from Task-0 are picked up too
+    for root, _, files in os.walk(data_dir):
+        for filename in sorted(files):
+            if filename.endswith((".json", ".ndjson")):
+                yield os.path.join(root, filename)
+
+
+def start_file(conn, filepath):
+    """Look up where to resume `filepath`; returns (manifest path, offset or None if done)."""
+    path = os.path.relpath(filepath, DATA_DIR)
+    if not RESUME:
+        return path, 0
+    with conn.cursor() as cur:
+        offset = begin_file(cur, LOADER_NAME, path, filepath)
+    conn.commit()
+    return path, offset
 
-            if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-                print(f"Processing {filename}...")
-                insert_records(data)
+
+def mark_checkpoint(conn, path, committed_rows, done):
+    with conn.cursor() as cur:
+        save_checkpoint(cur, LOADER_NAME, path, committed_rows, done)
+    conn.commit()
+
+
+def ingest_worker(work, pool, stats, lock, tracker):
+    """Drain (path, start_row, chunk) items from the queue, loading each on a pooled connection."""
+    while True:
+        item = work.get()
+        if item is None:
+            work.task_done()
+            return
+
+        path, start, chunk = item
+        conn = pool.getconn()
+        try:
+            if LOAD_MODE == "copy":
+                _, written = copy_records(chunk, len(chunk), conn)
             else:
-                print(f"Skipping {filename} (unsupported structure)")
+                written = insert_records(chunk, conn)
+            # Only advance the checkpoint after the chunk is durable; chunks commit out of
+            # order, so a crash can replay a committed chunk (dropped by ON CONFLICT) but never skip one.
+            offset, done = tracker.commit(path, start, start + len(chunk))
+            mark_checkpoint(conn, path, offset, done)
+            with lock:
+                stats["rows"] += len(chunk)
+                stats["written"] += written
+                stats["chunks"] += 1
         except Exception as e:
-            print(f"Error processing {filename}: {e}")
+            conn.rollback()
+            with lock:
+                stats["failed_chunks"] += 1
+            print(f"Error loading chunk from {path}: {e}")
+        finally:
+            pool.putconn(conn)
+            work.task_done()
+
+
+def ingest_concurrent(workers=INGEST_WORKERS, chunk_size=COPY_CHUNK_SIZE, queue_chunks=QUEUE_CHUNKS):
+    """
+    Parse files on the calling thread and fan chunks out to `workers` loader threads,
+    each holding one connection from a shared pool. The bounded queue applies
+    backpressure so parsing never runs more than `queue_chunks` chunks ahead.
+    """
+    # One extra connection for the parsing thread's manifest lookups
+    pool = ThreadedConnectionPool(
+        1, workers + 1,
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT,
+    )
+    work = queue.Queue(maxsize=queue_chunks)
+    stats = {"files": 0, "skipped_files": 0, "rows": 0, "written": 0, "chunks": 0, "failed_chunks": 0}
+    lock = threading.Lock()
+    tracker = ChunkTracker()
+    threads = [
+        threading.Thread(target=ingest_worker, args=(work, pool, stats, lock, tracker), daemon=True)
+        for _ in range(workers)
+    ]
+    for t in threads:
+        t.start()
+
+    started = time.perf_counter()
+    manifest_conn = pool.getconn()
+    try:
+        for filepath in iter_data_files(DATA_DIR):
+            try:
+                path, offset = start_file(manifest_conn, filepath)
+                if offset is None:
+                    stats["skipped_files"] += 1
+                    continue
+                print(f"Processing {path}" + (f" from row {offset}..." if offset else "..."))
+
+                tracker.start(path, offset)
+                records = islice(iter_file_records(filepath), offset, None)
+                position = offset
+                while True:
+                    with METRICS.stage("parse"):
+                        chunk = list(islice(records, chunk_size))
+                    if not chunk:
+                        break
+                    work.put((path, position, chunk))
+                    position += len(chunk)
+
+                # If the workers already committed every chunk, nobody else will mark the file done
+                committed, done = tracker.finish(path, position)
+                if done:
+                    mark_checkpoint(manifest_conn, path, committed, done)
+                stats["files"] += 1
+            except Exception as e:
+                manifest_conn.rollback()
+                print(f"Error processing {filepath}: {e}")
+    finally:
+        for _ in threads:
+            work.put(None)
+        for t in threads:
+            t.join()
+        pool.putconn(manifest_conn)
+        pool.closeall()
+    refresh_rollups()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Ingested {stats['files']} file(s) ({stats['skipped_files']} already complete), "
+        f"{stats['rows']:,} rows in {stats['chunks']} chunk(s) "
+        f"with {workers} worker(s): {stats['written']:,} written, {stats['failed_chunks']} failed chunk(s), "
+        f"{elapsed:.2f}s ({stats['rows'] / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+    return stats
+
+
+def ingest_file(conn, filepath):
+    path, offset = start_file(conn, filepath)
+    if offset is None:
+        print(f"Skipping {path} (already ingested)")
+        return
+    print(f"Processing {path}" + (f" from row {offset}..." if offset else "..."))
+
+    records = islice(iter_file_records(filepath), offset, None)
+    if LOAD_MODE == "copy":
+        started = time.perf_counter()
+        # The checkpoint commits in the same transaction as each chunk
+        rows_read, rows_inserted = copy_records(
+            records, conn=conn,
+            before_commit=lambda cur, rows: save_checkpoint(cur, LOADER_NAME, path, offset + rows),
+        )
+        mark_checkpoint(conn, path, offset + rows_read, True)
+        elapsed = time.perf_counter() - started
+        print(f"Loaded {path}: {rows_inserted}/{rows_read} rows inserted "
+              f"in {elapsed:.2f}s ({rows_read / max(elapsed, 1e-9):,.0f} rows/s)")
+    else:
+        with METRICS.stage("parse"):
+            data = list(records)
+        if data:
+            insert_records(
+                data, conn,
+                before_commit=lambda cur: save_checkpoint(cur, LOADER_NAME, path, offset + len(data), True),
+            )
+        else:
+            mark_checkpoint(conn, path, offset, True)
+
+
+def ingest_all():
+    print(f"-- Ingestion Started ({LOAD_MODE} mode) --")
+    create_table()
+
+    if INGEST_WORKERS > 1:
+        ingest_concurrent()
+        push_metrics(LOADER_NAME)
+        print("-- Ingestion Complete --")
+        return
+
+    conn = connect_db()
+    try:
+        for filepath in iter_data_files(DATA_DIR):
+            try:
+                ingest_file(conn, filepath)
+            except Exception as e:
+                conn.rollback()
+                print(f"Error processing {os.path.relpath(filepath, DATA_DIR)}: {e}")
+            refresh_rollups()
+    finally:
+        conn.close()
 
+    push_metrics(LOADER_NAME)
     print("-- Ingestion Complete --")
 
 if __name__ == "__main__":
+    serve_metrics()
     ingest_all()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+# Result cache settings
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # "memory", "redis" or "none"
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Raw data changes often; rollups for past ranges only change when ingest says so
+CACHE_TTL_SECONDS = {
+    "raw_data": int(os.getenv("CACHE_TTL_RAW", "30")),
+    "data_1m": int(os.getenv("CACHE_TTL_1M", "300")),
+    "data_1h": int(os.getenv("CACHE_TTL_1H", "3600")),
+    "data_1d": int(os.getenv("CACHE_TTL_1D", "86400")),
+}
+# Must match the channel the loaders NOTIFY on (common/notify.py)
+INGEST_CHANNEL = os.getenv("INGEST_CHANNEL", "data_ingested")
+# The LISTEN connection is checked this often; after losing it, reconnects back off
+# exponentially from LISTEN_RETRY_SECONDS up to LISTEN_RETRY_MAX_SECONDS
+LISTEN_PING_SECONDS = float(os.getenv("LISTEN_PING_SECONDS", "10"))
+LISTEN_RETRY_SECONDS = float(os.getenv("LISTEN_RETRY_SECONDS", "1"))
+LISTEN_RETRY_MAX_SECONDS = float(os.getenv("LISTEN_RETRY_MAX_SECONDS", "60"))
+
+Series = Tuple[str, str]
+
+
+def cache_key(table: str, user_id: str, metric: str, start: datetime, end: datetime, *extra) -> str:
+    return "|".join([table, user_id, metric, start.isoformat(), end.isoformat(), *map(str, extra)])
+
+
+def _overlaps(start: datetime, end: datetime, written_start: datetime, written_end: datetime) -> bool:
+    return start <= written_end and written_start <= end
+
+
+class MemoryCache:
+    """In-process LRU bounded by total payload bytes, with a TTL per entry."""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, float, Series]]" = OrderedDict()
+        # series -> {key: (start, end)} so invalidation never scans the whole cache
+        self._ranges: Dict[Series, Dict[str, Tuple[datetime, datetime]]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        body, expires, _ = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    async def set(self, key: str, body: bytes, ttl: int, series: Series, start: datetime, end: datetime):
+        if len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (body, time.monotonic() + ttl, series)
+        self._ranges.setdefault(series, {})[key] = (start, end)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    async def invalidate(self, series: Series, start: datetime, end: datetime) -> int:
+        stale = [
+            key for key, (key_start, key_end) in self._ranges.get(series, {}).items()
+            if _overlaps(key_start, key_end, start, end)
+        ]
+        for key in stale:
+            self._remove(key)
+        return len(stale)
+
+    async def clear(self):
+        self._entries.clear()
+        self._ranges.clear()
+        self.size = 0
+
+    def _remove(self, key: str):
+        body, _, series = self._entries.pop(key)
+        self.size -= len(body)
+        ranges = self._ranges.get(series)
+        if ranges is not None:
+            ranges.pop(key, None)
+            if not ranges:
+                del self._ranges[series]
+
+
+class RedisCache:
+    """Same interface backed by a local Redis-compatible server, shared across API processes."""
+
+    PREFIX = "pulseforge:data:"
+
+    def __init__(self, url: str = CACHE_REDIS_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ImportError("Please install redis using: pip install redis")
+        self.client = redis.from_url(url)
+
+    def _series_key(self, series: Series) -> str:
+        return f"{self.PREFIX}series:{series[0]}|{series[1]}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.PREFIX + key)
+
+    async def set(self, key: str, body: bytes, ttl: int, series: Series, start: datetime, end: datetime):
+        # Redis enforces the memory bound itself (maxmemory + an LRU policy)
+        index = self._series_key(series)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self.PREFIX + key, body, ex=ttl)
+            pipe.hset(index, key, f"{start.isoformat()}|{end.isoformat()}")
+            pipe.expire(index, max(CACHE_TTL_SECONDS.values()))
+            await pipe.execute()
+
+    async def invalidate(self, series: Series, start: datetime, end: datetime) -> int:
+        index = self._series_key(series)
+        stale = []
+        for key, bounds in (await self.client.hgetall(index)).items():
+            key_start, key_end = (datetime.fromisoformat(b) for b in bounds.decode().split("|"))
+            if _overlaps(key_start, key_end, start, end):
+                stale.append(key.decode())
+        if stale:
+            await self.client.delete(*(self.PREFIX + key for key in stale))
+            await self.client.hdel(index, *stale)
+        return len(stale)
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=self.PREFIX + "*", count=1000)]
+        for i in range(0, len(keys), 1000):
+            await self.client.delete(*keys[i:i + 1000])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_cache():
+    if CACHE_BACKEND == "redis":
+        return RedisCache()
+    if CACHE_BACKEND == "memory":
+        return MemoryCache()
+    return None
+
+
+def _parse_timestamp(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+async def listen_for_ingest(cache, connect):
+    """
+    Invalidate cached results overlapping each range the loaders announce via NOTIFY,
+    on a dedicated connection from `connect()`, for as long as the task runs. A lost
+    connection is re-opened with backoff, and the cache is flushed once listening
+    again, since notifications sent in between are gone. Entries also expire by TTL.
+    """
+    def on_notify(connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+            series = (event["user_id"], event["metric"])
+            # Widen to the enclosing day: a write changes the whole rollup bucket it lands
+            # in, and a cached range can end at the start of that bucket
+            start = _parse_timestamp(event["start"]).replace(hour=0, minute=0, second=0, microsecond=0)
+            end = _parse_timestamp(event["end"])
+        except (ValueError, KeyError) as e:
+            logging.warning(f"Ignoring malformed ingest notification {payload!r}: {e}")
+            return
+        asyncio.get_running_loop().create_task(cache.invalidate(series, start, end))
+
+    delay, listened = LISTEN_RETRY_SECONDS, False
+    while True:
+        conn = None
+        try:
+            conn = await connect()
+            await conn.add_listener(INGEST_CHANNEL, on_notify)
+            if listened:
+                await cache.clear()
+                logging.warning("Ingest listener reconnected; flushed the result cache")
+            listened, delay = True, LISTEN_RETRY_SECONDS
+            # Notifications arrive on their own; the ping only detects a dead connection
+            while True:
+                await asyncio.sleep(LISTEN_PING_SECONDS)
+                await conn.execute("SELECT 1", timeout=LISTEN_PING_SECONDS)
+        except Exception as e:
+            logging.warning(f"Ingest listener not connected, retrying in {delay:g}s: {e}")
+        finally:
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LISTEN_RETRY_MAX_SECONDS)
@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from common.sketches import POPULATION
+from .profiling import phase, record_query
+
+# DB Config
+DB_CONFIG = {
+    "host": os.getenv("TSDB_HOST", "localhost"),
+    "port": int(os.getenv("TSDB_PORT", "5432")),
+    "database": os.getenv("POSTGRES_DB", "wearipedia"),
+    "user": os.getenv("POSTGRES_USER", "wearipedia_user"),
+    "password": os.getenv("POSTGRES_PASSWORD", "19768003"),
+}
+
+# Pool sizing and per-statement limits
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "5000"))
+# Rows fetched per round trip when streaming exports from a server-side cursor
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "10000"))
+
+# Rollup tables store the bucket mean as avg_value
+VALUE_COLUMNS = {
+    "raw_data": "value",
+    "data_1m": "avg_value",
+    "data_1h": "avg_value",
+    "data_1d": "avg_value",
+}
+
+# raw_data and the rollups are keyed by integer ids from the users / metrics lookup
+# tables (Task-3/hypertables.sql); names are resolved once per request and cached here.
+# Ids are never reassigned, so entries never go stale. Unknown names are not cached.
+LOOKUP_TABLES = ("users", "metrics")
+SERIES_IDS: Dict[str, Dict[str, int]] = {table: {} for table in LOOKUP_TABLES}
+ID_QUERIES = {table: f"SELECT name, id FROM {table} WHERE name = ANY($1::text[]);" for table in LOOKUP_TABLES}
+
+# One fixed statement per table; asyncpg prepares each on first use per connection
+# and reuses it from the connection's statement cache afterwards.
+SERIES_QUERIES = {
+    table: f"""
+    SELECT timestamp, {column} AS value
+    FROM {table}
+    WHERE user_key = $1 AND metric_key = $2
+    AND timestamp BETWEEN $3 AND $4
+    ORDER BY timestamp;
+    """
+    for table, column in VALUE_COLUMNS.items()
+}
+
+
+# Cohort variant: every (user, metric) pair in one set-based query per table
+BATCH_QUERIES = {
+    table: f"""
+    SELECT user_key, metric_key, timestamp, {column} AS value
+    FROM {table}
+    WHERE user_key = ANY($1::int[]) AND metric_key = ANY($2::smallint[])
+    AND timestamp BETWEEN $3 AND $4
+    ORDER BY user_key, metric_key, timestamp;
+    """
+    for table, column in VALUE_COLUMNS.items()
+}
+
+
+# Quantile sketch tables (Task-3/sketches.sql) by resolution
+SKETCH_TABLES = {"1h": "sketch_1h", "1d": "sketch_1d"}
+# Whole population: one precomputed row per bucket, independent of cohort size
+POPULATION_SKETCH_QUERIES = {
+    table: f"""
+    SELECT timestamp, count_value, bins
+    FROM {table}
+    WHERE user_id = $1 AND metric = $2
+    AND timestamp BETWEEN $3 AND $4
+    ORDER BY timestamp;
+    """
+    for table in SKETCH_TABLES.values()
+}
+# Explicit cohort: per-user sketches merged in the database, one row per bucket returned
+COHORT_SKETCH_QUERIES = {
+    table: f"""
+    SELECT timestamp, sum(count_value)::BIGINT AS count_value, sketch_union(bins) AS bins
+    FROM {table}
+    WHERE user_id = ANY($1::text[]) AND metric = $2
+    AND timestamp BETWEEN $3 AND $4
+    GROUP BY timestamp
+    ORDER BY timestamp;
+    """
+    for table in SKETCH_TABLES.values()
+}
+
+
+async def create_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        **DB_CONFIG,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        # Server-side limit, plus a client-side one slightly above it for dead connections
+        server_settings={"statement_timeout": str(STATEMENT_TIMEOUT_MS)},
+        command_timeout=STATEMENT_TIMEOUT_MS / 1000 + 1,
+    )
+
+
+@asynccontextmanager
+async def acquire(pool: asyncpg.Pool):
+    """pool.acquire(), with the wait for a connection timed as the request's "acquire" phase."""
+    with phase("acquire"):
+        conn = await pool.acquire()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def execute(conn, query: str, *args):
+    """Run a data query as the "execute" phase (round trip and result transfer), kept for the slow-query log."""
+    started = time.perf_counter()
+    with phase("execute"):
+        rows = await conn.fetch(query, *args)
+    record_query(query, args, time.perf_counter() - started)
+    return rows
+
+
+async def resolve_ids(pool: asyncpg.Pool, table: str, names) -> Dict[str, int]:
+    """name -> id for the `names` present in lookup `table`; a missing name has no data."""
+    cache = SERIES_IDS[table]
+    missing = [name for name in dict.fromkeys(names) if name not in cache]
+    if missing:
+        async with acquire(pool) as conn:
+            with phase("resolve"):
+                rows = await conn.fetch(ID_QUERIES[table], missing)
+        for name, id_ in rows:
+            cache[name] = id_
+    return {name: cache[name] for name in names if name in cache}
+
+
+async def series_key(pool: asyncpg.Pool, user_id: str, metric: str):
+    """(user_key, metric_key) of one series, or None if either name was never ingested."""
+    users = await resolve_ids(pool, "users", [user_id])
+    metrics = await resolve_ids(pool, "metrics", [metric])
+    if user_id not in users or metric not in metrics:
+        return None
+    return users[user_id], metrics[metric]
+
+
+async def fetch_series(pool: asyncpg.Pool, table: str, user_key: int, metric_key: int,
+                       start: datetime, end: datetime):
+    async with acquire(pool) as conn:
+        return await execute(conn, SERIES_QUERIES[table], user_key, metric_key, start, end)
+
+
+async def fetch_batch(pool: asyncpg.Pool, table: str, user_keys, metric_keys, start: datetime, end: datetime):
+    """Rows (user_key, metric_key, timestamp, value) for every pair, ordered by series."""
+    async with acquire(pool) as conn:
+        return await execute(conn, BATCH_QUERIES[table], list(user_keys), list(metric_keys), start, end)
+
+
+async def fetch_sketches(pool: asyncpg.Pool, table: str, metric: str, start: datetime, end: datetime,
+                         user_ids: Optional[List[str]] = None):
+    """(timestamp, count, bins) per bucket; the whole population unless user_ids is given."""
+    async with acquire(pool) as conn:
+        if user_ids is None:
+            rows = await execute(conn, POPULATION_SKETCH_QUERIES[table], POPULATION, metric, start, end)
+        else:
+            rows = await execute(conn, COHORT_SKETCH_QUERIES[table], list(user_ids), metric, start, end)
+    # asyncpg hands JSONB back as text
+    return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+
+async def stream_series(pool: asyncpg.Pool, table: str, user_key: int, metric_key: int,
+                        start: datetime, end: datetime, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Yield the series in fixed-size batches from a server-side cursor, so memory stays
+    bounded by one batch however large the range is. Holds a pooled connection until done.
+    Time spent waiting on the cursor is the request's "fetch" phase.
+    """
+    args = (user_key, metric_key, start, end)
+    fetching = 0.0
+    async with acquire(pool) as conn:
+        # Cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            with phase("execute"):
+                cursor = await conn.cursor(SERIES_QUERIES[table], *args)
+            while True:
+                started = time.perf_counter()
+                with phase("fetch"):
+                    batch = await cursor.fetch(batch_size)
+                fetching += time.perf_counter() - started
+                if not batch:
+                    break
+                yield batch
+    record_query(SERIES_QUERIES[table], args, fetching)
@@ -0,0 +1,65 @@
+import numpy as np
+
+DOWNSAMPLE_MODES = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `n_out` points that preserve the
+    visual shape of the series. Keeps the first and last point; each bucket in
+    between contributes the point forming the largest triangle with the previously
+    selected point and the mean of the next bucket. The per-bucket area search is
+    vectorized; only the bucket walk itself is a Python loop (n_out iterations).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket boundaries over the interior points [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bx = x[start:end]
+        by = y[start:end]
+        # Twice the triangle area; the constant factor doesn't change the argmax
+        area = np.abs((x[prev] - avg_x) * (by - y[prev]) - (x[prev] - bx) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Min/max envelope: split the series into n_out / 2 buckets and keep each bucket's
+    minimum and maximum, in time order. Peaks and troughs always survive. Fully vectorized.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    n_buckets = n_out // 2
+    bucket = np.arange(n) * n_buckets // n
+    # Sort by (bucket, value): the first entry of each bucket is its min, the last its max
+    order = np.lexsort((y, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def downsample(timestamps: np.ndarray, values: np.ndarray, max_points: int, mode: str = "lttb") -> np.ndarray:
+    """Indices of the rows to keep so that at most `max_points` remain."""
+    if len(values) <= max_points:
+        return np.arange(len(values))
+    if mode == "minmax":
+        return minmax(values, max_points)
+    return lttb(timestamps, values, max_points)
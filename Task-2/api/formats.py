@@ -0,0 +1,109 @@
+import io
+import math
+from typing import AsyncIterator, List, Optional, Sequence
+
+# Output formats for /data and their media types
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+STREAMING_FORMATS = ("ndjson", "csv", "arrow")
+
+
+def negotiate(format_param: Optional[str], accept: Optional[str]) -> str:
+    """An explicit ?format= wins; otherwise the first supported Accept media type; JSON by default."""
+    if format_param:
+        return format_param
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip()
+        for fmt, supported in MEDIA_TYPES.items():
+            if media_type == supported:
+                return fmt
+    return "json"
+
+
+def json_value(value) -> Optional[float]:
+    """A row's value for JSON: NULL (None, or NaN from the hot tier) becomes null, never `NaN`."""
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def _value(value) -> str:
+    value = json_value(value)
+    return "" if value is None else repr(value)
+
+
+def encode_ndjson(rows: Sequence) -> bytes:
+    return "".join(
+        f'{{"timestamp":"{row[0].isoformat()}","value":{_value(row[1]) or "null"}}}\n' for row in rows
+    ).encode("utf-8")
+
+
+def encode_csv(rows: Sequence) -> bytes:
+    return "".join(f"{row[0].isoformat()},{_value(row[1])}\n" for row in rows).encode("utf-8")
+
+
+class ArrowEncoder:
+    """Arrow IPC stream: the schema once, then one record batch per row batch."""
+
+    def __init__(self):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Please install pyarrow using: pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("timestamp", pa.timestamp("us", tz="UTC")),
+            ("value", pa.float64()),
+        ])
+        self.sink = io.BytesIO()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _drain(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def encode(self, rows: Sequence) -> bytes:
+        batch = self.pa.record_batch([
+            self.pa.array([row[0] for row in rows], type=self.schema.field("timestamp").type),
+            # from_pandas: NaN becomes null, like None
+            self.pa.array([row[1] for row in rows], type=self.pa.float64(), from_pandas=True),
+        ], schema=self.schema)
+        self.writer.write_batch(batch)
+        return self._drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self._drain()
+
+
+def stream_body(batches: AsyncIterator[List], fmt: str) -> AsyncIterator[bytes]:
+    """
+    Encode row batches as they arrive so the first bytes go out before the query
+    finishes. The encoder is built eagerly so a missing dependency fails the request
+    before any response headers are sent.
+    """
+    arrow = ArrowEncoder() if fmt == "arrow" else None
+
+    async def body():
+        if arrow is not None:
+            async for rows in batches:
+                yield arrow.encode(rows)
+            yield arrow.close()
+            return
+
+        if fmt == "csv":
+            yield b"timestamp,value\n"
+            encode = encode_csv
+        else:
+            encode = encode_ndjson
+        async for rows in batches:
+            yield encode(rows)
+
+    return body()
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from common.record_batch import EPOCH, RecordBatch
+from .planner import BUCKET_WIDTHS
+
+# Hot tier: the most recent points of every streamed series, kept in memory
+HOT_TIER = os.getenv("HOT_TIER", "0") == "1"
+# Points older than this (behind the newest point of their series) are evicted
+HOT_WINDOW_SECONDS = int(os.getenv("HOT_WINDOW_SECONDS", "10800"))
+# Hard cap per series; 3 hours of a 1 Hz metric by default, 16 bytes per point
+HOT_MAX_POINTS = int(os.getenv("HOT_MAX_POINTS", "10800"))
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "kafka:9092")
+KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "wearipedia_stream")
+HOT_POLL_RECORDS = 5000
+REQUIRED_KEYS = ("user_id", "metric", "timestamp", "value")
+# Arrays start small and double up to twice HOT_MAX_POINTS
+INITIAL_CAPACITY = 256
+
+Series = Tuple[str, str]
+
+
+def _epoch_us(ts: datetime) -> int:
+    delta = ts - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _rows(timestamps: np.ndarray, values: np.ndarray) -> List[Tuple[datetime, Optional[float]]]:
+    return [
+        (EPOCH + timedelta(microseconds=ts), None if value != value else value)
+        for ts, value in zip(timestamps.tolist(), values.tolist())
+    ]
+
+
+class SeriesBuffer:
+    """
+    Recent points of one series, sorted by timestamp in the live region
+    [start, end) of preallocated NumPy arrays. Appends write past `end`; when the
+    arrays run out, the live region is moved back to the front (or the arrays
+    grow), so reads are always contiguous slices found with searchsorted.
+
+    `covered_from` is the timestamp from which the buffer holds every point the
+    stream delivered: the first point seen, advanced past anything evicted.
+    """
+
+    __slots__ = ("timestamps", "values", "start", "end", "covered_from")
+
+    def __init__(self):
+        self.timestamps = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.values = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.start = self.end = 0
+        self.covered_from = None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _reserve(self, n: int):
+        size = len(self)
+        if self.end + n <= len(self.timestamps):
+            return
+        capacity = len(self.timestamps)
+        while capacity < size + n:
+            capacity *= 2
+        if capacity > len(self.timestamps):
+            timestamps = np.empty(capacity, dtype=np.int64)
+            values = np.empty(capacity, dtype=np.float64)
+        else:
+            timestamps, values = self.timestamps, self.values
+        timestamps[:size] = self.timestamps[self.start:self.end]
+        values[:size] = self.values[self.start:self.end]
+        self.timestamps, self.values = timestamps, values
+        self.start, self.end = 0, size
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        """Add points in stream order; a timestamp already held keeps its first value, as in raw_data."""
+        timestamps, first = np.unique(timestamps, return_index=True)
+        values = values[first]
+        if self.covered_from is None:
+            self.covered_from = int(timestamps[0])
+        keep = timestamps >= self.covered_from
+        timestamps, values = timestamps[keep], values[keep]
+        if not len(timestamps):
+            return
+
+        if not len(self) or timestamps[0] > self.timestamps[self.end - 1]:
+            # In-order arrivals, the common case: a straight append
+            self._reserve(len(timestamps))
+            self.timestamps[self.end:self.end + len(timestamps)] = timestamps
+            self.values[self.end:self.end + len(timestamps)] = values
+            self.end += len(timestamps)
+        else:
+            # Late points: merge, keeping the stored value where a timestamp repeats
+            merged_ts = np.concatenate([self.timestamps[self.start:self.end], timestamps])
+            merged_values = np.concatenate([self.values[self.start:self.end], values])
+            merged_ts, first = np.unique(merged_ts, return_index=True)
+            merged_values = merged_values[first]
+            self.start = self.end = 0
+            self._reserve(len(merged_ts))
+            self.timestamps[:len(merged_ts)] = merged_ts
+            self.values[:len(merged_ts)] = merged_values
+            self.end = len(merged_ts)
+        self._evict()
+
+    def _evict(self):
+        newest = self.timestamps[self.end - 1]
+        oldest_kept = np.searchsorted(self.timestamps[self.start:self.end], newest - HOT_WINDOW_SECONDS * 1_000_000)
+        drop = max(int(oldest_kept), len(self) - HOT_MAX_POINTS)
+        if drop > 0:
+            self.covered_from = int(self.timestamps[self.start + drop - 1]) + 1
+            self.start += drop
+
+    def slice(self, start_us: int, end_us: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Points with start_us <= timestamp <= end_us."""
+        live = self.timestamps[self.start:self.end]
+        lo = np.searchsorted(live, start_us, side="left")
+        hi = np.searchsorted(live, end_us, side="right")
+        return live[lo:hi], self.values[self.start + lo:self.start + hi]
+
+
+def bucket_means(timestamps: np.ndarray, values: np.ndarray, width_us: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean per `width_us` bucket, the avg_value a rollup table stores; NULL values are skipped."""
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+    if not len(values):
+        return timestamps, values
+    buckets = timestamps - timestamps % width_us
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    sums = np.add.reduceat(values, starts)
+    counts = np.diff(np.append(starts, len(values)))
+    return buckets[starts], sums / counts
+
+
+class HotStore:
+    """
+    SeriesBuffer per (user_id, metric), fed from the stream on a background thread
+    and read by request handlers; one lock guards the map and every buffer.
+    """
+
+    def __init__(self):
+        self.series: Dict[Series, SeriesBuffer] = {}
+        self.lock = threading.Lock()
+
+    def extend(self, batch: RecordBatch):
+        if not len(batch):
+            return
+        codes = batch.series_codes()
+        order = np.lexsort((batch.timestamps, codes))
+        codes, timestamps, values = codes[order], batch.timestamps[order], batch.values[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        with self.lock:
+            for start, end in zip(np.append(0, bounds).tolist(), np.append(bounds, len(codes)).tolist()):
+                key = batch.series(codes[start])
+                buffer = self.series.get(key)
+                if buffer is None:
+                    buffer = self.series[key] = SeriesBuffer()
+                buffer.add(timestamps[start:end], values[start:end])
+
+    def read(self, user_id: str, metric: str, start: datetime, end: datetime, table: str = "raw_data"):
+        """
+        Rows (timestamp, value) for start..end as `table` would return them, or None
+        unless the buffer covers the range. Rollup tables are answered with bucket
+        means, which needs every point of the first bucket starting in the range.
+        """
+        width = int(BUCKET_WIDTHS[table].total_seconds() * 1_000_000)
+        start_us, end_us = _epoch_us(start), _epoch_us(end)
+        # Bucketed tables return buckets starting in the range, each holding a full width of points
+        first = start_us + (-start_us) % width if width else start_us
+        last = end_us - end_us % width + width - 1 if width else end_us
+        with self.lock:
+            buffer = self.series.get((user_id, metric))
+            if buffer is None or buffer.covered_from is None or first < buffer.covered_from:
+                return None
+            timestamps, values = buffer.slice(first, last)
+            timestamps, values = timestamps.copy(), values.copy()
+        if width:
+            timestamps, values = bucket_means(timestamps, values, width)
+        return _rows(timestamps, values)
+
+    def tail(self, user_id: str, metric: str, end: datetime):
+        """(covered_from, rows from there up to `end`) for merging with older DB rows, or (None, [])."""
+        with self.lock:
+            buffer = self.series.get((user_id, metric))
+            if buffer is None or buffer.covered_from is None:
+                return None, []
+            covered_from = buffer.covered_from
+            timestamps, values = buffer.slice(covered_from, _epoch_us(end))
+            timestamps, values = timestamps.copy(), values.copy()
+        return EPOCH + timedelta(microseconds=covered_from), _rows(timestamps, values)
+
+    @property
+    def points(self) -> int:
+        with self.lock:
+            return sum(len(buffer) for buffer in self.series.values())
+
+
+def parse_timestamp(value) -> datetime:
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def decode(messages) -> RecordBatch:
+    """Batch of the valid messages; malformed ones are logged and skipped, as in the Task-6 worker."""
+    records = []
+    for message in messages:
+        try:
+            record = json.loads(message.value)
+            if all(record.get(key) is not None for key in REQUIRED_KEYS):
+                records.append({
+                    "user_id": str(record["user_id"]),
+                    "metric": str(record["metric"]),
+                    "timestamp": parse_timestamp(record["timestamp"]),
+                    "value": float(record["value"]),
+                })
+                continue
+        except (ValueError, TypeError, AttributeError) as e:
+            record = e
+        logging.warning(f"Hot tier skipping malformed message at {message.topic}[{message.partition}]@{message.offset}: {record}")
+    return RecordBatch.from_records(records)
+
+
+def consume(store: HotStore, stop: threading.Event):
+    """
+    Tail KAFKA_TOPIC into `store` until `stop` is set. Runs without a consumer
+    group, so every API process sees every partition; it starts HOT_WINDOW_SECONDS
+    back so the hot tier is warm shortly after startup.
+    """
+    try:
+        from kafka import KafkaConsumer, TopicPartition
+    except ImportError:
+        raise ImportError("Please install kafka-python using: pip install kafka-python")
+
+    consumer = None
+    while not stop.is_set():
+        try:
+            if consumer is None:
+                consumer = KafkaConsumer(bootstrap_servers=[KAFKA_BROKER], group_id=None, enable_auto_commit=False)
+                partitions = consumer.partitions_for_topic(KAFKA_TOPIC)
+                if not partitions:
+                    raise RuntimeError(f"topic {KAFKA_TOPIC} not found")
+                assigned = [TopicPartition(KAFKA_TOPIC, p) for p in partitions]
+                consumer.assign(assigned)
+                since = int((time.time() - HOT_WINDOW_SECONDS) * 1000)
+                offsets = consumer.offsets_for_times({tp: since for tp in assigned})
+                for tp in assigned:
+                    if offsets.get(tp) is None:
+                        consumer.seek_to_end(tp)
+                    else:
+                        consumer.seek(tp, offsets[tp].offset)
+                logging.info(f"Hot tier tailing {KAFKA_TOPIC} ({len(assigned)} partition(s))")
+
+            polled = consumer.poll(timeout_ms=500, max_records=HOT_POLL_RECORDS)
+            for messages in polled.values():
+                store.extend(decode(messages))
+        except Exception as e:
+            logging.warning(f"Hot tier consumer error, retrying: {e}")
+            if consumer is not None:
+                consumer.close()
+                consumer = None
+            stop.wait(5)
+    if consumer is not None:
+        consumer.close()
+
+
+def start_hot_tier() -> Tuple[Optional[HotStore], Optional[threading.Event]]:
+    """Start the stream-fed store if HOT_TIER is enabled; returns (store, stop event)."""
+    if not HOT_TIER:
+        return None, None
+    store = HotStore()
+    stop = threading.Event()
+    threading.Thread(target=consume, args=(store, stop), name="hot-tier", daemon=True).start()
+    return store, stop
@@ -1,17 +1,57 @@
-from fastapi import FastAPI, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
-import psycopg2
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import asyncio
+import asyncpg
+import json
 import os
-from datetime import datetime
 import logging
+import numpy as np
+
+from .cache import CACHE_TTL_SECONDS, cache_key, create_cache, listen_for_ingest
+from common.sketches import merge_bins, quantiles
+from .db import (DB_CONFIG, SKETCH_TABLES, create_pool, fetch_batch, fetch_series, fetch_sketches,
+                 resolve_ids, series_key, stream_series)
+from .downsample import DOWNSAMPLE_MODES, downsample
+from .formats import MEDIA_TYPES, STREAMING_FORMATS, json_value, negotiate, stream_body
+from .hot import start_hot_tier
+from .profiling import SERVER_TIMING, phase, report_slow_request, set_table, start_profile
+from .planner import Planner, refresh_periodically
 
 # Prometheus imports
 from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pool per process, shared by every request
+    app.state.pool = await create_pool()
+    app.state.cache = create_cache()
+    # Table choice uses density statistics refreshed in the background
+    app.state.planner = Planner()
+    planner_task = asyncio.create_task(refresh_periodically(app.state.planner, app.state.pool))
+    # Recent points tailed from the Kafka stream (HOT_TIER=1), or None
+    app.state.hot, hot_stop = start_hot_tier()
+    listener_task = None
+    if app.state.cache is not None:
+        # Dedicated connection outside the pool: LISTEN needs it held for the app's lifetime
+        listener_task = asyncio.create_task(listen_for_ingest(app.state.cache, lambda: asyncpg.connect(**DB_CONFIG)))
+    try:
+        yield
+    finally:
+        planner_task.cancel()
+        if hot_stop is not None:
+            hot_stop.set()
+        if listener_task is not None:
+            listener_task.cancel()
+        if hasattr(app.state.cache, "close"):
+            await app.state.cache.close()
+        await app.state.pool.close()
 
-app = FastAPI(title="Wearipedia TimescaleDB API")
+app = FastAPI(title="Wearipedia TimescaleDB API", lifespan=lifespan)
 
 # Enable CORS for frontend access
 app.add_middleware(
@@ -30,26 +70,57 @@ api_requests_total = Counter(
     "api_requests_total", "Total API requests",
     ["method", "endpoint"]
 )
-
-# DB Config
-DB_CONFIG = {
-    "host": os.getenv("TSDB_HOST", "localhost"),
-    "port": os.getenv("TSDB_PORT", "5432"),
-    "dbname": os.getenv("POSTGRES_DB", "wearipedia"),
-    "user": os.getenv("POSTGRES_USER", "wearipedia_user"),
-    "password": os.getenv("POSTGRES_PASSWORD", "19768003"),
-}
+hot_tier_reads_total = Counter(
+    "hot_tier_reads_total", "/data reads by source: hot, hot+db (merged at the boundary) or db",
+    ["source"]
+)
 
 # Define response schema
 class TimeSeriesRecord(BaseModel):
     timestamp: str
-    value: float
+    value: Optional[float]
+
+class SeriesResult(BaseModel):
+    user_id: str
+    metric: str
+    data: List[TimeSeriesRecord]
+
+class QuantileBucket(BaseModel):
+    timestamp: str
+    count: int
+    values: List[Optional[float]]
+
+class QuantileResult(BaseModel):
+    metric: str
+    quantiles: List[float]
+    count: int
+    values: List[Optional[float]]
+    buckets: List[QuantileBucket]
 
-# Middleware to count API requests
+# Upper bound on users x metrics per /data/batch call
+MAX_BATCH_SERIES = int(os.getenv("MAX_BATCH_SERIES", "1000"))
+
+# Middleware to count and profile API requests
 @app.middleware("http")
 async def count_requests(request: Request, call_next):
+    profile = start_profile(request.url.path, str(request.url.path) + (f"?{request.url.query}" if request.url.query else ""))
     response = await call_next(request)
     api_requests_total.labels(method=request.method, endpoint=request.url.path).inc()
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = profile.server_timing()
+
+    # Latency and phases are recorded once the body is sent, so streamed exports count in full
+    body = response.body_iterator
+
+    async def finish():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profile.finish()
+            report_slow_request(request.app.state.pool, profile)
+
+    response.body_iterator = finish()
     return response
 
 # Route: Expose Prometheus metrics
@@ -57,48 +128,223 @@ async def count_requests(request: Request, call_next):
 def metrics():
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-# Helper: Choose appropriate table based on query span
-def select_table(start_date: str, end_date: str) -> str:
-    fmt = "%Y-%m-%d"
-    start = datetime.strptime(start_date, fmt)
-    end = datetime.strptime(end_date, fmt)
-    span = (end - start).days
-    logging.info(f"Date range span: {span} days")
-
-    if span <= 3:
-        return "raw_data"
-    elif span <= 30:
-        return "data_1h"
-    else:
-        return "data_1d"
+# Helper: Parse a YYYY-MM-DD date or ISO 8601 timestamp; naive values are UTC
+def parse_date(value: str) -> datetime:
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+# Helper: Downsample a series' rows (timestamp, value last) to at most max_points.
+# NULL values have no shape to preserve, so they are dropped before downsampling.
+def reduce_rows(rows, max_points: Optional[int], mode: str):
+    if max_points is None or len(rows) <= max_points:
+        return rows
+    values = np.fromiter((np.nan if row[-1] is None else row[-1] for row in rows), dtype=np.float64, count=len(rows))
+    present = np.flatnonzero(~np.isnan(values))
+    if len(present) <= max_points:
+        return [rows[i] for i in present]
+    timestamps = np.fromiter((rows[i][-2].timestamp() for i in present), dtype=np.float64, count=len(present))
+    return [rows[present[i]] for i in downsample(timestamps, values[present], max_points, mode)]
+
+# Helper: Ask the planner for the finest table that fits the scan budget and covers the series
+async def select_table(request: Request, metric: str, start: datetime, end: datetime, max_points: Optional[int],
+                       series=()) -> str:
+    planner = request.app.state.planner
+    with phase("plan"):
+        await planner.load_coverage(request.app.state.pool, series)
+        table = planner.choose(metric, start, end, max_points, series)
+    set_table(table)
+    logging.info(f"Planned '{table}' for {metric} {start}..{end}: ~{planner.estimate(table, metric, start, end):.0f} rows")
+    return table
+
+# Helper: Rows from the hot tier if it holds the range; raw reads starting before it are merged with older DB rows
+async def read_hot(request: Request, table: str, user_id: str, metric: str, ids, start: datetime, end: datetime):
+    hot = request.app.state.hot
+    if hot is None:
+        return None, "db"
+    with phase("hot"):
+        rows = hot.read(user_id, metric, start, end, table)
+    if rows is not None:
+        return rows, "hot"
+    if table != "raw_data":
+        return None, "db"
+    with phase("hot"):
+        covered_from, recent = hot.tail(user_id, metric, end)
+    if covered_from is None or not start < covered_from <= end:
+        return None, "db"
+    older = []
+    if ids is not None:
+        older = await fetch_series(request.app.state.pool, table, *ids, start, covered_from - timedelta(microseconds=1))
+    return list(older) + recent, "hot+db"
 
 # Main endpoint to fetch timeseries data
 @app.get("/data", response_model=List[TimeSeriesRecord])
-def get_data(
+async def get_data(
+    request: Request,
     user_id: str = Query(..., description="User ID, e.g. synthetic_001"),
     metric: str = Query(..., description="Metric name, e.g. heart_rate"),
-    start_date: str = Query(..., description="Start date in YYYY-MM-DD"),
-    end_date: str = Query(..., description="End date in YYYY-MM-DD"),
+    start_date: str = Query(..., description="Start as YYYY-MM-DD or an ISO 8601 timestamp"),
+    end_date: str = Query(..., description="End as YYYY-MM-DD or an ISO 8601 timestamp"),
+    max_points: Optional[int] = Query(None, ge=3, description="Downsample to at most this many points, e.g. the chart width in px"),
+    downsample_mode: str = Query("lttb", alias="downsample", pattern=f"^({'|'.join(DOWNSAMPLE_MODES)})$",
+                                 description="Shape-preserving method: lttb or minmax (envelope)"),
+    output_format: Optional[str] = Query(None, alias="format", pattern=f"^({'|'.join(MEDIA_TYPES)})$",
+                                         description="json, ndjson, csv or arrow; defaults to the Accept header, then json"),
 ):
     try:
-        table = select_table(start_date, end_date)
+        start, end = parse_date(start_date), parse_date(end_date)
+        # Names -> integer keys once per request; None if the series was never ingested
+        ids = await series_key(request.app.state.pool, user_id, metric)
+        table = await select_table(request, metric, start, end, max_points, [ids] if ids else [])
         logging.info(f"[GET /data] Querying table '{table}' for user '{user_id}', metric '{metric}'")
 
-        query = f"""
-        SELECT timestamp, value
-        FROM {table}
-        WHERE user_id = %s AND metric = %s
-        AND timestamp BETWEEN %s AND %s
-        ORDER BY timestamp;
-        """
+        fmt = negotiate(output_format, request.headers.get("accept"))
+        rows, source = await read_hot(request, table, user_id, metric, ids, start, end)
+        hot_tier_reads_total.labels(source=source).inc()
+        if rows is not None:
+            logging.info(f"[GET /data] Served {len(rows)} row(s) from {source}")
+        elif ids is None:
+            rows = []
+        elif fmt in STREAMING_FORMATS and max_points is None:
+            # Exports stream straight from the cursor and bypass the cache
+            batches = stream_series(request.app.state.pool, table, *ids, start, end)
+            return StreamingResponse(stream_body(batches, fmt), media_type=MEDIA_TYPES[fmt])
+
+        # Only JSON responses from the database are cached; the hot tier changes every poll
+        cache = request.app.state.cache if fmt == "json" and rows is None else None
+        key = cache_key(table, user_id, metric, start, end, max_points, downsample_mode)
+        if cache is not None:
+            with phase("cache"):
+                body = await cache.get(key)
+            if body is not None:
+                return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        if rows is None:
+            rows = await fetch_series(request.app.state.pool, table, *ids, start, end)
+        with phase("downsample"):
+            rows = reduce_rows(rows, max_points, downsample_mode)
 
-        with psycopg2.connect(**DB_CONFIG) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, (user_id, metric, start_date, end_date))
-                rows = cur.fetchall()
+        if fmt in STREAMING_FORMATS:
+            async def single_batch():
+                yield rows
+            return StreamingResponse(stream_body(single_batch(), fmt), media_type=MEDIA_TYPES[fmt])
 
-        return [{"timestamp": row[0].isoformat(), "value": float(row[1])} for row in rows]
+        # Serialize once; the same bytes are cached and sent
+        with phase("serialize"):
+            body = json.dumps(
+                [{"timestamp": row[0].isoformat(), "value": json_value(row[1])} for row in rows],
+                separators=(",", ":"),
+            ).encode("utf-8")
+        if cache is not None:
+            with phase("cache"):
+                await cache.set(key, body, CACHE_TTL_SECONDS[table], (user_id, metric), start, end)
+        headers = {"X-Cache": "MISS"} if source == "db" else {"X-Source": source}
+        return Response(body, media_type="application/json", headers=headers)
 
     except Exception as e:
         logging.exception("Error in /data route")
-        return {"error": str(e)}
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Cohort endpoint: many users x metrics over one shared range in a single round trip
+@app.get("/data/batch", response_model=List[SeriesResult])
+async def get_data_batch(
+    request: Request,
+    user_id: List[str] = Query(..., description="Repeat for each user, e.g. user_id=synthetic_001&user_id=synthetic_002"),
+    metric: List[str] = Query(..., description="Repeat for each metric, e.g. metric=heart_rate&metric=spo2"),
+    start_date: str = Query(..., description="Start as YYYY-MM-DD or an ISO 8601 timestamp"),
+    end_date: str = Query(..., description="End as YYYY-MM-DD or an ISO 8601 timestamp"),
+    max_points: Optional[int] = Query(None, ge=3, description="Downsample each series to at most this many points"),
+    downsample_mode: str = Query("lttb", alias="downsample", pattern=f"^({'|'.join(DOWNSAMPLE_MODES)})$"),
+):
+    user_ids = list(dict.fromkeys(user_id))
+    metrics = list(dict.fromkeys(metric))
+    if len(user_ids) * len(metrics) > MAX_BATCH_SERIES:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {MAX_BATCH_SERIES} series per batch, got {len(user_ids) * len(metrics)}")
+
+    try:
+        start, end = parse_date(start_date), parse_date(end_date)
+        # Names -> integer keys once per request; names never ingested simply have no rows
+        user_keys = await resolve_ids(request.app.state.pool, "users", user_ids)
+        metric_keys = await resolve_ids(request.app.state.pool, "metrics", metrics)
+        user_names = {key: name for name, key in user_keys.items()}
+        metric_names = {key: name for name, key in metric_keys.items()}
+
+        # Metrics differ in density, so each may resolve to its own table
+        by_table = {}
+        for m in metric_keys if user_keys else []:
+            series = [(user_key, metric_keys[m]) for user_key in user_keys.values()]
+            by_table.setdefault(await select_table(request, m, start, end, max_points, series), []).append(metric_keys[m])
+        logging.info(f"[GET /data/batch] Querying {sorted(by_table)} for {len(user_ids)} user(s) x {len(metrics)} metric(s)")
+
+        results = await asyncio.gather(*(
+            fetch_batch(request.app.state.pool, table, user_keys.values(), table_metrics, start, end)
+            for table, table_metrics in by_table.items()
+        ))
+
+        # Rows arrive ordered by (user_key, metric_key, timestamp): split into contiguous runs
+        series = {(u, m): [] for u in user_ids for m in metrics}
+        for rows in results:
+            for row in rows:
+                series[(user_names[row[0]], metric_names[row[1]])].append(row)
+
+        with phase("downsample"):
+            series = {pair: reduce_rows(series_rows, max_points, downsample_mode) for pair, series_rows in series.items()}
+        with phase("serialize"):
+            body = json.dumps(
+                [
+                    {
+                        "user_id": u,
+                        "metric": m,
+                        "data": [{"timestamp": row[2].isoformat(), "value": json_value(row[3])} for row in series_rows],
+                    }
+                    for (u, m), series_rows in series.items()
+                ],
+                separators=(",", ":"),
+            ).encode("utf-8")
+        return Response(body, media_type="application/json")
+
+    except Exception as e:
+        logging.exception("Error in /data/batch route")
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Population statistics: approximate quantiles merged from per-bucket sketches
+@app.get("/stats/quantiles", response_model=QuantileResult)
+async def get_quantiles(
+    request: Request,
+    metric: str = Query(..., description="Metric name, e.g. heart_rate"),
+    start_date: str = Query(..., description="Start as YYYY-MM-DD or an ISO 8601 timestamp"),
+    end_date: str = Query(..., description="End as YYYY-MM-DD or an ISO 8601 timestamp"),
+    q: List[float] = Query([0.05, 0.5, 0.95], description="Repeat for each quantile in [0, 1]"),
+    user_id: Optional[List[str]] = Query(None, description="Restrict to these users; omit for every participant"),
+    resolution: str = Query("1h", pattern=f"^({'|'.join(SKETCH_TABLES)})$", description="Bucket size: 1h or 1d"),
+):
+    if any(not 0 <= value <= 1 for value in q):
+        raise HTTPException(status_code=422, detail="Quantiles must be between 0 and 1")
+
+    try:
+        table = SKETCH_TABLES[resolution]
+        set_table(table)
+        user_ids = list(dict.fromkeys(user_id)) if user_id else None
+        logging.info(f"[GET /stats/quantiles] Merging '{table}' sketches for metric '{metric}', "
+                     f"{len(user_ids) if user_ids else 'all'} user(s)")
+
+        buckets = await fetch_sketches(
+            request.app.state.pool, table, metric,
+            parse_date(start_date), parse_date(end_date), user_ids,
+        )
+        with phase("merge"):
+            overall = merge_bins(*(bins for _, _, bins in buckets))
+            return {
+                "metric": metric,
+                "quantiles": q,
+                "count": sum(count for _, count, _ in buckets),
+                "values": quantiles(overall, q),
+                "buckets": [
+                    {"timestamp": ts.isoformat(), "count": count, "values": quantiles(bins, q)}
+                    for ts, count, bins in buckets
+                ],
+            }
+
+    except Exception as e:
+        logging.exception("Error in /stats/quantiles route")
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import asyncpg
+
+# Finest to coarsest, with the width of the bucket each row stands for
+TABLES = (
+    ("raw_data", timedelta(0)),
+    ("data_1m", timedelta(minutes=1)),
+    ("data_1h", timedelta(hours=1)),
+    ("data_1d", timedelta(days=1)),
+)
+BUCKET_WIDTHS = dict(TABLES)
+
+# Rows a query may read before the planner moves to a coarser table. max_points only
+# raises it: the finest table within budget is read and then downsampled to max_points.
+PLANNER_POINT_BUDGET = int(os.getenv("PLANNER_POINT_BUDGET", "5000"))
+PLANNER_REFRESH_SECONDS = int(os.getenv("PLANNER_REFRESH_SECONDS", "600"))
+# Density is sampled from the most recent days of data_1h
+DENSITY_SAMPLE_DAYS = int(os.getenv("DENSITY_SAMPLE_DAYS", "7"))
+
+# Rows per series-day assumed until statistics exist for a metric (1 Hz raw worst case)
+DEFAULT_DENSITY = {
+    "raw_data": 86400.0,
+    "data_1m": 1440.0,
+    "data_1h": 24.0,
+    "data_1d": 1.0,
+}
+
+# data_1h carries raw point counts per hour, which is enough to estimate every
+# finer table without scanning them: a minute bucket exists for each of up to 60
+# points in the hour, an hour bucket for each row, a day bucket once per series-day.
+DENSITY_QUERY = """
+SELECT m.name AS metric,
+       avg(points) AS raw_data,
+       avg(minutes) AS data_1m,
+       avg(hours) AS data_1h
+FROM (
+    SELECT user_key, metric_key, time_bucket(INTERVAL '1 day', timestamp) AS day,
+           sum(count_value) AS points,
+           sum(LEAST(count_value, 60)) AS minutes,
+           count(*) AS hours
+    FROM data_1h
+    WHERE timestamp >= (SELECT max(timestamp) FROM data_1h) - make_interval(days => $1)
+    GROUP BY user_key, metric_key, day
+) AS series_days
+JOIN metrics m ON m.id = series_days.metric_key
+GROUP BY m.name;
+"""
+
+# First/last timestamp per requested series: two primary-key index probes each, however
+# much history the series has
+COVERAGE_QUERY = """
+SELECT k.user_key, k.metric_key,
+       (SELECT timestamp FROM {table} t
+        WHERE t.user_key = k.user_key AND t.metric_key = k.metric_key
+        ORDER BY timestamp LIMIT 1) AS first,
+       (SELECT timestamp FROM {table} t
+        WHERE t.user_key = k.user_key AND t.metric_key = k.metric_key
+        ORDER BY timestamp DESC LIMIT 1) AS last
+FROM unnest($1::integer[], $2::smallint[]) AS k(user_key, metric_key);
+"""
+
+Span = Tuple[datetime, datetime]
+# (user_key, metric_key)
+Series = Tuple[int, int]
+
+
+class Planner:
+    """
+    Chooses the table for a (metric, range) query: the finest resolution whose
+    estimated row count fits the scan budget, skipping tables whose data doesn't
+    span the requested range for the queried series (retention, rollups not yet
+    written for them).
+    """
+
+    def __init__(self, budget: int = PLANNER_POINT_BUDGET):
+        self.budget = budget
+        # (metric, table) -> rows per series-day
+        self.density: Dict[Tuple[str, str], float] = {}
+        # series -> table -> (first, last) bucket timestamp present; loaded on demand and
+        # dropped on every refresh
+        self.coverage: Dict[Series, Dict[str, Span]] = {}
+
+    async def refresh(self, pool: asyncpg.Pool):
+        async with pool.acquire() as conn:
+            density = {}
+            for row in await conn.fetch(DENSITY_QUERY, DENSITY_SAMPLE_DAYS):
+                for table in ("raw_data", "data_1m", "data_1h"):
+                    density[(row["metric"], table)] = float(row[table])
+                density[(row["metric"], "data_1d")] = 1.0
+
+        self.density, self.coverage = density, {}
+        logging.info(f"Planner statistics refreshed: {len(density) // len(TABLES)} metric(s)")
+
+    async def load_coverage(self, pool: asyncpg.Pool, series: Iterable[Series]):
+        """Fetch first/last timestamps per table for the series not loaded since the last refresh."""
+        missing = [key for key in dict.fromkeys(series) if key not in self.coverage]
+        if not missing:
+            return
+        coverage = {key: {} for key in missing}
+        users, metrics = [key[0] for key in missing], [key[1] for key in missing]
+        async with pool.acquire() as conn:
+            for table, _ in TABLES:
+                for row in await conn.fetch(COVERAGE_QUERY.format(table=table), users, metrics):
+                    if row["first"] is not None:
+                        coverage[(row["user_key"], row["metric_key"])][table] = (row["first"], row["last"])
+        self.coverage.update(coverage)
+
+    def estimate(self, table: str, metric: str, start: datetime, end: datetime) -> float:
+        days = max((end - start) / timedelta(days=1), 0.0)
+        rows = self.density.get((metric, table), DEFAULT_DENSITY[table]) * days
+        # Any non-empty range touches at least one bucket
+        return max(rows, 1.0)
+
+    def covers(self, table: str, start: datetime, end: datetime, series: Iterable[Series] = ()) -> bool:
+        """Whether `table` spans the range for every one of `series` whose coverage is loaded."""
+        for key in series:
+            spans = self.coverage.get(key)
+            if not spans:
+                # Not loaded, or no data anywhere: nothing to judge
+                continue
+            # Only judge the part of the range where any table has data for this series
+            lo = max(start, min(first for first, _ in spans.values()))
+            hi = min(end, max(last for _, last in spans.values()))
+            if lo > hi:
+                continue
+            span = spans.get(table)
+            if span is None:
+                return False
+            first, last = span
+            # Bucket timestamps are bucket starts; the last bucket extends one width further
+            if not (first <= lo + BUCKET_WIDTHS[table] and last + BUCKET_WIDTHS[table] >= hi):
+                return False
+        return True
+
+    def choose(self, metric: str, start: datetime, end: datetime, max_points: Optional[int] = None,
+               series: Iterable[Series] = ()) -> str:
+        """
+        The finest table whose estimate fits the scan budget (never below max_points, so
+        a finer table the response has room for isn't skipped); the caller downsamples.
+        """
+        budget = max(self.budget, max_points or 0)
+        series = list(series)
+        order = [table for table, _ in TABLES]
+        fits = next(
+            (i for i, table in enumerate(order) if self.estimate(table, metric, start, end) <= budget),
+            len(order) - 1,
+        )
+        # Prefer coarser tables over a gap; finer ones only if every coarser table has gaps too
+        for table in order[fits:] + order[:fits][::-1]:
+            if self.covers(table, start, end, series):
+                if table != order[fits]:
+                    logging.warning(f"{order[fits]} has gaps for {start}..{end}, using {table}")
+                return table
+        return order[fits]
+
+
+async def refresh_periodically(planner: Planner, pool: asyncpg.Pool, interval: int = PLANNER_REFRESH_SECONDS):
+    while True:
+        try:
+            await planner.refresh(pool)
+        except Exception as e:
+            # Keep serving with the last (or default) statistics
+            logging.warning(f"Planner statistics refresh failed: {e}")
+        await asyncio.sleep(interval)
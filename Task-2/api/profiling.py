@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set, Tuple
+
+from prometheus_client import Histogram
+
+# Debug only: a Server-Timing header with every phase on each response (browser devtools show it)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# Requests slower than this are logged with their phases; 0 disables the slow-query log
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Also log EXPLAIN (ANALYZE, BUFFERS) of the slowest query of a slow request. ANALYZE runs
+# the query again, so at most one plan is captured at a time and others are skipped.
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_SECONDS = Histogram(
+    "api_request_seconds", "Request latency, until the last body byte is sent",
+    ["endpoint", "table"],
+    buckets=LATENCY_BUCKETS,
+)
+PHASE_SECONDS = Histogram(
+    "api_phase_seconds",
+    "Time per request phase: plan, resolve, hot, cache, acquire, execute, fetch, downsample, serialize, merge",
+    ["endpoint", "table", "phase"],
+    buckets=LATENCY_BUCKETS,
+)
+
+Query = Tuple[float, str, tuple]
+
+
+class RequestProfile:
+    """
+    Phase durations and executed queries of one request. Phases of concurrent
+    queries (e.g. /data/batch across tables) are summed, so they can exceed the total.
+    """
+
+    def __init__(self, endpoint: str, target: str = ""):
+        self.endpoint = endpoint
+        self.target = target or endpoint
+        self.tables: Set[str] = set()
+        self.phases: Dict[str, float] = {}
+        # (seconds, SQL, arguments) per query, for EXPLAIN
+        self.queries: List[Query] = []
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+
+    @property
+    def table(self) -> str:
+        return "+".join(sorted(self.tables)) or "none"
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started if self.seconds is None else self.seconds
+
+    def finish(self):
+        self.seconds = self.elapsed()
+        REQUEST_SECONDS.labels(endpoint=self.endpoint, table=self.table).observe(self.seconds)
+        for name, seconds in self.phases.items():
+            PHASE_SECONDS.labels(endpoint=self.endpoint, table=self.table, phase=name).observe(seconds)
+
+    @property
+    def slow(self) -> bool:
+        return SLOW_REQUEST_MS > 0 and self.elapsed() * 1000 >= SLOW_REQUEST_MS
+
+    def server_timing(self) -> str:
+        """Server-Timing value for the phases so far; streamed bodies add theirs after the headers."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def describe(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.phases.items())
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def start_profile(endpoint: str, target: str = "") -> RequestProfile:
+    """Profile the current request; tasks it spawns (asyncio.gather) inherit it."""
+    profile = RequestProfile(endpoint, target)
+    _current.set(profile)
+    return profile
+
+
+def set_table(table: str):
+    profile = _current.get()
+    if profile is not None:
+        profile.tables.add(table)
+
+
+@contextmanager
+def phase(name: str):
+    """Add the block's duration to the current request's `name` phase; a no-op outside requests."""
+    profile = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.add(name, time.perf_counter() - started)
+
+
+def record_query(query: str, args: tuple, seconds: float):
+    profile = _current.get()
+    if profile is not None:
+        profile.queries.append((seconds, query, args))
+
+
+_explain_lock = asyncio.Lock()
+# Running slow-request logs; the event loop only keeps weak references to tasks
+_slow_logs: Set[asyncio.Task] = set()
+
+
+def report_slow_request(pool, profile: RequestProfile):
+    """Log a finished request in the background if it was slow; the response is never held up."""
+    if not profile.slow:
+        return
+    task = asyncio.create_task(log_slow_request(pool, profile))
+    _slow_logs.add(task)
+    task.add_done_callback(_slow_logs.discard)
+
+
+async def log_slow_request(pool, profile: RequestProfile):
+    """Log a slow request's phases and, if enabled, the plan of its slowest query."""
+    logging.warning(f"[SLOW] {profile.target} took {profile.elapsed() * 1000:.0f} ms "
+                    f"(table {profile.table}, {len(profile.queries)} query(s)): {profile.describe()}")
+    if not SLOW_QUERY_EXPLAIN or not profile.queries or _explain_lock.locked():
+        return
+    seconds, query, args = max(profile.queries, key=lambda q: q[0])
+    async with _explain_lock:
+        try:
+            async with pool.acquire() as conn:
+                # ANALYZE executes the statement; the read-only transaction keeps that harmless
+                async with conn.transaction(readonly=True):
+                    plan = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+        except Exception as e:
+            logging.warning(f"[SLOW] Could not explain query from {profile.target}: {e}")
+            return
+    logging.warning(f"[SLOW] Plan for {profile.target} ({seconds * 1000:.0f} ms, args {args}):\n"
+                    + "\n".join(row[0] for row in plan))
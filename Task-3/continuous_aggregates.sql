@@ -0,0 +1,116 @@
+-- Continuous-aggregate schema mode (TimescaleDB 2.9+ for hierarchical aggregates).
+-- Run after hypertables.sql. data_1m, data_1h and data_1d become continuous aggregates
+-- maintained by TimescaleDB from raw_data, so every ingest path (batch loaders and the
+-- Kafka worker) feeds the rollups. The writers detect the views (ROLLUP_MODE=auto) and
+-- then only write raw_data. Safe to rerun.
+
+-- Continuous aggregates that already exist; only the ones created below get the initial
+-- refresh at the end of this file
+CREATE TEMP TABLE existing_rollups AS
+SELECT view_name::TEXT AS view_name FROM timescaledb_information.continuous_aggregates;
+
+-- Migration: move plain rollup hypertables out of the way. Their contents are derived
+-- from raw_data and are rebuilt by the refreshes at the end of this file. A table left
+-- over from an earlier run keeps its name; this one gets the next free *_legacy_<n>.
+DO $$
+DECLARE
+    rollup TEXT;
+    legacy TEXT;
+    n INTEGER;
+BEGIN
+    FOREACH rollup IN ARRAY ARRAY['data_1m', 'data_1h', 'data_1d']
+    LOOP
+        CONTINUE WHEN NOT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = rollup);
+        legacy := rollup || '_legacy';
+        n := 1;
+        WHILE to_regclass(legacy) IS NOT NULL LOOP
+            n := n + 1;
+            legacy := rollup || '_legacy_' || n;
+        END LOOP;
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', rollup, legacy);
+        RAISE NOTICE 'Renamed plain table % to %', rollup, legacy;
+    END LOOP;
+END
+$$;
+
+-- 1-minute, built from raw_data
+CREATE MATERIALIZED VIEW IF NOT EXISTS data_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    user_key,
+    metric_key,
+    time_bucket(INTERVAL '1 minute', timestamp) AS timestamp,
+    avg(value) AS avg_value,
+    sum(value) AS sum_value,
+    count(value) AS count_value,
+    min(value) AS min_value,
+    max(value) AS max_value
+FROM raw_data
+GROUP BY user_key, metric_key, time_bucket(INTERVAL '1 minute', timestamp)
+WITH NO DATA;
+
+-- 1-hour, built from data_1m by merging partial state
+CREATE MATERIALIZED VIEW IF NOT EXISTS data_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    user_key,
+    metric_key,
+    time_bucket(INTERVAL '1 hour', timestamp) AS timestamp,
+    sum(sum_value) / NULLIF(sum(count_value), 0) AS avg_value,
+    sum(sum_value) AS sum_value,
+    sum(count_value)::BIGINT AS count_value,
+    min(min_value) AS min_value,
+    max(max_value) AS max_value
+FROM data_1m
+GROUP BY user_key, metric_key, time_bucket(INTERVAL '1 hour', timestamp)
+WITH NO DATA;
+
+-- 1-day, built from data_1h
+CREATE MATERIALIZED VIEW IF NOT EXISTS data_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    user_key,
+    metric_key,
+    time_bucket(INTERVAL '1 day', timestamp) AS timestamp,
+    sum(sum_value) / NULLIF(sum(count_value), 0) AS avg_value,
+    sum(sum_value) AS sum_value,
+    sum(count_value)::BIGINT AS count_value,
+    min(min_value) AS min_value,
+    max(max_value) AS max_value
+FROM data_1h
+GROUP BY user_key, metric_key, time_bucket(INTERVAL '1 day', timestamp)
+WITH NO DATA;
+
+-- Refresh policies: each level trails the one below it. materialized_only = false above
+-- serves the newest, not-yet-materialized buckets from the source in real time. Rows older
+-- than a policy's start_offset (backfills, Kafka replays) are refreshed by the writers
+-- themselves (RollupRefresher in common/rollups.py) over the range they committed.
+SELECT add_continuous_aggregate_policy('data_1m',
+    start_offset => INTERVAL '2 hours',
+    end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute',
+    if_not_exists => TRUE);
+
+SELECT add_continuous_aggregate_policy('data_1h',
+    start_offset => INTERVAL '2 days',
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '15 minutes',
+    if_not_exists => TRUE);
+
+SELECT add_continuous_aggregate_policy('data_1d',
+    start_offset => INTERVAL '7 days',
+    end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 hour',
+    if_not_exists => TRUE);
+
+-- Initial materialization of everything already in raw_data, bottom-up, for the views
+-- created by this run only. Refreshing an existing view over its whole range would drop
+-- buckets whose raw rows a retention policy already removed.
+SELECT format('CALL refresh_continuous_aggregate(%L, NULL, NULL)', r.view_name)
+FROM unnest(ARRAY['data_1m', 'data_1h', 'data_1d']) WITH ORDINALITY AS r(view_name, level)
+WHERE r.view_name NOT IN (SELECT view_name FROM existing_rollups)
+ORDER BY r.level
+\gexec
+
+-- Once the aggregates are verified, the renamed tables can be dropped:
+-- DROP TABLE IF EXISTS data_1m_legacy, data_1h_legacy, data_1d_legacy;  -- and any *_legacy_<n>
@@ -1,10 +1,46 @@
+-- Lookup tables: every row below stores small integer keys instead of repeating the
+-- user and metric names (common/series_ids.py caches them in the loaders and the API)
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+-- Migration: tables created with user_id/metric TEXT columns are renamed to *_text and
+-- copied into the keyed tables at the end of this file. Rollups that are continuous
+-- aggregates are dropped; rerun continuous_aggregates.sql to rebuild them from raw_data.
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['data_1d', 'data_1h', 'data_1m', 'raw_data']
+    LOOP
+        IF EXISTS (SELECT 1 FROM timescaledb_information.continuous_aggregates
+                   WHERE view_name = tbl)
+           AND EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = tbl AND column_name = 'user_id') THEN
+            EXECUTE format('DROP MATERIALIZED VIEW %I', tbl);
+            RAISE NOTICE 'Dropped continuous aggregate %; rerun continuous_aggregates.sql', tbl;
+        ELSIF EXISTS (SELECT 1 FROM information_schema.columns
+                      WHERE table_schema = 'public' AND table_name = tbl AND column_name = 'user_id')
+              AND NOT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = tbl || '_text') THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', tbl, tbl || '_text');
+            RAISE NOTICE 'Renamed % to %_text for migration to integer keys', tbl, tbl;
+        END IF;
+    END LOOP;
+END
+$$;
+
 -- Main table
 CREATE TABLE IF NOT EXISTS raw_data (
-    user_id TEXT NOT NULL,
-    metric TEXT NOT NULL,
+    user_key INTEGER NOT NULL,
+    metric_key SMALLINT NOT NULL,
     timestamp TIMESTAMPTZ NOT NULL,
     value DOUBLE PRECISION,
-    PRIMARY KEY (user_id, metric, timestamp)
+    PRIMARY KEY (user_key, metric_key, timestamp)
 );
 
 -- Convert to hypertable
@@ -14,30 +50,135 @@ SELECT create_hypertable('raw_data', 'timestamp', if_not_exists => TRUE);
 
 -- 1-minute
 CREATE TABLE IF NOT EXISTS data_1m (
-    user_id TEXT,
-    metric TEXT,
+    user_key INTEGER,
+    metric_key SMALLINT,
     timestamp TIMESTAMPTZ,
     avg_value DOUBLE PRECISION,
-    PRIMARY KEY (user_id, metric, timestamp)
+    sum_value DOUBLE PRECISION,
+    count_value BIGINT,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    PRIMARY KEY (user_key, metric_key, timestamp)
 );
-SELECT create_hypertable('data_1m', 'timestamp', if_not_exists => TRUE);
 
 -- 1-hour
 CREATE TABLE IF NOT EXISTS data_1h (
-    user_id TEXT,
-    metric TEXT,
+    user_key INTEGER,
+    metric_key SMALLINT,
     timestamp TIMESTAMPTZ,
     avg_value DOUBLE PRECISION,
-    PRIMARY KEY (user_id, metric, timestamp)
+    sum_value DOUBLE PRECISION,
+    count_value BIGINT,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    PRIMARY KEY (user_key, metric_key, timestamp)
 );
-SELECT create_hypertable('data_1h', 'timestamp', if_not_exists => TRUE);
 
 -- 1-day
 CREATE TABLE IF NOT EXISTS data_1d (
-    user_id TEXT,
-    metric TEXT,
+    user_key INTEGER,
+    metric_key SMALLINT,
     timestamp TIMESTAMPTZ,
     avg_value DOUBLE PRECISION,
-    PRIMARY KEY (user_id, metric, timestamp)
+    sum_value DOUBLE PRECISION,
+    count_value BIGINT,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    PRIMARY KEY (user_key, metric_key, timestamp)
 );
-SELECT create_hypertable('data_1d', 'timestamp', if_not_exists => TRUE);
\ No newline at end of file
+
+-- Only plain tables become hypertables: rollups that are already continuous aggregates
+-- (continuous_aggregates.sql) are views, and CREATE TABLE IF NOT EXISTS left them alone
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['data_1m', 'data_1h', 'data_1d']
+    LOOP
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = to_regclass(tbl)) IS DISTINCT FROM 'r';
+        PERFORM create_hypertable(tbl::regclass, 'timestamp', if_not_exists => TRUE);
+    END LOOP;
+END
+$$;
+
+-- Names next to the keys, for ad-hoc queries and dashboards
+CREATE OR REPLACE VIEW raw_data_named AS
+SELECT u.name AS user_id, m.name AS metric, r.timestamp, r.value
+FROM raw_data r
+JOIN users u ON u.id = r.user_key
+JOIN metrics m ON m.id = r.metric_key;
+
+-- Migration, continued: copy the *_text tables into the keyed ones (only while those are
+-- still empty, so reruns do nothing). Drop the *_text tables once verified:
+-- DROP TABLE IF EXISTS raw_data_text, data_1m_text, data_1h_text, data_1d_text;
+DO $$
+DECLARE
+    tbl TEXT;
+    has_rows BOOLEAN;
+    columns TEXT[];
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['raw_data', 'data_1m', 'data_1h', 'data_1d']
+    LOOP
+        CONTINUE WHEN NOT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = tbl || '_text');
+        -- Continuous aggregates rebuild themselves from raw_data
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = to_regclass(tbl)) IS DISTINCT FROM 'r';
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I)', tbl) INTO has_rows;
+        CONTINUE WHEN has_rows;
+
+        EXECUTE format('INSERT INTO users (name) SELECT DISTINCT user_id FROM %I ON CONFLICT (name) DO NOTHING', tbl || '_text');
+        EXECUTE format('INSERT INTO metrics (name) SELECT DISTINCT metric FROM %I ON CONFLICT (name) DO NOTHING', tbl || '_text');
+
+        -- Every column after user_id/metric; older rollups may lack the partial-state ones
+        SELECT array_agg(quote_ident(column_name::TEXT) ORDER BY ordinal_position)
+        INTO columns
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = tbl || '_text' AND column_name NOT IN ('user_id', 'metric');
+
+        EXECUTE format('INSERT INTO %I (user_key, metric_key, %s)
+            SELECT u.id, m.id, %s
+            FROM %I t
+            JOIN users u ON u.name = t.user_id
+            JOIN metrics m ON m.name = t.metric',
+            tbl, array_to_string(columns, ', '),
+            (SELECT string_agg('t.' || c, ', ') FROM unnest(columns) AS c),
+            tbl || '_text');
+        RAISE NOTICE 'Copied %_text into keyed %', tbl, tbl;
+    END LOOP;
+END
+$$;
+
+-- Mergeable partial state for rollups created before sum/count/min/max existed.
+-- Buckets that only carry avg_value are rebuilt from raw_data so later merges stay exact.
+DO $$
+DECLARE
+    rollup RECORD;
+BEGIN
+    FOR rollup IN SELECT * FROM (VALUES ('data_1m', '1 minute'), ('data_1h', '1 hour'), ('data_1d', '1 day')) AS r(tbl, width)
+    LOOP
+        -- Continuous aggregates already carry the partial state
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = to_regclass(rollup.tbl)) IS DISTINCT FROM 'r';
+        EXECUTE format('ALTER TABLE %I
+            ADD COLUMN IF NOT EXISTS sum_value DOUBLE PRECISION,
+            ADD COLUMN IF NOT EXISTS count_value BIGINT,
+            ADD COLUMN IF NOT EXISTS min_value DOUBLE PRECISION,
+            ADD COLUMN IF NOT EXISTS max_value DOUBLE PRECISION', rollup.tbl);
+
+        EXECUTE format('UPDATE %1$I AS agg SET
+                sum_value = src.sum_value,
+                count_value = src.count_value,
+                min_value = src.min_value,
+                max_value = src.max_value,
+                avg_value = src.sum_value / NULLIF(src.count_value, 0)
+            FROM (
+                SELECT user_key, metric_key, time_bucket(%2$L::interval, timestamp) AS bucket,
+                       sum(value) AS sum_value, count(value) AS count_value,
+                       min(value) AS min_value, max(value) AS max_value
+                FROM raw_data
+                GROUP BY 1, 2, 3
+            ) AS src
+            WHERE agg.count_value IS NULL
+              AND agg.user_key = src.user_key AND agg.metric_key = src.metric_key AND agg.timestamp = src.bucket',
+            rollup.tbl, rollup.width);
+    END LOOP;
+END
+$$;
\ No newline at end of file
@@ -1,10 +1,18 @@
 import os
 import json
+import time
 import psycopg2
-import pandas as pd
-from datetime import datetime
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from common.checkpoint import begin_file, create_manifest_table, save_checkpoint
+from common.instrumentation import LoaderMetrics, push_metrics, serve_metrics
+from common.notify import notify_ingest
+from common.record_batch import RecordBatch
+from common.rollups import RollupRefresher, plain_rollups, upsert_partials
+from common.series_ids import SeriesIds
+from common.sketches import merge_sketches
+
 load_dotenv()
 
 DB_PARAMS = {
@@ -15,71 +23,156 @@ DB_PARAMS = {
     "port": os.getenv("TSDB_PORT", "5432"),
 }
 
-AGG_WINDOWS = {
-    "data_1m": "1min",
-    "data_1h": "1h",
-    "data_1d": "1d"
-}
+# "auto" merges rollups here into every one that is a plain table and leaves continuous
+# aggregates (continuous_aggregates.sql) to TimescaleDB; "continuous" only writes raw_data
+ROLLUP_MODE = os.getenv("ROLLUP_MODE", "auto")
+# Quantile sketches (sketches.sql) can't be continuous aggregates, so every writer merges
+# them in either mode once the tables exist; SKETCHES=0 skips them
+SKETCHES = os.getenv("SKETCHES", "1") == "1"
 
-EXTRACTED_DIR = "extracted_data"
+EXTRACTED_DIR = os.getenv("EXTRACTED_DIR", "extracted_data")
+# Name under which this loader's progress is kept in the ingest manifest
+LOADER_NAME = "ingestion_update"
+METRICS = LoaderMetrics(LOADER_NAME)
+# user/metric name -> integer key cache for raw_data and the rollups
+IDS = SeriesIds(lambda: psycopg2.connect(**DB_PARAMS))
+# Range written since the last file, refreshed into the rollups that are continuous aggregates
+ROLLUP_REFRESH = RollupRefresher(lambda: psycopg2.connect(**DB_PARAMS))
+# Skip files already ingested according to the manifest; RESUME=0 forces a full pass
+RESUME = os.getenv("RESUME", "1") == "1"
 
-def insert_raw_and_aggregates(records):
+def insert_raw_and_aggregates(records, before_commit=None):
     print(f"Inserting {len(records)} raw records and computing aggregates...")
+    started = time.perf_counter()
     conn = psycopg2.connect(**DB_PARAMS)
     cur = conn.cursor()
 
-    for row in records:
-        cur.execute(
+    with METRICS.stage("batch_build"):
+        values = IDS.encode(RecordBatch.from_records(records)).rows()
+
+    # RETURNING only yields rows that were actually new, so rows already in raw_data
+    # (reruns, overlapping files) are never counted into the rollups twice.
+    with METRICS.stage("db_write"):
+        inserted = execute_values(
+            cur,
             """
-            INSERT INTO raw_data (user_id, metric, timestamp, value)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT DO NOTHING;
+            INSERT INTO raw_data (user_key, metric_key, timestamp, value)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING user_key, metric_key, timestamp, value;
             """,
-            (row["user_id"], row["metric"], row["timestamp"], row["value"])
+            values,
+            page_size=10000,
+            fetch=True,
         )
+    print(f"{len(inserted)} new raw rows ({len(records) - len(inserted)} already present)")
 
-    df = pd.DataFrame(records)
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    if inserted:
+        with METRICS.stage("normalize"):
+            batch = RecordBatch.from_rows(inserted)
+            named = IDS.decode(batch)
 
-    for table, rule in AGG_WINDOWS.items():
-        print(f"Aggregating into {table} using {rule} interval...")
-        df_agg = (
-            df.groupby(["user_id", "metric", pd.Grouper(key="timestamp", freq=rule)])
-            .agg(avg_value=("value", "mean"))
-            .reset_index()
-        )
+        # Let the API drop cached results overlapping what was just written
+        notify_ingest(cur, named.series_ranges())
 
-        for _, row in df_agg.iterrows():
-            cur.execute(
-                f"""
-                INSERT INTO {table} (user_id, metric, timestamp, avg_value)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT DO NOTHING;
-                """,
-                (row.user_id, row.metric, row.timestamp, row.avg_value)
-            )
+    if inserted:
+        with METRICS.stage("rollup"):
+            for table, width in plain_rollups(cur, ROLLUP_MODE).items():
+                print(f"Aggregating into {table} using {width} interval...")
+                merged = upsert_partials(cur, table, batch.partials(width))
+                print(f"Merged {merged} bucket(s) into {table}")
 
-    conn.commit()
+    if inserted and SKETCHES:
+        with METRICS.stage("sketch"):
+            for table, merged in merge_sketches(cur, named).items():
+                print(f"Merged {merged} sketch(es) into {table}")
+
+    # Checkpoint in the same transaction so a file is never half-counted in the rollups
+    if before_commit is not None:
+        before_commit(cur)
+    with METRICS.stage("commit"):
+        conn.commit()
     cur.close()
     conn.close()
+    ROLLUP_REFRESH.add_rows(inserted)
+    METRICS.batch(len(records), len(inserted), seconds=time.perf_counter() - started)
     print("All data inserted and aggregated.")
 
 
+def refresh_rollups():
+    """Materialize committed rows into continuous-aggregate rollups beyond their policy windows."""
+    try:
+        with METRICS.stage("rollup"):
+            ROLLUP_REFRESH.refresh()
+    except psycopg2.Error as e:
+        print(f"[WARNING] Could not refresh continuous aggregates (retried after the next file): {e}")
+
+
+def create_manifest():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            create_manifest_table(cur)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def file_offset(file, filepath):
+    """Rows of `file` already ingested per the manifest, or None if it is complete."""
+    if not RESUME:
+        return 0
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            offset = begin_file(cur, LOADER_NAME, file, filepath)
+        conn.commit()
+    finally:
+        conn.close()
+    return offset
+
+
+def data_files(data_dir):
+    """JSON arrays and NDJSON shards, recursively so per-participant directories from Task-0 are included."""
+    for root, _, files in sorted(os.walk(data_dir)):
+        for filename in sorted(files):
+            if filename.endswith((".json", ".ndjson")):
+                yield os.path.join(root, filename)
+
+
+def load_records(filepath):
+    with open(filepath, "r") as f:
+        if filepath.endswith(".ndjson"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
 if __name__ == "__main__":
     print("Starting ingestion_update pipeline...")
-    files = [f for f in os.listdir(EXTRACTED_DIR) if f.endswith(".json")]
+    serve_metrics()
+    create_manifest()
 
-    for file in files:
-        filepath = os.path.join(EXTRACTED_DIR, file)
-        print(f"Loading {filepath}")
+    for filepath in data_files(EXTRACTED_DIR):
+        # Manifest key; top-level files keep their bare name
+        file = os.path.relpath(filepath, EXTRACTED_DIR)
         try:
-            with open(filepath, "r") as f:
-                records = json.load(f)
+            if file_offset(file, filepath) is None:
+                print(f"Skipping {file} (already ingested)")
+                continue
+            print(f"Loading {filepath}")
+            with METRICS.stage("parse"):
+                records = load_records(filepath)
             if not records:
                 print(f"No records in {file}, skipping.")
                 continue
-            insert_raw_and_aggregates(records)
+            # Each file commits in one transaction, so there is never a partial offset to resume
+            insert_raw_and_aggregates(
+                records,
+                before_commit=lambda cur: save_checkpoint(cur, LOADER_NAME, file, len(records), True),
+            )
         except Exception as e:
             print(f"Failed to process {file}: {e}")
+        refresh_rollups()
 
+    push_metrics(LOADER_NAME)
     print("ingestion_update finished.")
\ No newline at end of file
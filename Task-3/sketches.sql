@@ -0,0 +1,87 @@
+-- Mergeable quantile sketches per bucket, alongside the data_1h / data_1d rollups.
+-- Run after hypertables.sql. ingestion_update.py keeps them current from then on.
+--
+-- bins maps a DDSketch-style bin key to a count: "p<i>" holds positive values in
+-- (gamma^(i-1), gamma^i], "n<i>" the same for negative values, "z" values near zero,
+-- with gamma = (1 + alpha) / (1 - alpha) and alpha = 0.01 (SKETCH_ALPHA in common/sketches.py).
+-- Rows with user_id '*' merge every participant, so population quantiles read one
+-- sketch per bucket however large the cohort is.
+
+-- Merging two sketches is adding their counts bin by bin
+CREATE OR REPLACE FUNCTION sketch_merge(a JSONB, b JSONB) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::JSONB)
+    FROM (
+        SELECT key, sum(value::BIGINT) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::JSONB))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::JSONB))
+        ) AS bins
+        GROUP BY key
+    ) AS merged;
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+-- sketch_union(bins) merges any number of sketches, across users and/or time
+CREATE OR REPLACE AGGREGATE sketch_union(JSONB) (
+    SFUNC = sketch_merge,
+    STYPE = JSONB,
+    COMBINEFUNC = sketch_merge,
+    INITCOND = '{}',
+    PARALLEL = SAFE
+);
+
+CREATE TABLE IF NOT EXISTS sketch_1h (
+    user_id TEXT,
+    metric TEXT,
+    timestamp TIMESTAMPTZ,
+    count_value BIGINT,
+    bins JSONB,
+    PRIMARY KEY (user_id, metric, timestamp)
+);
+SELECT create_hypertable('sketch_1h', 'timestamp', if_not_exists => TRUE);
+
+CREATE TABLE IF NOT EXISTS sketch_1d (
+    user_id TEXT,
+    metric TEXT,
+    timestamp TIMESTAMPTZ,
+    count_value BIGINT,
+    bins JSONB,
+    PRIMARY KEY (user_id, metric, timestamp)
+);
+SELECT create_hypertable('sketch_1d', 'timestamp', if_not_exists => TRUE);
+
+-- Backfill from raw_data on first run. Only sketch_1h reads raw rows; the population
+-- rows and sketch_1d are merged from it, which is exact because sketches are mergeable.
+-- Sketch tables keep user_id/metric names: the population rows use user_id '*'.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM sketch_1h LIMIT 1) THEN
+        INSERT INTO sketch_1h (user_id, metric, timestamp, count_value, bins)
+        SELECT user_id, metric, bucket, sum(n), jsonb_object_agg(key, n)
+        FROM (
+            SELECT user_id, metric, time_bucket(INTERVAL '1 hour', timestamp) AS bucket,
+                   CASE
+                       WHEN abs(value) < 1e-9 THEN 'z'
+                       WHEN value > 0 THEN 'p' || ceil(ln(value) / ln(1.01 / 0.99))::BIGINT
+                       ELSE 'n' || ceil(ln(-value) / ln(1.01 / 0.99))::BIGINT
+                   END AS key,
+                   count(*) AS n
+            FROM raw_data_named
+            WHERE value IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        ) AS binned
+        GROUP BY user_id, metric, bucket;
+
+        INSERT INTO sketch_1h (user_id, metric, timestamp, count_value, bins)
+        SELECT '*', metric, timestamp, sum(count_value), sketch_union(bins)
+        FROM sketch_1h
+        GROUP BY metric, timestamp;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM sketch_1d LIMIT 1) THEN
+        INSERT INTO sketch_1d (user_id, metric, timestamp, count_value, bins)
+        SELECT user_id, metric, time_bucket(INTERVAL '1 day', timestamp), sum(count_value), sketch_union(bins)
+        FROM sketch_1h
+        GROUP BY 1, 2, 3;
+    END IF;
+END $$;
@@ -0,0 +1,64 @@
+-- Storage tiering for raw_data and the rollups: chunk sizing, native compression and retention.
+-- Run after hypertables.sql (and continuous_aggregates.sql, if used). Safe to rerun.
+-- Check the effect with: python storage_report.py
+
+-- Chunk sizing: a chunk (plus its indexes) should fit in ~25% of shared memory while it is
+-- being written. At 1 Hz per metric, one participant adds ~350k raw rows/day, so a day-wide
+-- chunk stays small up to a few hundred participants; shrink the interval as the cohort
+-- grows (e.g. 6 hours at 1k, 1 hour at 10k). Only chunks created afterwards are affected.
+SELECT set_chunk_time_interval('raw_data', INTERVAL '1 day');
+
+-- Native compression: one compressed segment per series, ordered by time, so a
+-- (user_key, metric_key, time range) query decompresses only the segments it needs.
+ALTER TABLE raw_data SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'user_key, metric_key',
+    timescaledb.compress_orderby = 'timestamp'
+);
+-- Late rows for compressed chunks are slower to insert, so leave a week uncompressed.
+SELECT add_compression_policy('raw_data', INTERVAL '7 days', if_not_exists => TRUE);
+
+-- Retention for raw_data is opt-in: psql -v raw_retention='90 days' -f storage_policies.sql
+-- Dropping a raw chunk is only safe once every rollup covers it. Plain rollup tables are
+-- merged at ingest time, so they do. Continuous aggregates only hold what has been
+-- refreshed, and refreshing a range whose raw chunks are gone empties its buckets: with
+-- them, enable retention only if no data older than the retention window (e.g. a 2024
+-- backfill) will be written again. Without the variable no policy is added; an existing
+-- one is kept (remove it with SELECT remove_retention_policy('raw_data');).
+\if :{?raw_retention}
+SELECT add_retention_policy('raw_data', :'raw_retention'::INTERVAL, if_not_exists => TRUE);
+\endif
+
+-- Rollup tiers: coarser tables get wider chunks and longer retention; data_1d is kept forever.
+DO $$
+DECLARE
+    tier RECORD;
+    is_cagg BOOLEAN;
+BEGIN
+    FOR tier IN SELECT * FROM (VALUES
+        ('data_1m', INTERVAL '7 days', INTERVAL '30 days', INTERVAL '1 year'),
+        ('data_1h', INTERVAL '30 days', INTERVAL '90 days', INTERVAL '5 years'),
+        ('data_1d', INTERVAL '365 days', INTERVAL '365 days', NULL::INTERVAL)
+    ) AS t(name, chunk_interval, compress_after, drop_after)
+    LOOP
+        SELECT EXISTS (
+            SELECT 1 FROM timescaledb_information.continuous_aggregates WHERE view_name = tier.name
+        ) INTO is_cagg;
+
+        IF is_cagg THEN
+            EXECUTE format('ALTER MATERIALIZED VIEW %I SET (timescaledb.compress = true)', tier.name);
+        ELSE
+            PERFORM set_chunk_time_interval(tier.name::regclass, tier.chunk_interval);
+            EXECUTE format('ALTER TABLE %I SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = ''user_key, metric_key'',
+                timescaledb.compress_orderby = ''timestamp'')', tier.name);
+        END IF;
+
+        PERFORM add_compression_policy(tier.name::regclass, tier.compress_after, if_not_exists => TRUE);
+        IF tier.drop_after IS NOT NULL THEN
+            PERFORM add_retention_policy(tier.name::regclass, tier.drop_after, if_not_exists => TRUE);
+        END IF;
+    END LOOP;
+END
+$$;
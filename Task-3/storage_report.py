@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PARAMS = {
+    "dbname": os.getenv("POSTGRES_DB", "wearipedia"),
+    "user": os.getenv("POSTGRES_USER", "wearipedia_user"),
+    "password": os.getenv("POSTGRES_PASSWORD", "19768003"),
+    "host": os.getenv("TSDB_HOST", "timescaledb"),
+    "port": os.getenv("TSDB_PORT", "5432"),
+}
+
+# Assumptions baked into Task-0a/task.py's volume estimates
+ESTIMATED_BYTES_PER_POINT = 16
+ESTIMATED_COMPRESSION_RATE = 0.80
+
+# Row counts come from the compression catalog for compressed chunks (exact, free)
+# and from planner statistics for uncompressed ones (approximate, avoids a full scan).
+CHUNK_QUERY = """
+SELECT
+    c.chunk_schema,
+    c.chunk_name,
+    c.range_start,
+    c.range_end,
+    c.is_compressed,
+    s.before_compression_total_bytes,
+    s.after_compression_total_bytes,
+    chunk_size.total_bytes,
+    cs.numrows_pre_compression
+FROM timescaledb_information.chunks c
+LEFT JOIN chunk_compression_stats(%(table)s::regclass) s
+    ON s.chunk_schema = c.chunk_schema AND s.chunk_name = c.chunk_name
+LEFT JOIN _timescaledb_catalog.chunk cat
+    ON cat.schema_name = c.chunk_schema AND cat.table_name = c.chunk_name
+LEFT JOIN _timescaledb_catalog.compression_chunk_size cs
+    ON cs.chunk_id = cat.id
+CROSS JOIN LATERAL (
+    SELECT pg_total_relation_size(format('%%I.%%I', c.chunk_schema, c.chunk_name)::regclass) AS total_bytes
+) chunk_size
+WHERE c.hypertable_name = %(table)s
+ORDER BY c.range_start;
+"""
+
+
+def chunk_stats(cur, table):
+    cur.execute(CHUNK_QUERY, {"table": table})
+    chunks = []
+    for (schema, name, range_start, range_end, is_compressed,
+         before_bytes, after_bytes, total_bytes, rows) in cur.fetchall():
+        if not is_compressed or rows is None:
+            cur.execute("SELECT approximate_row_count(%s::regclass)", (f"{schema}.{name}",))
+            rows = cur.fetchone()[0]
+            before_bytes = after_bytes = total_bytes
+
+        chunks.append({
+            "chunk": f"{schema}.{name}",
+            "range_start": range_start.isoformat(),
+            "range_end": range_end.isoformat(),
+            "compressed": bool(is_compressed),
+            "rows": int(rows or 0),
+            "bytes_before": int(before_bytes or 0),
+            "bytes_after": int(after_bytes or 0),
+        })
+    return chunks
+
+
+def summarize(chunks):
+    rows = sum(c["rows"] for c in chunks)
+    before = sum(c["bytes_before"] for c in chunks)
+    after = sum(c["bytes_after"] for c in chunks)
+    compressed = [c for c in chunks if c["compressed"]]
+    compressed_before = sum(c["bytes_before"] for c in compressed)
+    compressed_after = sum(c["bytes_after"] for c in compressed)
+    return {
+        "chunks": len(chunks),
+        "compressed_chunks": len(compressed),
+        "rows": rows,
+        "bytes": after,
+        "bytes_per_point": after / rows if rows else None,
+        "uncompressed_bytes_per_point": before / rows if rows else None,
+        # Only compressed chunks say anything about the achieved rate
+        "compression_rate": 1 - compressed_after / compressed_before if compressed_before else None,
+    }
+
+
+def fmt(value, spec, width=0):
+    return "n/a".rjust(width) if value is None else format(value, spec).rjust(width)
+
+
+def print_report(table, chunks, summary):
+    print(f"=== Storage report: {table} ===\n")
+    print(f"{'chunk':<45} {'start':<26} {'rows':>12} {'bytes':>14} {'ratio':>7} {'B/pt':>8}")
+    for c in chunks:
+        ratio = 1 - c["bytes_after"] / c["bytes_before"] if c["compressed"] and c["bytes_before"] else None
+        per_point = c["bytes_after"] / c["rows"] if c["rows"] else None
+        print(f"{c['chunk']:<45} {c['range_start']:<26} {c['rows']:>12,} {c['bytes_after']:>14,} "
+              f"{fmt(ratio, '.1%', 7)} {fmt(per_point, '.2f', 8)}")
+
+    print(f"\n  → Chunks (compressed)      : {summary['chunks']} ({summary['compressed_chunks']})")
+    print(f"  → Points                   : {summary['rows']:,}")
+    print(f"  → Bytes on disk            : {summary['bytes']:,}")
+    print(f"  → Bytes per point          : {fmt(summary['bytes_per_point'], '.2f')} "
+          f"(estimator assumes {ESTIMATED_BYTES_PER_POINT * (1 - ESTIMATED_COMPRESSION_RATE):.2f} compressed)")
+    print(f"  → Compression rate         : {fmt(summary['compression_rate'], '.1%')} "
+          f"(estimator assumes {ESTIMATED_COMPRESSION_RATE:.0%})\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report achieved compression and bytes per point per chunk.")
+    parser.add_argument("tables", nargs="*", default=["raw_data"])
+    parser.add_argument("--json", action="store_true", help="Emit machine-readable JSON instead of a table")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    conn = psycopg2.connect(**DB_PARAMS)
+    report = {}
+    try:
+        with conn.cursor() as cur:
+            for table in args.tables:
+                chunks = chunk_stats(cur, table)
+                report[table] = {"summary": summarize(chunks), "chunks": chunks}
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for table, result in report.items():
+            print_report(table, result["chunks"], result["summary"])
@@ -19,6 +19,8 @@ import './App.css';
 ChartJS.register(LineElement, CategoryScale, LinearScale, PointElement, Title, Tooltip, Legend);
 
 const API_BASE = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+// The chart is ~1,400px wide; more points than pixels only slow down rendering
+const MAX_POINTS = 1400;
 
 export default function App() {
   const [startDate, setStartDate] = useState(new Date('2024-01-01'));
@@ -38,12 +40,13 @@ export default function App() {
           start_date: startDate.toISOString().split('T')[0],
           end_date: endDate.toISOString().split('T')[0],
           user_id: userId,
-          metric
+          metric,
+          max_points: MAX_POINTS
         }
       });
       setData(res.data);
     } catch (err) {
-      setError(err.response?.data?.error || err.message);
+      setError(err.response?.data?.detail || err.message);
     } finally {
       setLoading(false);
     }
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import time
+
+from kafka import KafkaProducer
+from kafka.admin import KafkaAdminClient, NewTopic
+from kafka.errors import TopicAlreadyExistsError
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+KAFKA_BOOTSTRAP = os.getenv("KAFKA_BROKER", "kafka:9092")
+KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "wearipedia_stream")
+DATA_DIR = os.getenv("DATA_DIR", "extracted_data")
+# Report progress every this many records
+REPORT_EVERY = 100_000
+
+
+def iter_file_records(filepath):
+    """Records from a Task-0 JSON array file or NDJSON shard."""
+    with open(filepath, "r") as f:
+        if filepath.endswith(".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    if isinstance(data, list):
+        yield from (item for item in data if isinstance(item, dict))
+
+
+def iter_data_files(data_dir):
+    # Recursive so per-participant shard directories from Task-0 are picked up too
+    for root, _, files in os.walk(data_dir):
+        for filename in sorted(files):
+            if filename.endswith((".json", ".ndjson")):
+                yield os.path.join(root, filename)
+
+
+def create_topic(partitions):
+    admin = KafkaAdminClient(bootstrap_servers=[KAFKA_BOOTSTRAP])
+    try:
+        admin.create_topics([NewTopic(name=KAFKA_TOPIC, num_partitions=partitions, replication_factor=1)])
+        print(f"[INFO] Created topic {KAFKA_TOPIC} with {partitions} partition(s)")
+    except TopicAlreadyExistsError:
+        print(f"[INFO] Topic {KAFKA_TOPIC} already exists; partition count left unchanged")
+    finally:
+        admin.close()
+
+
+def replay(data_dir, rate, limit=None):
+    """
+    Send every record under `data_dir` to KAFKA_TOPIC, keyed by user_id so each
+    participant's records stay ordered within one partition. `rate` is records per
+    second (0 = as fast as the broker accepts them).
+    """
+    producer = KafkaProducer(
+        bootstrap_servers=[KAFKA_BOOTSTRAP],
+        key_serializer=lambda k: k.encode("utf-8"),
+        value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        linger_ms=20,
+        batch_size=256 * 1024,
+    )
+    sent = 0
+    started = time.monotonic()
+    try:
+        for filepath in iter_data_files(data_dir):
+            print(f"[INFO] Replaying {filepath}")
+            for record in iter_file_records(filepath):
+                if limit is not None and sent >= limit:
+                    return sent
+                producer.send(KAFKA_TOPIC, key=str(record.get("user_id", "")), value=record)
+                sent += 1
+                if rate > 0:
+                    # Sleep off any lead over the target schedule
+                    ahead = sent / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+                if sent % REPORT_EVERY == 0:
+                    elapsed = time.monotonic() - started
+                    print(f"[INFO] Sent {sent:,} records ({sent / elapsed:,.0f}/s)")
+    finally:
+        producer.flush()
+        producer.close()
+        elapsed = time.monotonic() - started
+        print(f"[INFO] Sent {sent:,} records in {elapsed:.1f}s ({sent / max(elapsed, 1e-9):,.0f}/s)")
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Task-0 extracted data into Kafka at a configurable rate.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory of Task-0 .json/.ndjson files")
+    parser.add_argument("--rate", type=float, default=0, help="Records per second; 0 sends as fast as possible")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many records")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the data this many times")
+    parser.add_argument("--partitions", type=int, default=None,
+                        help="Create the topic with this many partitions if it doesn't exist")
+    args = parser.parse_args()
+
+    if args.partitions:
+        create_topic(args.partitions)
+
+    total = 0
+    for _ in range(args.repeat):
+        remaining = None if args.limit is None else args.limit - total
+        if remaining is not None and remaining <= 0:
+            break
+        total += replay(args.data_dir, args.rate, remaining)
+
+
+if __name__ == "__main__":
+    main()
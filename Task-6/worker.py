@@ -1,9 +1,21 @@
 import json
 import os
+import signal
 import time
+import multiprocessing
+from datetime import datetime, timedelta, timezone
 import psycopg2
-from kafka import KafkaConsumer
-from kafka.errors import NoBrokersAvailable
+from psycopg2.extras import execute_values
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from kafka.errors import CommitFailedError, NoBrokersAvailable
+
+from common.checkpoint import create_stream_checkpoint_table, load_stream_checkpoints, save_stream_checkpoints
+from common.instrumentation import METRICS_PORT, LoaderMetrics, serve_metrics
+from common.notify import notify_ingest, series_ranges
+from common.record_batch import RecordBatch
+from common.rollups import RollupRefresher, TumblingWindows, plain_rollups, rebuild_buckets, upsert_partials
+from common.series_ids import SeriesIds
+from common.sketches import merge_sketches
 
 try:
     from dotenv import load_dotenv
@@ -18,63 +30,454 @@ DB_HOST = os.getenv("TSDB_HOST", "timescaledb")
 DB_PORT = os.getenv("TSDB_PORT", "5432")
 KAFKA_BOOTSTRAP = os.getenv("KAFKA_BROKER", "kafka:9092")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "wearipedia_stream")
+KAFKA_GROUP = os.getenv("KAFKA_GROUP", "wearipedia-group")
 
-DB_CONN = None
-for i in range(10):
-    try:
-        DB_CONN = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            host=DB_HOST,
-            port=DB_PORT,
-        )
-        print("Connected to TimescaleDB")
-        break
-    except psycopg2.OperationalError as e:
-        print(f"TimescaleDB connection failed (attempt {i+1}/10): {e}")
-        time.sleep(5)
-else:
+# A micro-batch is written once it holds BATCH_MAX_RECORDS messages or BATCH_LINGER_MS
+# has passed since its first message, whichever comes first
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", "5000"))
+BATCH_LINGER_MS = int(os.getenv("BATCH_LINGER_MS", "500"))
+# Wait before re-reading a batch whose DB write failed
+RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", "5"))
+
+# Consumer processes to run: a number, or "auto" for one per topic partition.
+# Workers share the consumer group, so Kafka spreads the partitions across them.
+WORKER_PROCESSES = os.getenv("WORKER_PROCESSES", "1")
+
+# "auto" aggregates streamed rows here into every rollup that is a plain table and leaves
+# continuous aggregates (Task-3/continuous_aggregates.sql) to TimescaleDB; "continuous"
+# only writes raw_data
+ROLLUP_MODE = os.getenv("ROLLUP_MODE", "auto")
+# Quantile sketches (Task-3/sketches.sql) are merged from the rows each batch inserts,
+# in the same transaction, once the tables exist; SKETCHES=0 skips them
+SKETCHES = os.getenv("SKETCHES", "1") == "1"
+# How long a window stays open after its end for out-of-order events
+ALLOWED_LATENESS_SECONDS = int(os.getenv("ALLOWED_LATENESS_SECONDS", "60"))
+# Windows close on event time, so with no new messages they would stay open; after
+# this long idle every open window is flushed (a later event merges into the bucket)
+WINDOW_IDLE_FLUSH_SECONDS = int(os.getenv("WINDOW_IDLE_FLUSH_SECONDS", "60"))
+# When the rollups are continuous aggregates, rows older than their refresh policies'
+# windows (replays, backfills through the topic) are refreshed at most this often
+ROLLUP_REFRESH_SECONDS = int(os.getenv("ROLLUP_REFRESH_SECONDS", "60"))
+
+REQUIRED_KEYS = ("user_id", "metric", "timestamp", "value")
+RAW_TARGET = "raw_data"
+METRICS = LoaderMetrics("kafka_worker")
+
+
+def connect_db():
+    for i in range(10):
+        try:
+            conn = psycopg2.connect(
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASS,
+                host=DB_HOST,
+                port=DB_PORT,
+            )
+            print("Connected to TimescaleDB")
+            return conn
+        except psycopg2.OperationalError as e:
+            print(f"TimescaleDB connection failed (attempt {i+1}/10): {e}")
+            time.sleep(5)
     raise Exception("Could not connect to TimescaleDB after multiple attempts.")
 
-consumer = None
-for i in range(10):
-    try:
-        consumer = KafkaConsumer(
-            KAFKA_TOPIC,
-            bootstrap_servers=[KAFKA_BOOTSTRAP],
-            value_deserializer=lambda m: json.loads(m.decode("utf-8")),
-            auto_offset_reset="earliest",
-            group_id="wearipedia-group"
-        )
-        print(f"Connected to Kafka topic: {KAFKA_TOPIC}")
-        break
-    except NoBrokersAvailable:
-        print(f"Kafka not ready (attempt {i+1}/10). Retrying...")
-        time.sleep(5)
-else:
+
+# user/metric name -> integer key cache; it outlives rebalances, since ids never change.
+# New names are committed on its own connection, opened in the worker process.
+IDS = SeriesIds(connect_db)
+
+
+def create_consumer(listener=None):
+    for i in range(10):
+        try:
+            consumer = KafkaConsumer(
+                bootstrap_servers=[KAFKA_BOOTSTRAP],
+                auto_offset_reset="earliest",
+                group_id=KAFKA_GROUP,
+                # Offsets are committed only after the batch they cover is in the DB
+                enable_auto_commit=False,
+                max_poll_records=BATCH_MAX_RECORDS,
+            )
+            consumer.subscribe([KAFKA_TOPIC], listener=listener)
+            print(f"Connected to Kafka topic: {KAFKA_TOPIC}")
+            return consumer
+        except NoBrokersAvailable:
+            print(f"Kafka not ready (attempt {i+1}/10). Retrying...")
+            time.sleep(5)
     raise Exception("Kafka not available after multiple retries.")
 
-def insert_to_tsdb(payload):
+
+def parse_timestamp(value):
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def decode(messages):
+    """(message, record) pairs for valid messages; malformed ones are logged and skipped."""
+    decoded = []
+    for message in messages:
+        try:
+            payload = json.loads(message.value.decode("utf-8"))
+            if all(payload.get(key) is not None for key in REQUIRED_KEYS):
+                payload["timestamp"] = parse_timestamp(payload["timestamp"])
+                payload["value"] = float(payload["value"])
+                decoded.append((message, payload))
+                continue
+        except (ValueError, TypeError, AttributeError) as e:
+            payload = e
+        print(f"[WARNING] Skipping malformed message at {message.topic}[{message.partition}]@{message.offset}: {payload}")
+    return decoded
+
+
+def insert_batch(cur, records):
+    """
+    Insert records into raw_data and sketch the new ones; returns the (user_id, metric,
+    timestamp) keys that were new. Their names must already be resolved in IDS.
+    """
+    if not records:
+        return set()
+    with METRICS.stage("batch_build"):
+        batch = RecordBatch.from_records(records)
+        values = IDS.encode(batch).rows()
+    with METRICS.stage("db_write"):
+        inserted = execute_values(
+            cur,
+            """
+            INSERT INTO raw_data (user_key, metric_key, timestamp, value)
+            VALUES %s
+            ON CONFLICT (user_key, metric_key, timestamp) DO NOTHING
+            RETURNING user_key, metric_key, timestamp, value
+            """,
+            values,
+            page_size=len(records),
+            fetch=True,
+        )
+        notify_ingest(cur, batch.series_ranges())
+    if SKETCHES and inserted:
+        with METRICS.stage("sketch"):
+            merge_sketches(cur, IDS.decode(RecordBatch.from_rows(inserted)))
+    return set(IDS.name_keys(row[:3] for row in inserted))
+
+
+class StreamWorker(ConsumerRebalanceListener):
+    """
+    One consumer and one DB connection. Each micro-batch is written in a single
+    transaction: new raw rows, the rollup buckets whose windows closed, and a
+    checkpoint per (partition, target) recording the highest offset whose effect
+    on that target is committed. Kafka offsets are committed afterwards but only
+    for lag reporting; on (re)assignment a worker resumes from the checkpoints, so
+    a crash replays exactly what some target is missing and nothing is counted twice.
+    """
+
+    def __init__(self, name="worker"):
+        self.name = name
+        self.pending = []
+        self.running = True
+        self.inserted = 0
+        self.started = time.monotonic()
+        self.last_message = self.started
+        self.rollup_refresh = RollupRefresher(connect_db)
+        self.last_refresh = self.started
+        # Rollup table -> open windows, empty when the database maintains the rollups
+        self.windows = {}
+        # (partition, target) -> committed offset, and partition -> highest offset read
+        self.checkpoints = {}
+        self.positions = {}
+        self.conn = connect_db()
+        with self.conn.cursor() as cur:
+            create_stream_checkpoint_table(cur)
+        self.conn.commit()
+        self.detect_rollups()
+        self.consumer = create_consumer(listener=self)
+
+    def detect_rollups(self):
+        """Keep windows for the rollups that are plain tables; continuous aggregates maintain themselves."""
+        with self.conn.cursor() as cur:
+            widths = plain_rollups(cur, ROLLUP_MODE)
+        self.conn.commit()
+        lateness = timedelta(seconds=ALLOWED_LATENESS_SECONDS)
+        windows = {table: self.windows.get(table) or TumblingWindows(width, lateness) for table, width in widths.items()}
+        if windows.keys() != self.windows.keys():
+            print(f"[{self.name}] Aggregating into {sorted(windows) or 'no rollups (continuous aggregates)'}")
+        self.windows = windows
+
+    @property
+    def targets(self):
+        return (RAW_TARGET, *self.windows)
+
+    def checkpoint(self, partition, target):
+        return self.checkpoints.get((partition, target), -1)
+
+    def on_partitions_revoked(self, revoked):
+        # Runs inside poll() before partitions move to another worker: hand them over
+        # with everything read from them written, and every open window flushed
+        if revoked:
+            print(f"[{self.name}] Partitions revoked: {sorted(tp.partition for tp in revoked)}")
+        for tp in revoked:
+            METRICS.clear_lag(tp.partition)
+        try:
+            self.flush(force=True)
+        except Exception as e:
+            # The new owner resumes from the last committed checkpoints
+            print(f"[{self.name}] Could not flush before rebalance, dropping {len(self.pending)} message(s): {e}")
+            self.reset_connection()
+        self.discard_state()
+
+    def on_partitions_assigned(self, assigned):
+        print(f"[{self.name}] Partitions assigned: {sorted(tp.partition for tp in assigned)}")
+        self.restore(assigned)
+
+    def discard_state(self):
+        self.pending = []
+        self.checkpoints = {}
+        self.positions = {}
+        for windows in self.windows.values():
+            windows.open.clear()
+
+    def restore(self, partitions):
+        """Seek each partition to just after the lowest offset every target has committed."""
+        with self.conn.cursor() as cur:
+            self.checkpoints = load_stream_checkpoints(cur, KAFKA_GROUP, KAFKA_TOPIC, [tp.partition for tp in partitions])
+        self.conn.commit()
+        for tp in partitions:
+            raw = self.checkpoints.get((tp.partition, RAW_TARGET))
+            if raw is None:
+                # Never checkpointed here: fall back to Kafka's committed offset
+                committed = self.consumer.committed(tp)
+                if committed is None:
+                    self.consumer.seek_to_beginning(tp)
+                else:
+                    self.consumer.seek(tp, committed)
+                continue
+            # A target added since (e.g. rollups just enabled) starts where raw_data is
+            for target in self.targets:
+                self.checkpoints.setdefault((tp.partition, target), raw)
+            resume = min(self.checkpoint(tp.partition, target) for target in self.targets) + 1
+            self.positions[tp.partition] = resume - 1
+            self.consumer.seek(tp, resume)
+
+    def poll_batch(self):
+        """Add polled messages to `pending` until it is full or has lingered long enough."""
+        deadline = time.monotonic() + BATCH_LINGER_MS / 1000 if self.pending else None
+        while self.running and len(self.pending) < BATCH_MAX_RECORDS:
+            if deadline is None:
+                # Nothing buffered yet: block for a while without holding anything back
+                timeout_ms = BATCH_LINGER_MS
+            else:
+                timeout_ms = int((deadline - time.monotonic()) * 1000)
+                if timeout_ms <= 0:
+                    break
+            polled = self.consumer.poll(timeout_ms=timeout_ms, max_records=BATCH_MAX_RECORDS - len(self.pending))
+            for messages in polled.values():
+                self.pending.extend(messages)
+                self.last_message = time.monotonic()
+            if self.pending and deadline is None:
+                deadline = time.monotonic() + BATCH_LINGER_MS / 1000
+
+    def flush(self, force=False):
+        """
+        Write `pending` and every closed window (all of them if `force`) in one
+        transaction, together with the new checkpoints.
+        """
+        started = time.perf_counter()
+        with METRICS.stage("parse"):
+            decoded = decode(self.pending)
+        with METRICS.stage("batch_build"):
+            IDS.resolve([record["user_id"] for _, record in decoded], [record["metric"] for _, record in decoded])
+        with self.conn.cursor() as cur:
+            # Messages at or below the raw_data checkpoint are replays: their rows are already stored
+            fresh = [record for message, record in decoded if message.offset > self.checkpoint(message.partition, RAW_TARGET)]
+            new_keys = insert_batch(cur, fresh)
+            written = len(new_keys)
+            new_timestamps = [key[2] for key in new_keys]
+
+            # Replays a rollup hasn't committed yet: whether the original insert stored the
+            # row or hit ON CONFLICT is unknown, so their buckets are rebuilt from raw_data
+            rebuild = {table: set() for table in self.windows}
+            for message, record in decoded:
+                if message.offset <= self.checkpoint(message.partition, RAW_TARGET):
+                    for table, windows in self.windows.items():
+                        if message.offset > self.checkpoint(message.partition, table):
+                            rebuild[table].add((record["user_id"], record["metric"], windows.bucket(record["timestamp"])))
+            for table, keys in rebuild.items():
+                # raw_data already holds every row an open window has for these buckets
+                for key in keys:
+                    self.windows[table].open.pop(key, None)
+
+            for message, record in decoded:
+                key = (record["user_id"], record["metric"], record["timestamp"])
+                # Count a fresh row only if it was new to raw_data, and only once per batch
+                if key not in new_keys:
+                    continue
+                new_keys.discard(key)
+                for table, windows in self.windows.items():
+                    if (*key[:2], windows.bucket(key[2])) not in rebuild[table]:
+                        windows.add(*key, record["value"], message.partition, message.offset)
+
+            with METRICS.stage("rollup"):
+                for table, windows in self.windows.items():
+                    closed = windows.close(force)
+                    if closed:
+                        upsert_partials(cur, table, IDS.key_rows(closed))
+                    if rebuild[table]:
+                        rebuild_buckets(cur, table, timedelta(seconds=windows.width),
+                                        IDS.key_rows(rebuild[table]))
+                    changed = [row[:3] for row in closed] + list(rebuild[table])
+                    if changed:
+                        # Let the API drop cached results for the buckets that changed
+                        notify_ingest(cur, series_ranges(
+                            {"user_id": row[0], "metric": row[1], "timestamp": row[2]} for row in changed
+                        ))
+
+            positions = dict(self.positions)
+            for message in self.pending:
+                positions[message.partition] = max(positions.get(message.partition, -1), message.offset)
+            checkpoints = {}
+            for partition, position in positions.items():
+                checkpoints[(partition, RAW_TARGET)] = position
+                for table, windows in self.windows.items():
+                    # Everything below the oldest offset still held in an open window is flushed
+                    held = windows.min_open_offset(partition)
+                    checkpoints[(partition, table)] = position if held is None else held - 1
+            save_stream_checkpoints(cur, KAFKA_GROUP, KAFKA_TOPIC, checkpoints)
+        with METRICS.stage("commit"):
+            self.conn.commit()
+            self.checkpoints.update(checkpoints)
+            self.positions = positions
+            self.consumer.commit()
+        if new_timestamps:
+            self.rollup_refresh.add(min(new_timestamps), max(new_timestamps))
+        self.inserted += len(fresh)
+        rate = self.inserted / max(time.monotonic() - self.started, 1e-9)
+        if self.pending:
+            # Replayed messages were stored before; they are neither written nor conflicts
+            replayed = len(decoded) - len(fresh)
+            METRICS.batch(len(self.pending) - replayed, written, len(self.pending) - len(decoded),
+                          time.perf_counter() - started)
+            self.report_lag()
+            print(f"[{self.name}] Inserted {len(fresh)} record(s) from {len(self.pending)} message(s) ({rate:,.0f} rows/s overall).")
+        self.pending = []
+
+    def refresh_rollups(self, force=False):
+        """Materialize committed rows into continuous-aggregate rollups beyond their policy windows."""
+        if not force and time.monotonic() - self.last_refresh < ROLLUP_REFRESH_SECONDS:
+            return
+        self.last_refresh = time.monotonic()
+        try:
+            with METRICS.stage("rollup"):
+                self.rollup_refresh.refresh()
+        except Exception as e:
+            # The range stays pending, and a DB outage also shows up on the next batch
+            print(f"[{self.name}] Could not refresh continuous aggregates, retrying later: {e}")
+
+    def report_lag(self):
+        for tp in self.consumer.assignment():
+            # highwater() is cached from fetch responses, so this costs no round trip
+            highwater = self.consumer.highwater(tp)
+            if highwater is not None:
+                METRICS.lag(tp.partition, max(highwater - self.consumer.position(tp), 0))
+
+    def reset_connection(self):
+        if self.conn.closed:
+            self.conn = connect_db()
+        else:
+            self.conn.rollback()
+
+    def stop(self, *_):
+        self.running = False
+
+    def run(self):
+        print(f"[{self.name}] Listening to Kafka topic: {KAFKA_TOPIC}...")
+        while self.running:
+            self.poll_batch()
+            try:
+                if self.pending:
+                    self.flush()
+                elif (any(windows.open for windows in self.windows.values())
+                      and time.monotonic() - self.last_message >= WINDOW_IDLE_FLUSH_SECONDS):
+                    self.flush(force=True)
+            except CommitFailedError as e:
+                # The DB side is committed; the new owner resumes from the checkpoints
+                print(f"[{self.name}] Offset commit failed after rebalance: {e}")
+                self.pending = []
+            except Exception as e:
+                print(f"[{self.name}] Failed to write batch of {len(self.pending)} message(s), retrying: {e}")
+                self.reset_connection()
+                # Back to the last committed state: drop in-memory windows and re-read from the checkpoints.
+                # The rollups may have become continuous aggregates meanwhile, so check again.
+                self.discard_state()
+                self.detect_rollups()
+                self.restore(self.consumer.assignment())
+                time.sleep(RETRY_BACKOFF_SECONDS)
+            self.refresh_rollups()
+
+        # Graceful shutdown: write what was read and flush every open window, then
+        # leave the group so the partitions are reassigned right away
+        self.flush(force=True)
+        self.refresh_rollups(force=True)
+        self.consumer.close()
+        self.conn.close()
+        print(f"[{self.name}] Stopped after inserting {self.inserted} record(s).")
+
+
+def run_worker(name, metrics_port=METRICS_PORT):
+    # Each worker process serves its own metrics, on consecutive ports
+    serve_metrics(metrics_port)
+    worker = StreamWorker(name)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+def worker_count():
+    if WORKER_PROCESSES != "auto":
+        return max(int(WORKER_PROCESSES), 1)
+    consumer = KafkaConsumer(bootstrap_servers=[KAFKA_BOOTSTRAP])
     try:
-        with DB_CONN.cursor() as cur:
-            cur.execute("""
-                INSERT INTO raw_data (user_id, metric, timestamp, value)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id, metric, timestamp) DO NOTHING
-            """, (
-                payload["user_id"],
-                payload["metric"],
-                payload["timestamp"],
-                payload["value"]
-            ))
-            DB_CONN.commit()
-    except Exception as e:
-        print("Failed to insert record:", e)
-
-# Listen to Kafka and insert records
-print(f"Listening to Kafka topic: {KAFKA_TOPIC}...")
-for message in consumer:
-    print("Received message:", message.value)
-    insert_to_tsdb(message.value)
-    print("Inserted into TimescaleDB.")
\ No newline at end of file
+        partitions = consumer.partitions_for_topic(KAFKA_TOPIC) or {0}
+    finally:
+        consumer.close()
+    return len(partitions)
+
+
+def supervise(workers):
+    """Run `workers` consumer processes, restarting any that exit until told to stop."""
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: the worker flushes and leaves the group
+
+    def start(index):
+        port = METRICS_PORT + index if METRICS_PORT else 0
+        process = multiprocessing.Process(target=run_worker, args=(f"worker-{index}", port), name=f"worker-{index}")
+        process.start()
+        return process
+
+    processes = {index: start(index) for index in range(workers)}
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Supervising {workers} worker process(es) on topic {KAFKA_TOPIC}")
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in processes.items():
+            if not process.is_alive() and not stopping:
+                print(f"[WARNING] worker-{index} exited with code {process.exitcode}, restarting in {RETRY_BACKOFF_SECONDS}s")
+                time.sleep(RETRY_BACKOFF_SECONDS)
+                processes[index] = start(index)
+
+    for process in processes.values():
+        process.join()
+    print("All workers stopped.")
+
+
+if __name__ == "__main__":
+    count = worker_count()
+    if count == 1:
+        run_worker("worker")
+    else:
+        supervise(count)
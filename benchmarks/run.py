@@ -0,0 +1,430 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from common.sketches import POPULATION  # noqa: E402
+
+DB_PARAMS = {
+    "dbname": os.getenv("POSTGRES_DB", "wearipedia"),
+    "user": os.getenv("POSTGRES_USER", "wearipedia_user"),
+    "password": os.getenv("POSTGRES_PASSWORD", "19768003"),
+    "host": os.getenv("TSDB_HOST", "localhost"),
+    "port": os.getenv("TSDB_PORT", "5432"),
+}
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "localhost:9092")
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+
+# Synthetic participants are named bench_NNNNN and dated far from real data, so a
+# run only ever deletes and measures its own rows
+USER_PREFIX = "bench_"
+START = datetime(2030, 1, 1)
+# Sampling period in seconds per metric, roughly a Fitbit Charge 6
+METRIC_PERIODS = {
+    "heart_rate": 1,
+    "spo2": 60,
+    "activity": 60,
+    "hrv": 300,
+}
+SCALES = (1, 1000, 10000)
+# raw_data and the rollups are keyed by lookup-table ids; sketches keep user_id names
+KEYED_TABLES = ("raw_data", "data_1m", "data_1h", "data_1d")
+SKETCH_TABLES = ("sketch_1h", "sketch_1d")
+BENCH_USER_KEYS = "user_key IN (SELECT id FROM users WHERE name LIKE %s)"
+
+# Ingest paths: loader script, working directory and environment overrides
+INGEST_PATHS = {
+    "ingest_insert": ("Task-1", "ingest.py", {"LOAD_MODE": "insert"}),
+    "ingest_copy": ("Task-1", "ingest.py", {"LOAD_MODE": "copy"}),
+    "ingest_copy_concurrent": ("Task-1", "ingest.py", {"LOAD_MODE": "copy", "INGEST_WORKERS": "4"}),
+    "ingestion_update": ("Task-3", "ingestion_update.py", {}),
+    "kafka_worker": ("Task-6", "worker.py", {}),
+}
+
+# /data query mix as (name, weight, nominal span, request builder); dashboards mostly look
+# at a day or a week. Spans are capped at the generated window (--minutes) and placed inside
+# it, so every query reads data; pass --minutes 10080 for the full week-long ranges.
+QUERY_MIX = (
+    ("data_1h_raw", 0.15, timedelta(hours=1),
+     lambda u, m, s, e: ("/data", {"user_id": u, "metric": m, **_range(s, e)})),
+    ("data_1d_chart", 0.35, timedelta(days=1),
+     lambda u, m, s, e: ("/data", {"user_id": u, "metric": m, **_range(s, e), "max_points": 1400})),
+    ("data_7d_chart", 0.2, timedelta(days=7),
+     lambda u, m, s, e: ("/data", {"user_id": u, "metric": m, **_range(s, e), "max_points": 1400})),
+    ("data_1d_ndjson", 0.1, timedelta(days=1),
+     lambda u, m, s, e: ("/data", {"user_id": u, "metric": m, **_range(s, e), "format": "ndjson"})),
+    ("batch_10x2", 0.1, timedelta(days=1),
+     lambda u, m, s, e: ("/data/batch", {"user_id": [f"{USER_PREFIX}{i:05d}" for i in range(1, 11)],
+                                         "metric": ["heart_rate", "spo2"], **_range(s, e), "max_points": 500})),
+    ("quantiles_1d", 0.1, timedelta(days=1),
+     lambda u, m, s, e: ("/stats/quantiles", {"metric": m, **_range(s, e)})),
+)
+
+
+def _range(start, end):
+    return {"start_date": start.isoformat(), "end_date": end.isoformat()}
+
+
+def user_id(index):
+    return f"{USER_PREFIX}{index:05d}"
+
+
+def generate_workload(participants, minutes, seed=42):
+    """Yield (user_id, metric, timestamps, values) per series; timestamps are ISO strings."""
+    rng = np.random.default_rng(seed)
+    for index in range(1, participants + 1):
+        for metric, period in METRIC_PERIODS.items():
+            offsets = np.arange(0, minutes * 60, period)
+            if metric == "heart_rate":
+                values = 70 + 10 * np.sin(offsets / 600) + rng.normal(0, 3, len(offsets))
+            elif metric == "spo2":
+                values = rng.normal(97, 1, len(offsets))
+            elif metric == "activity":
+                values = rng.poisson(20, len(offsets)).astype(float)
+            else:
+                values = rng.normal(45, 8, len(offsets))
+            stamps = (np.datetime64(START) + offsets.astype("timedelta64[s]")).astype(str)
+            yield user_id(index), metric, stamps, np.round(values, 2)
+
+
+def write_workload(directory, participants, minutes):
+    """
+    Write the workload twice: NDJSON shards per participant (Task-0 generate.py
+    layout, read by ingest.py and the producer) and flat JSON arrays in `flat/`
+    (what ingestion_update.py reads). Returns the row count.
+    """
+    shards = os.path.join(directory, "shards")
+    flat = os.path.join(directory, "flat")
+    os.makedirs(flat, exist_ok=True)
+    rows = 0
+    flat_batch = []
+    for uid, metric, stamps, values in generate_workload(participants, minutes):
+        lines = [
+            f'{{"user_id":"{uid}","metric":"{metric}","timestamp":"{ts}","value":{value}}}'
+            for ts, value in zip(stamps, values.tolist())
+        ]
+        os.makedirs(os.path.join(shards, uid), exist_ok=True)
+        with open(os.path.join(shards, uid, f"{metric}-{START.date()}.ndjson"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        flat_batch.extend(lines)
+        rows += len(lines)
+        # ingestion_update loads a file at a time, so keep its files bounded
+        if len(flat_batch) >= 500_000:
+            _write_flat(flat, flat_batch)
+            flat_batch = []
+    if flat_batch:
+        _write_flat(flat, flat_batch)
+    return rows
+
+
+def _write_flat(directory, lines):
+    name = f"bench-{len(os.listdir(directory)):05d}.json"
+    with open(os.path.join(directory, name), "w") as f:
+        f.write("[" + ",".join(lines) + "]")
+
+
+def reset_bench_rows(conn):
+    """Delete earlier benchmark rows; tables that don't exist or are views are skipped."""
+    with conn.cursor() as cur:
+        for table in (*KEYED_TABLES, *SKETCH_TABLES):
+            cur.execute("SAVEPOINT reset")
+            try:
+                if table in KEYED_TABLES:
+                    cur.execute(f"DELETE FROM {table} WHERE {BENCH_USER_KEYS}", (USER_PREFIX + "%",))
+                else:
+                    # Population sketch rows ('*') for benchmark dates only hold benchmark data
+                    cur.execute(
+                        f"DELETE FROM {table} WHERE user_id LIKE %s OR (user_id = %s AND timestamp >= %s)",
+                        (USER_PREFIX + "%", POPULATION, START),
+                    )
+                cur.execute("RELEASE SAVEPOINT reset")
+            except psycopg2.Error:
+                cur.execute("ROLLBACK TO SAVEPOINT reset")
+    conn.commit()
+
+
+def count_bench_rows(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM raw_data WHERE {BENCH_USER_KEYS}", (USER_PREFIX + "%",))
+        count = cur.fetchone()[0]
+    conn.commit()
+    return count
+
+
+def loader_env(overrides):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "TSDB_HOST": DB_PARAMS["host"],
+        "TSDB_PORT": str(DB_PARAMS["port"]),
+        "RESUME": "0",
+        "METRICS_PORT": "0",
+    })
+    env.update(overrides)
+    return env
+
+
+def wait_rusage(process):
+    """Wait for `process`; returns (exit status, peak RSS in MiB of it and its children)."""
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux
+    return process.returncode, usage.ru_maxrss / 1024
+
+
+def run_batch_loader(path, data_dir):
+    task, script, overrides = INGEST_PATHS[path]
+    env = loader_env({**overrides, "EXTRACTED_DIR": data_dir})
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script], cwd=os.path.join(REPO_ROOT, task), env=env,
+                               stdout=subprocess.DEVNULL)
+    code, peak_rss = wait_rusage(process)
+    return time.perf_counter() - started, peak_rss, code
+
+
+def run_kafka_worker(shards_dir, expected, conn, workers, timeout):
+    """
+    Replay the shards into a fresh topic, then time a fresh consumer group from
+    start until every row is in raw_data.
+    """
+    topic = f"bench_{int(time.time())}"
+    producer_env = loader_env({"KAFKA_BROKER": KAFKA_BROKER, "KAFKA_TOPIC": topic})
+    subprocess.run(
+        [sys.executable, "producer.py", "--data-dir", shards_dir, "--partitions", str(max(workers, 1))],
+        cwd=os.path.join(REPO_ROOT, "Task-6"), env=producer_env, stdout=subprocess.DEVNULL, check=True,
+    )
+
+    env = loader_env({
+        "KAFKA_BROKER": KAFKA_BROKER, "KAFKA_TOPIC": topic, "KAFKA_GROUP": topic,
+        "WORKER_PROCESSES": str(workers), "WINDOW_IDLE_FLUSH_SECONDS": "1",
+    })
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "worker.py"], cwd=os.path.join(REPO_ROOT, "Task-6"), env=env,
+                               stdout=subprocess.DEVNULL)
+    while count_bench_rows(conn) < expected and time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            break
+        time.sleep(0.5)
+    elapsed = time.perf_counter() - started
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+    code, peak_rss = wait_rusage(process)
+    return elapsed, peak_rss, code
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def query_range(rng, span, minutes):
+    """A random range of `span`, capped at the generated data, inside START .. START + minutes."""
+    window = timedelta(minutes=minutes)
+    span = min(span, window)
+    start = START + timedelta(seconds=rng.randrange(0, int((window - span).total_seconds()) + 1))
+    return start, start + span
+
+
+def replay_queries(participants, minutes, requests, concurrency, seed=42):
+    """
+    Send `requests` weighted random queries from the mix over the generated data
+    (`minutes` from START); returns one result per query kind.
+    """
+    rng = random.Random(seed)
+    names = [name for name, _, _, _ in QUERY_MIX]
+    weights = [weight for _, weight, _, _ in QUERY_MIX]
+    kinds = {name: (span, build) for name, _, span, build in QUERY_MIX}
+    plan = []
+    for _ in range(requests):
+        name = rng.choices(names, weights)[0]
+        span, build = kinds[name]
+        start, end = query_range(rng, span, minutes)
+        uid = user_id(rng.randint(1, participants))
+        path, params = build(uid, rng.choice(list(METRIC_PERIODS)), start, end)
+        plan.append((name, f"{API_URL}{path}?{urllib.parse.urlencode(params, doseq=True)}"))
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def send(item):
+        name, url = item
+        started = time.perf_counter()
+        try:
+            # Read the whole body so the latency includes the transfer
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+            ok = 200 <= response.status < 300
+        except Exception:
+            # urlopen raises HTTPError for 4xx/5xx responses
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies[name].append(elapsed * 1000)
+            else:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, plan))
+    wall = time.perf_counter() - started
+
+    results = []
+    for name in names:
+        values = sorted(latencies[name])
+        results.append({
+            "name": f"api:{name}",
+            "requests": len(values) + errors[name],
+            "errors": errors[name],
+            "requests_per_second": round(len(values) / wall, 1),
+            "p50_ms": percentile(values, 0.50),
+            "p95_ms": percentile(values, 0.95),
+            "p99_ms": percentile(values, 0.99),
+        })
+    return results
+
+
+def api_peak_rss(pid):
+    """Peak RSS in MiB of a running API process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        for scale in args.scales:
+            workdir = tempfile.mkdtemp(prefix=f"pulseforge-bench-{scale}-")
+            try:
+                print(f"[INFO] Generating {scale} participant(s) x {args.minutes} min...")
+                rows = write_workload(workdir, scale, args.minutes)
+                for path in args.paths:
+                    reset_bench_rows(conn)
+                    print(f"[INFO] {path}: {rows:,} rows for {scale} participant(s)")
+                    if path == "kafka_worker":
+                        seconds, peak_rss, code = run_kafka_worker(
+                            os.path.join(workdir, "shards"), rows, conn, args.kafka_workers, args.timeout)
+                    elif path == "ingestion_update":
+                        seconds, peak_rss, code = run_batch_loader(path, os.path.join(workdir, "flat"))
+                    else:
+                        seconds, peak_rss, code = run_batch_loader(path, os.path.join(workdir, "shards"))
+                    loaded = count_bench_rows(conn)
+                    results.append({
+                        "name": path,
+                        "participants": scale,
+                        "rows": rows,
+                        "rows_loaded": loaded,
+                        "seconds": round(seconds, 3),
+                        "rows_per_second": round(loaded / max(seconds, 1e-9), 1),
+                        "peak_rss_mb": round(peak_rss, 1),
+                        "exit_code": code,
+                    })
+                    print(f"[INFO]   {loaded:,}/{rows:,} rows in {seconds:.2f}s "
+                          f"({loaded / max(seconds, 1e-9):,.0f} rows/s), peak RSS {peak_rss:.0f} MiB")
+
+                # Query the last scale's data while it is still loaded
+                if args.requests and scale == args.scales[-1]:
+                    print(f"[INFO] Replaying {args.requests} API queries against {API_URL}...")
+                    for result in replay_queries(scale, args.minutes, args.requests, args.concurrency):
+                        result["participants"] = scale
+                        if args.api_pid:
+                            result["peak_rss_mb"] = api_peak_rss(args.api_pid)
+                        results.append(result)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        if not args.keep:
+            reset_bench_rows(conn)
+    finally:
+        conn.close()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {"scales": args.scales, "minutes": args.minutes, "paths": args.paths,
+                   "requests": args.requests, "concurrency": args.concurrency},
+        "results": results,
+    }
+
+
+def compare(baseline_path, current_path):
+    """Print the relative change of each throughput and latency figure between two result files."""
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r.get("participants")): r for r in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+    for result in current:
+        before = baseline.get((result["name"], result.get("participants")))
+        if before is None:
+            continue
+        changes = []
+        for key in ("rows_per_second", "requests_per_second", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {100 * (result[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{result['name']} @ {result.get('participants')}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest paths and the /data API against a local TimescaleDB.")
+    parser.add_argument("--scales", type=lambda v: [int(x) for x in v.split(",")], default=list(SCALES),
+                        help="Comma-separated participant counts (default 1,1000,10000)")
+    parser.add_argument("--minutes", type=int, default=10, help="Minutes of data per participant")
+    parser.add_argument("--paths", type=lambda v: v.split(","), default=list(INGEST_PATHS),
+                        help=f"Comma-separated ingest paths: {', '.join(INGEST_PATHS)}")
+    parser.add_argument("--kafka-workers", type=int, default=1, help="WORKER_PROCESSES for the Kafka worker")
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up on the Kafka worker after this many seconds")
+    parser.add_argument("--requests", type=int, default=2000, help="API queries to replay (0 skips the API)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent API clients")
+    parser.add_argument("--api-pid", type=int, default=None, help="PID of the API process, to report its peak RSS")
+    parser.add_argument("--keep", action="store_true", help="Leave the benchmark rows in the database")
+    parser.add_argument("--output", default="benchmarks/results/latest.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare --output against a baseline result file and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare, args.output)
+        return
+
+    unknown = set(args.paths) - set(INGEST_PATHS)
+    if unknown:
+        parser.error(f"unknown ingest path(s): {', '.join(sorted(unknown))}")
+
+    report = run(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
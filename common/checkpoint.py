@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+
+# Per-file ingest progress, stored next to the data it describes so a checkpoint
+# update can commit in the same transaction as the rows it covers.
+MANIFEST_TABLE = "ingest_manifest"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def create_manifest_table(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+        loader TEXT NOT NULL,
+        path TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        size BIGINT NOT NULL,
+        mtime_ns BIGINT NOT NULL,
+        committed_rows BIGINT NOT NULL DEFAULT 0,
+        done BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (loader, path)
+    );
+    """)
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def begin_file(cur, loader, path, filepath):
+    """
+    Return the number of rows of `filepath` already committed, or None if the
+    file was fully ingested. A changed file (size or content) starts over at 0.
+    The file is only re-hashed when its size or mtime no longer match.
+    """
+    stat = os.stat(filepath)
+    cur.execute(
+        f"SELECT sha256, size, mtime_ns, committed_rows, done FROM {MANIFEST_TABLE} "
+        f"WHERE loader = %s AND path = %s",
+        (loader, path),
+    )
+    row = cur.fetchone()
+    if row is not None:
+        sha256, size, mtime_ns, committed_rows, done = row
+        if size == stat.st_size and (mtime_ns == stat.st_mtime_ns or sha256 == file_sha256(filepath)):
+            if mtime_ns != stat.st_mtime_ns:
+                cur.execute(
+                    f"UPDATE {MANIFEST_TABLE} SET mtime_ns = %s WHERE loader = %s AND path = %s",
+                    (stat.st_mtime_ns, loader, path),
+                )
+            return None if done else committed_rows
+
+    cur.execute(
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (loader, path, sha256, size, mtime_ns, committed_rows, done, updated_at)
+        VALUES (%s, %s, %s, %s, %s, 0, FALSE, now())
+        ON CONFLICT (loader, path) DO UPDATE SET
+            sha256 = EXCLUDED.sha256, size = EXCLUDED.size, mtime_ns = EXCLUDED.mtime_ns,
+            committed_rows = 0, done = FALSE, updated_at = now();
+        """,
+        (loader, path, file_sha256(filepath), stat.st_size, stat.st_mtime_ns),
+    )
+    return 0
+
+
+def save_checkpoint(cur, loader, path, committed_rows, done=False):
+    """Record progress; call on the cursor whose transaction wrote those rows."""
+    cur.execute(
+        f"""
+        UPDATE {MANIFEST_TABLE}
+        SET committed_rows = GREATEST(committed_rows, %s), done = done OR %s, updated_at = now()
+        WHERE loader = %s AND path = %s;
+        """,
+        (committed_rows, done, loader, path),
+    )
+
+
+class ChunkTracker:
+    """
+    Turns out-of-order chunk commits from concurrent workers into a contiguous
+    committed-row offset per file, so a resume never skips an uncommitted chunk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def start(self, path, offset):
+        with self._lock:
+            self._files[path] = {"offset": offset, "pending": {}, "total": None}
+
+    def commit(self, path, start, end):
+        """Mark rows [start, end) committed; returns (contiguous_offset, done)."""
+        with self._lock:
+            state = self._files[path]
+            state["pending"][start] = end
+            while state["offset"] in state["pending"]:
+                state["offset"] = state["pending"].pop(state["offset"])
+            return state["offset"], self._done(state)
+
+    def finish(self, path, total):
+        """Record the file's total row count once fully read; returns (offset, done)."""
+        with self._lock:
+            state = self._files[path]
+            state["total"] = total
+            return state["offset"], self._done(state)
+
+    @staticmethod
+    def _done(state):
+        return state["total"] is not None and state["offset"] >= state["total"]
+
+
+# Per-partition stream progress, one row per write target ("raw_data" or a rollup
+# table): the highest offset whose effect on that target is committed.
+STREAM_CHECKPOINT_TABLE = "stream_checkpoint"
+
+
+def create_stream_checkpoint_table(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STREAM_CHECKPOINT_TABLE} (
+        consumer_group TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        partition INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        committed_offset BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (consumer_group, topic, partition, target)
+    );
+    """)
+
+
+def load_stream_checkpoints(cur, group, topic, partitions):
+    """{(partition, target): committed offset} for the given partitions."""
+    cur.execute(
+        f"SELECT partition, target, committed_offset FROM {STREAM_CHECKPOINT_TABLE} "
+        f"WHERE consumer_group = %s AND topic = %s AND partition = ANY(%s)",
+        (group, topic, list(partitions)),
+    )
+    return {(partition, target): offset for partition, target, offset in cur.fetchall()}
+
+
+def save_stream_checkpoints(cur, group, topic, checkpoints):
+    """Record {(partition, target): offset}; call in the transaction that wrote those effects."""
+    for (partition, target), offset in checkpoints.items():
+        cur.execute(
+            f"""
+            INSERT INTO {STREAM_CHECKPOINT_TABLE} (consumer_group, topic, partition, target, committed_offset)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (consumer_group, topic, partition, target) DO UPDATE SET
+                committed_offset = GREATEST({STREAM_CHECKPOINT_TABLE}.committed_offset, EXCLUDED.committed_offset),
+                updated_at = now();
+            """,
+            (group, topic, partition, target, offset),
+        )
@@ -0,0 +1,113 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, push_to_gateway, start_http_server
+except ImportError:
+    raise ImportError("Please install prometheus_client using: pip install prometheus_client")
+
+# Port each loader serves /metrics on (0 disables); Prometheus scrapes it (Task-5/prometheus.yml)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+# Batch loaders exit when done; set this to push their final metrics to a Pushgateway
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "")
+
+REGISTRY = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds", "Time spent per ingest stage and batch",
+    ["loader", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
+STAGE_ERRORS = Counter(
+    "ingest_errors_total", "Ingest stages that raised",
+    ["loader", "stage"],
+    registry=REGISTRY,
+)
+ROWS = Counter(
+    "ingest_rows_total", "Rows seen by outcome: read, written, conflict (already stored) or invalid",
+    ["loader", "outcome"],
+    registry=REGISTRY,
+)
+BATCH_ROWS = Histogram(
+    "ingest_batch_rows", "Rows per written batch",
+    ["loader"],
+    buckets=(1, 10, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000),
+    registry=REGISTRY,
+)
+ROWS_PER_SECOND = Gauge(
+    "ingest_rows_per_second", "Throughput of the most recent batch",
+    ["loader"],
+    registry=REGISTRY,
+)
+LAST_SUCCESS = Gauge(
+    "ingest_last_success_timestamp_seconds", "Unix time of the last committed batch",
+    ["loader"],
+    registry=REGISTRY,
+)
+CONSUMER_LAG = Gauge(
+    "kafka_consumer_lag", "Messages between the consumer position and the partition high watermark",
+    ["loader", "partition"],
+    registry=REGISTRY,
+)
+
+
+class LoaderMetrics:
+    """Metric handles bound to one loader's label."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as `name`; an exception is counted as an error of that stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.labels(self.loader, name).inc()
+            raise
+        finally:
+            STAGE_SECONDS.labels(self.loader, name).observe(time.perf_counter() - started)
+
+    def batch(self, read, written, invalid=0, seconds=None):
+        """
+        Record a committed batch: `read` rows in, `invalid` rejected before the write,
+        `written` actually inserted; the rest were dropped by ON CONFLICT.
+        """
+        ROWS.labels(self.loader, "read").inc(read)
+        ROWS.labels(self.loader, "invalid").inc(invalid)
+        ROWS.labels(self.loader, "written").inc(written)
+        ROWS.labels(self.loader, "conflict").inc(max(read - invalid - written, 0))
+        BATCH_ROWS.labels(self.loader).observe(read)
+        if seconds:
+            ROWS_PER_SECOND.labels(self.loader).set(read / seconds)
+        LAST_SUCCESS.labels(self.loader).set_to_current_time()
+
+    def lag(self, partition, messages):
+        CONSUMER_LAG.labels(self.loader, str(partition)).set(messages)
+
+    def clear_lag(self, partition):
+        """Stop reporting a partition this process no longer owns."""
+        try:
+            CONSUMER_LAG.remove(self.loader, str(partition))
+        except KeyError:
+            pass
+
+
+def serve_metrics(port=METRICS_PORT):
+    """Serve every loader metric on `port` (no-op when 0); call once per process."""
+    if port:
+        start_http_server(port, registry=REGISTRY)
+        print(f"[INFO] Serving metrics on :{port}/metrics")
+
+
+def push_metrics(loader):
+    """Push everything to PUSHGATEWAY_URL, if set; call once a batch loader is done."""
+    if not PUSHGATEWAY_URL:
+        return
+    try:
+        push_to_gateway(PUSHGATEWAY_URL, job=loader, registry=REGISTRY)
+    except Exception as e:
+        print(f"[WARNING] Could not push metrics to {PUSHGATEWAY_URL}: {e}")
@@ -0,0 +1,35 @@
+import json
+import os
+
+# Postgres NOTIFY channel the API listens on to invalidate cached query results
+INGEST_CHANNEL = os.getenv("INGEST_CHANNEL", "data_ingested")
+
+
+def _iso(value):
+    return value if isinstance(value, str) else value.isoformat()
+
+
+def series_ranges(records):
+    """Min/max timestamp written per (user_id, metric) for a batch of record dicts."""
+    ranges = {}
+    for rec in records:
+        key = (rec["user_id"], rec["metric"])
+        ts = _iso(rec["timestamp"])
+        bounds = ranges.get(key)
+        if bounds is None:
+            ranges[key] = [ts, ts]
+        elif ts < bounds[0]:
+            bounds[0] = ts
+        elif ts > bounds[1]:
+            bounds[1] = ts
+    return ranges
+
+
+def notify_ingest(cur, ranges):
+    """
+    Announce written ranges on INGEST_CHANNEL. NOTIFY is transactional, so listeners
+    only hear about rows once the surrounding transaction commits.
+    """
+    for (user_id, metric), (start, end) in ranges.items():
+        payload = {"user_id": user_id, "metric": metric, "start": _iso(start), "end": _iso(end)}
+        cur.execute("SELECT pg_notify(%s, %s)", (INGEST_CHANNEL, json.dumps(payload)))
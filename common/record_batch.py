@@ -0,0 +1,265 @@
+import io
+import struct
+import warnings
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# PostgreSQL binary COPY framing; timestamps there count from 2000-01-01
+PG_EPOCH_OFFSET_US = 946_684_800_000_000
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+# Bytes after the user_id/metric prefix: timestamp and value fields (or a NULL value)
+COPY_TAIL = [("ts_len", ">i4"), ("ts", ">i8"), ("value_len", ">i4"), ("value", ">f8")]
+COPY_TAIL_NULL = [("ts_len", ">i4"), ("ts", ">i8"), ("value_len", ">i4")]
+
+
+def to_epoch_us(timestamps) -> np.ndarray:
+    """
+    ISO strings or datetimes -> int64 microseconds since the Unix epoch. Naive values
+    are taken as UTC and offsets are applied, as everywhere else in the pipeline.
+    """
+    array = np.asarray(timestamps)
+    if array.dtype.kind != "M":
+        # NumPy parses ISO strings in C; it only warns that it has no timezone type to keep
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            array = np.array(timestamps, dtype="datetime64[us]")
+    return array.astype("datetime64[us]").astype(np.int64)
+
+
+def intern(values, dictionary):
+    """Codes of `values` in `dictionary` (value -> code), adding unseen values as they come."""
+    if isinstance(values, str):
+        code = dictionary.setdefault(values, len(dictionary))
+        return code
+    return np.fromiter(
+        (dictionary.setdefault(value, len(dictionary)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+
+
+class RecordBatch:
+    """
+    Raw rows (user_id, metric, timestamp, value) as parallel arrays: int32 codes into
+    the `users` / `metrics` dictionaries, int64 UTC microseconds since the Unix epoch
+    and float64 values with NaN for NULL. A row costs 24 bytes instead of a dict of
+    four Python objects, and the repeated user_id/metric strings are stored once.
+    """
+
+    __slots__ = ("users", "metrics", "user_codes", "metric_codes", "timestamps", "values")
+
+    def __init__(self, users, metrics, user_codes, metric_codes, timestamps, values):
+        self.users = users
+        self.metrics = metrics
+        self.user_codes = user_codes
+        self.metric_codes = metric_codes
+        self.timestamps = timestamps
+        self.values = values
+
+    @classmethod
+    def from_columns(cls, user_id, metric, timestamps, values):
+        """
+        Build from column sequences. `user_id` and `metric` may each be a single string
+        for the whole batch, the usual case for one participant's Fitbit payload.
+        """
+        n = len(timestamps)
+        users, metrics = {}, {}
+        user_codes = intern(user_id, users)
+        metric_codes = intern(metric, metrics)
+        if isinstance(user_id, str):
+            user_codes = np.full(n, user_codes, dtype=np.int32)
+        if isinstance(metric, str):
+            metric_codes = np.full(n, metric_codes, dtype=np.int32)
+        values = np.array([np.nan if v is None else v for v in values] if not isinstance(values, np.ndarray)
+                          else values, dtype=np.float64)
+        return cls(list(users), list(metrics), user_codes, metric_codes, to_epoch_us(timestamps), values)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from record dicts, e.g. a parsed JSON file or NDJSON chunk."""
+        return cls.from_columns(
+            [rec["user_id"] for rec in records],
+            [rec["metric"] for rec in records],
+            [rec["timestamp"] for rec in records],
+            [rec["value"] for rec in records],
+        )
+
+    @classmethod
+    def from_rows(cls, rows, columns=(0, 1, 2, 3)):
+        """Build from tuples, e.g. rows RETURNING user_id, metric, timestamp, value."""
+        user, metric, ts, value = columns
+        return cls.from_columns(
+            [row[user] for row in rows],
+            [row[metric] for row in rows],
+            [row[ts] for row in rows],
+            [row[value] for row in rows],
+        )
+
+    @classmethod
+    def concat(cls, batches):
+        """One batch from many, re-coding their dictionaries into a shared one."""
+        users, metrics = {}, {}
+        user_codes, metric_codes = [], []
+        for batch in batches:
+            user_codes.append(intern(batch.users, users)[batch.user_codes] if batch.users else batch.user_codes)
+            metric_codes.append(intern(batch.metrics, metrics)[batch.metric_codes] if batch.metrics else batch.metric_codes)
+        return cls(
+            list(users),
+            list(metrics),
+            np.concatenate(user_codes) if user_codes else np.empty(0, np.int32),
+            np.concatenate(metric_codes) if metric_codes else np.empty(0, np.int32),
+            np.concatenate([b.timestamps for b in batches]) if batches else np.empty(0, np.int64),
+            np.concatenate([b.values for b in batches]) if batches else np.empty(0, np.float64),
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        return self.user_codes.nbytes + self.metric_codes.nbytes + self.timestamps.nbytes + self.values.nbytes
+
+    def take(self, index):
+        """Rows selected by a boolean mask or index array; dictionaries are shared."""
+        return RecordBatch(self.users, self.metrics, self.user_codes[index], self.metric_codes[index],
+                           self.timestamps[index], self.values[index])
+
+    def series_codes(self):
+        """One int64 per row identifying its (user_id, metric) series."""
+        return self.user_codes.astype(np.int64) * max(len(self.metrics), 1) + self.metric_codes
+
+    def series(self, code):
+        user, metric = divmod(int(code), max(len(self.metrics), 1))
+        return self.users[user], self.metrics[metric]
+
+    # --- Adapters -----------------------------------------------------------
+
+    def iso_timestamps(self):
+        return np.datetime_as_string(self.timestamps.astype("datetime64[us]"), timezone="UTC")
+
+    def rows(self):
+        """Plain-Python (user_id, metric, timestamp, value) tuples for execute_values."""
+        users = np.array(self.users, dtype=object)[self.user_codes].tolist()
+        metrics = np.array(self.metrics, dtype=object)[self.metric_codes].tolist()
+        values = [None if v != v else v for v in self.values.tolist()]
+        return list(zip(users, metrics, self.iso_timestamps().tolist(), values))
+
+    def records(self):
+        """Record dicts, for code that still expects them."""
+        return [
+            {"user_id": user, "metric": metric, "timestamp": ts, "value": value}
+            for user, metric, ts, value in self.rows()
+        ]
+
+    def to_frame(self):
+        """DataFrame with categorical user_id/metric and tz-aware UTC timestamps."""
+        import pandas as pd
+
+        return pd.DataFrame({
+            "user_id": pd.Categorical.from_codes(self.user_codes, categories=self.users),
+            "metric": pd.Categorical.from_codes(self.metric_codes, categories=self.metrics),
+            "timestamp": pd.to_datetime(self.timestamps, unit="us", utc=True),
+            "value": self.values,
+        })
+
+    def series_ranges(self):
+        """Min/max timestamp per (user_id, metric), in the shape notify_ingest takes."""
+        if not len(self):
+            return {}
+        codes, inverse = np.unique(self.series_codes(), return_inverse=True)
+        low = np.full(len(codes), np.iinfo(np.int64).max)
+        high = np.full(len(codes), np.iinfo(np.int64).min)
+        np.minimum.at(low, inverse, self.timestamps)
+        np.maximum.at(high, inverse, self.timestamps)
+        return {
+            self.series(code): (_datetime(lo), _datetime(hi))
+            for code, lo, hi in zip(codes.tolist(), low.tolist(), high.tolist())
+        }
+
+    def partials(self, width):
+        """
+        Rollup partial rows (user_id, metric, bucket, sum, count, min, max) for
+        `width`-wide buckets, computed with sorted segment reductions; the same rows
+        compute_partials produces, ready for upsert_partials.
+        """
+        valid = ~np.isnan(self.values)
+        step = int(width.total_seconds() * 1_000_000)
+        series = self.series_codes()[valid]
+        timestamps = self.timestamps[valid]
+        buckets = timestamps - timestamps % step
+        values = self.values[valid]
+        if not len(values):
+            return []
+
+        order = np.lexsort((buckets, series))
+        series, buckets, values = series[order], buckets[order], values[order]
+        change = np.empty(len(values), dtype=bool)
+        change[0] = True
+        change[1:] = (series[1:] != series[:-1]) | (buckets[1:] != buckets[:-1])
+        starts = np.flatnonzero(change)
+
+        sums = np.add.reduceat(values, starts)
+        counts = np.diff(np.append(starts, len(values)))
+        lows = np.minimum.reduceat(values, starts)
+        highs = np.maximum.reduceat(values, starts)
+        return [
+            (*self.series(code), _datetime(bucket), total, count, low, high)
+            for code, bucket, total, count, low, high in zip(
+                series[starts].tolist(), buckets[starts].tolist(), sums.tolist(),
+                counts.tolist(), lows.tolist(), highs.tolist(),
+            )
+        ]
+
+    def copy_binary(self) -> io.BytesIO:
+        """
+        Encode the batch as one binary COPY stream (user, metric, timestamp, value).
+        Names are written as text; ids (a batch from SeriesIds.encode) as an int4 user
+        key and an int2 metric key. Rows of one series share a byte prefix, so each
+        series is laid out as a single packed structured array instead of field by field.
+        """
+        buf = io.BytesIO()
+        buf.write(COPY_HEADER)
+        series = self.series_codes()
+        order = np.argsort(series, kind="stable")
+        series = series[order]
+        timestamps = self.timestamps[order] - PG_EPOCH_OFFSET_US
+        values = self.values[order]
+        bounds = np.flatnonzero(np.diff(series)) + 1
+        for start, end in zip(np.append(0, bounds).tolist(), np.append(bounds, len(series)).tolist()):
+            if start == end:
+                continue
+            user, metric = self.series(series[start])
+            prefix = struct.pack("!h", 4) + _copy_field(user, "!ii") + _copy_field(metric, "!ih")
+            null = np.isnan(values[start:end])
+            for mask, tail in ((~null, COPY_TAIL), (null, COPY_TAIL_NULL)):
+                n = int(mask.sum())
+                if not n:
+                    continue
+                rows = np.empty(n, dtype=[("prefix", f"V{len(prefix)}"), *tail])
+                rows["prefix"] = np.frombuffer(prefix, dtype=f"V{len(prefix)}")[0]
+                rows["ts_len"] = 8
+                rows["ts"] = timestamps[start:end][mask]
+                if tail is COPY_TAIL:
+                    rows["value_len"] = 8
+                    rows["value"] = values[start:end][mask]
+                else:
+                    rows["value_len"] = -1
+                buf.write(rows.tobytes())
+        buf.write(COPY_TRAILER)
+        buf.seek(0)
+        return buf
+
+
+def _copy_field(value, int_format):
+    """One COPY field: an integer key in `int_format` (length, value), or UTF-8 text."""
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return struct.pack("!i", len(data)) + data
+    return struct.pack(int_format, struct.calcsize(int_format) - 4, value)
+
+
+def _datetime(epoch_us):
+    return EPOCH + timedelta(microseconds=epoch_us)
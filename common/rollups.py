@@ -0,0 +1,276 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+# Rollup hypertables and the bucket width each one aggregates to
+ROLLUP_WINDOWS = {
+    "data_1m": "1min",
+    "data_1h": "1h",
+    "data_1d": "1d",
+}
+# The same widths for code that buckets without pandas
+ROLLUP_WIDTHS = {
+    "data_1m": timedelta(minutes=1),
+    "data_1h": timedelta(hours=1),
+    "data_1d": timedelta(days=1),
+}
+
+# Rollups that are continuous aggregates (Task-3/continuous_aggregates.sql) are views
+# maintained by TimescaleDB; writers only ever merge into the ones that are plain tables
+PLAIN_ROLLUPS_QUERY = """
+SELECT relname FROM pg_class
+WHERE relname = ANY(%s) AND relkind = 'r' AND pg_table_is_visible(oid);
+"""
+
+# Rollups that are continuous aggregates, whether they have a refresh policy and how far
+# back it looks (NULL start_offset: the whole history)
+CONTINUOUS_ROLLUPS_QUERY = """
+SELECT ca.view_name, j.job_id IS NOT NULL, (j.config->>'start_offset')::interval
+FROM timescaledb_information.continuous_aggregates ca
+LEFT JOIN timescaledb_information.jobs j
+  ON j.proc_name = 'policy_refresh_continuous_aggregate'
+ AND j.hypertable_schema = ca.materialization_hypertable_schema
+ AND j.hypertable_name = ca.materialization_hypertable_name
+WHERE ca.view_name = ANY(%s);
+"""
+
+# Mergeable partial state kept per (user_key, metric_key, bucket); avg_value is derived from it
+PARTIAL_COLUMNS = ("sum_value", "count_value", "min_value", "max_value")
+
+
+def plain_rollups(cur, mode="auto"):
+    """
+    ROLLUP_WIDTHS restricted to the rollups a writer has to merge into: none in
+    "continuous" mode, otherwise every one that is a plain table. Continuous
+    aggregates are detected rather than configured, since merging into one fails.
+    """
+    if mode == "continuous":
+        return {}
+    cur.execute(PLAIN_ROLLUPS_QUERY, (list(ROLLUP_WIDTHS),))
+    plain = {row[0] for row in cur.fetchall()}
+    return {table: width for table, width in ROLLUP_WIDTHS.items() if table in plain}
+
+
+def compute_partials(df, freq):
+    """
+    Vectorized rollup of raw rows (user_id, metric, timestamp, value) into one
+    partial-state row per (user_id, metric, bucket).
+    """
+    buckets = df.assign(timestamp=df["timestamp"].dt.floor(freq))
+    partials = (
+        buckets.groupby(["user_id", "metric", "timestamp"], sort=False, observed=True)
+        .agg(
+            sum_value=("value", "sum"),
+            count_value=("value", "count"),
+            min_value=("value", "min"),
+            max_value=("value", "max"),
+        )
+        .reset_index()
+    )
+    # Buckets whose values were all NULL carry no state worth merging
+    return partials[partials["count_value"] > 0]
+
+
+def upsert_sql(table):
+    """Merge incoming partials into existing buckets instead of keeping whichever came first."""
+    return f"""
+    INSERT INTO {table} (user_key, metric_key, timestamp, avg_value, sum_value, count_value, min_value, max_value)
+    VALUES %s
+    ON CONFLICT (user_key, metric_key, timestamp) DO UPDATE SET
+        sum_value = {table}.sum_value + EXCLUDED.sum_value,
+        count_value = {table}.count_value + EXCLUDED.count_value,
+        min_value = LEAST({table}.min_value, EXCLUDED.min_value),
+        max_value = GREATEST({table}.max_value, EXCLUDED.max_value),
+        avg_value = ({table}.sum_value + EXCLUDED.sum_value)
+                    / NULLIF({table}.count_value + EXCLUDED.count_value, 0);
+    """
+
+
+def upsert_partials(cur, table, rows, page_size=10000):
+    """
+    Bulk-merge partial rows (user_key, metric_key, bucket, sum, count, min, max) into
+    `table`; see SeriesIds for turning names into keys. Rows must be unique per
+    (user_key, metric_key, bucket) within one call.
+    """
+    values = [
+        (user_key, metric_key, bucket, total / count, total, count, low, high)
+        for user_key, metric_key, bucket, total, count, low, high in rows
+    ]
+    if values:
+        execute_values(cur, upsert_sql(table), values, page_size=page_size)
+    return len(values)
+
+
+def rebuild_sql(table, width):
+    """Recompute whole buckets from raw_data and replace what `table` holds for them."""
+    return f"""
+    INSERT INTO {table} (user_key, metric_key, timestamp, avg_value, sum_value, count_value, min_value, max_value)
+    SELECT k.user_key, k.metric_key, k.bucket,
+           avg(r.value), sum(r.value), count(r.value), min(r.value), max(r.value)
+    FROM (VALUES %s) AS k(user_key, metric_key, bucket)
+    JOIN raw_data r
+      ON r.user_key = k.user_key AND r.metric_key = k.metric_key
+     AND r.timestamp >= k.bucket AND r.timestamp < k.bucket + INTERVAL '{int(width.total_seconds())} seconds'
+    GROUP BY k.user_key, k.metric_key, k.bucket
+    HAVING count(r.value) > 0
+    ON CONFLICT (user_key, metric_key, timestamp) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        sum_value = EXCLUDED.sum_value,
+        count_value = EXCLUDED.count_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value;
+    """
+
+
+def rebuild_buckets(cur, table, width, keys, page_size=1000):
+    """
+    Replace the (user_key, metric_key, bucket) buckets of `table` with their
+    aggregates over raw_data. Unlike upsert_partials this is idempotent, for when
+    it isn't known which of a bucket's rows were already merged.
+    """
+    keys = list(keys)
+    if keys:
+        execute_values(cur, rebuild_sql(table, width), keys,
+                       template="(%s::integer, %s::smallint, %s::timestamptz)", page_size=page_size)
+    return len(keys)
+
+
+def floor_time(ts, width):
+    """Start of the `width` bucket holding `ts`, as time_bucket aligns it for these widths."""
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return epoch + (ts - epoch) // width * width
+
+
+def refresh_window(start, end, width, start_offset, now):
+    """
+    Bucket-aligned [lo, hi) to refresh so that rows written between `start` and `end`
+    are materialized, minus what the refresh policy (`start_offset` back from `now`)
+    reaches on its own; start_offset None means there is no policy. None if nothing is left.
+    """
+    lo = floor_time(start, width)
+    hi = floor_time(end, width) + width
+    if start_offset is not None:
+        hi = min(hi, floor_time(now - start_offset, width) + width)
+    return (lo, hi) if lo < hi else None
+
+
+class RollupRefresher:
+    """
+    Time range written to raw_data since the last refresh, for rollups that are
+    continuous aggregates (Task-3/continuous_aggregates.sql). Their refresh policies
+    only look back a few hours or days, so older rows (backfills, Kafka replays)
+    would never be materialized; refresh() covers the part of the range the policies
+    don't, bottom-up. Nothing is refreshed while the rollups are plain tables.
+    Thread-safe, so concurrent loader threads can share one.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.lock = threading.Lock()
+        self.start = self.end = None
+
+    def add(self, start, end):
+        with self.lock:
+            self.start = start if self.start is None else min(self.start, start)
+            self.end = end if self.end is None else max(self.end, end)
+
+    def add_rows(self, rows, column=2):
+        """Widen the range to the timestamps of rows written, e.g. RETURNING rows."""
+        timestamps = [row[column] for row in rows]
+        if timestamps:
+            self.add(min(timestamps), max(timestamps))
+
+    def refresh(self):
+        """
+        Materialize the pending range. The CALLs can't run in a transaction block, so
+        they use their own autocommit connection. On failure the range stays pending.
+        """
+        with self.lock:
+            start, end = self.start, self.end
+            self.start = self.end = None
+        if start is None:
+            return
+        try:
+            conn = self.connect()
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(CONTINUOUS_ROLLUPS_QUERY, (list(ROLLUP_WIDTHS),))
+                    policies = {name: (has_policy, offset) for name, has_policy, offset in cur.fetchall()}
+                    now = datetime.now(timezone.utc)
+                    # ROLLUP_WIDTHS runs finest first, the order the hierarchy is built in
+                    for table, width in ROLLUP_WIDTHS.items():
+                        if table not in policies:
+                            continue
+                        has_policy, offset = policies[table]
+                        if has_policy and offset is None:
+                            continue
+                        window = refresh_window(start, end, width, offset if has_policy else None, now)
+                        if window is not None:
+                            cur.execute("CALL refresh_continuous_aggregate(%s, %s, %s)", (table, *window))
+            finally:
+                conn.close()
+        except Exception:
+            self.add(start, end)
+            raise
+
+
+def partial_rows(partials):
+    """DataFrame from compute_partials -> plain-Python tuples psycopg2 can adapt."""
+    columns = ["user_id", "metric", "timestamp", *PARTIAL_COLUMNS]
+    return partials[columns].astype(object).itertuples(index=False, name=None)
+
+
+class TumblingWindows:
+    """
+    In-memory partial state for one rollup table, fed one value at a time from a
+    stream. A bucket closes once the watermark (latest event time seen) passes its
+    end plus `lateness`. Values arriving for an already closed bucket open a fresh
+    partial that closes immediately; the upsert merges it into the stored bucket,
+    so late data is never lost, it only costs an extra merge.
+
+    Each partial remembers the lowest (source, offset) that fed it, so the caller
+    can tell which stream positions still have unflushed effects.
+    """
+
+    def __init__(self, width, lateness):
+        self.width = int(width.total_seconds())
+        self.lateness = lateness
+        self.watermark = None
+        # (user_id, metric, bucket) -> [sum, count, min, max, {source: min offset}]
+        self.open = {}
+
+    def bucket(self, ts):
+        epoch = int(ts.timestamp())
+        return datetime.fromtimestamp(epoch - epoch % self.width, timezone.utc)
+
+    def add(self, user_id, metric, ts, value, source, offset):
+        if self.watermark is None or ts > self.watermark:
+            self.watermark = ts
+        key = (user_id, metric, self.bucket(ts))
+        state = self.open.get(key)
+        if state is None:
+            self.open[key] = [value, 1, value, value, {source: offset}]
+            return
+        state[0] += value
+        state[1] += 1
+        state[2] = min(state[2], value)
+        state[3] = max(state[3], value)
+        state[4][source] = min(state[4].get(source, offset), offset)
+
+    def close(self, force=False):
+        """Remove and return closed partial rows (user_id, metric, bucket, sum, count, min, max)."""
+        if force:
+            closed = list(self.open)
+        elif self.watermark is None:
+            return []
+        else:
+            cutoff = self.watermark - self.lateness - timedelta(seconds=self.width)
+            closed = [key for key in self.open if key[2] <= cutoff]
+        return [(*key, *self.open.pop(key)[:4]) for key in closed]
+
+    def min_open_offset(self, source):
+        """Lowest offset from `source` still held in an open bucket, or None."""
+        offsets = [state[4][source] for state in self.open.values() if source in state[4]]
+        return min(offsets) if offsets else None
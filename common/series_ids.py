@@ -0,0 +1,136 @@
+import threading
+
+from common.record_batch import RecordBatch
+
+# Lookup tables behind the integer user_key / metric_key columns of raw_data and the
+# rollups (Task-3/hypertables.sql). Ids are never reassigned, so caching them is safe.
+LOOKUP_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+"""
+
+
+def create_lookup_tables(cur):
+    cur.execute(LOOKUP_TABLES_SQL)
+
+
+def check_keyed_table(cur, table):
+    """
+    Fail fast if `table` predates the integer keys: CREATE TABLE IF NOT EXISTS leaves a
+    legacy table with TEXT user_id/metric columns in place, and keyed inserts would fail.
+    """
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s",
+        (table,),
+    )
+    columns = {row[0] for row in cur.fetchall()}
+    if columns and not {"user_key", "metric_key"} <= columns:
+        raise RuntimeError(
+            f"{table} has the legacy TEXT user_id/metric columns; run Task-3/hypertables.sql to migrate it to integer keys"
+        )
+
+
+class SeriesIds:
+    """
+    In-process name <-> id cache for the users and metrics lookup tables, shared by
+    every thread of a loader. Names missing from the cache are inserted (or looked up,
+    if another loader got there first) on a dedicated connection from `connect()` and
+    committed there before they are cached, so the caller's transaction is never
+    committed early and a rolled-back batch never leaves stale ids behind.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.ids = {"users": {}, "metrics": {}}
+        self.names = {"users": {}, "metrics": {}}
+        # Guards the caches and the lookup connection
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+        return self._conn
+
+    @staticmethod
+    def _fetch(cur, table, names):
+        cur.execute(
+            f"INSERT INTO {table} (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (names,),
+        )
+        cur.execute(f"SELECT name, id FROM {table} WHERE name = ANY(%s::text[])", (names,))
+        return cur.fetchall()
+
+    def resolve(self, users, metrics):
+        """Make sure every name in `users` and `metrics` has a cached id."""
+        with self.lock:
+            missing = {
+                table: sorted(set(names) - self.ids[table].keys())
+                for table, names in (("users", users), ("metrics", metrics))
+            }
+            if not any(missing.values()):
+                return
+            conn = self._connection()
+            try:
+                with conn.cursor() as cur:
+                    fetched = {table: self._fetch(cur, table, names) for table, names in missing.items() if names}
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            for table, rows in fetched.items():
+                for name, id_ in rows:
+                    self.ids[table][name] = id_
+                    self.names[table][id_] = name
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._conn = None
+
+    def user_key(self, name):
+        return self.ids["users"][name]
+
+    def metric_key(self, name):
+        return self.ids["metrics"][name]
+
+    def encode(self, batch: RecordBatch) -> RecordBatch:
+        """
+        The same rows with ids in place of names. Only the batch's dictionaries are
+        translated; the per-row code arrays are shared.
+        """
+        self.resolve(batch.users, batch.metrics)
+        return RecordBatch(
+            [self.ids["users"][name] for name in batch.users],
+            [self.ids["metrics"][name] for name in batch.metrics],
+            batch.user_codes, batch.metric_codes, batch.timestamps, batch.values,
+        )
+
+    def decode(self, batch: RecordBatch) -> RecordBatch:
+        """Inverse of encode, for rows read back by id (e.g. RETURNING user_key, metric_key, ...)."""
+        with self.lock:
+            return RecordBatch(
+                [self.names["users"][key] for key in batch.users],
+                [self.names["metrics"][key] for key in batch.metrics],
+                batch.user_codes, batch.metric_codes, batch.timestamps, batch.values,
+            )
+
+    def key_rows(self, rows):
+        """Rows (user_id, metric, ...) -> (user_key, metric_key, ...), e.g. partials from TumblingWindows."""
+        rows = list(rows)
+        self.resolve([row[0] for row in rows], [row[1] for row in rows])
+        users, metrics = self.ids["users"], self.ids["metrics"]
+        return [(users[row[0]], metrics[row[1]], *row[2:]) for row in rows]
+
+    def name_keys(self, keys):
+        """(user_key, metric_key, *rest) tuples -> (user_id, metric, *rest) for ids already cached."""
+        users, metrics = self.names["users"], self.names["metrics"]
+        return [(users[key[0]], metrics[key[1]], *key[2:]) for key in keys]
@@ -0,0 +1,148 @@
+import json
+import math
+
+import numpy as np
+
+# Quantile sketch tables kept alongside the 1h/1d rollups, and their bucket widths
+SKETCH_WINDOWS = {
+    "sketch_1h": "1h",
+    "sketch_1d": "1d",
+}
+# user_id under which every participant's values are merged into one sketch per bucket
+POPULATION = "*"
+
+# DDSketch-style log buckets: any quantile comes back within this relative error.
+# Not configurable: every stored sketch and sketches.sql (backfill, sketch_merge) use this
+# bin mapping, and sketches with different accuracies can't be merged.
+SKETCH_ALPHA = 0.01
+GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+LOG_GAMMA = math.log(GAMMA)
+# Magnitudes below this land in the zero bin
+MIN_MAGNITUDE = 1e-9
+
+
+def bin_keys(values: np.ndarray) -> np.ndarray:
+    """
+    Bin key per value: "p<i>" for positive values, "n<i>" for negative ones (by
+    magnitude) and "z" around zero, where bin i covers (gamma^(i-1), gamma^i].
+    """
+    magnitude = np.abs(values)
+    index = np.ceil(np.log(np.maximum(magnitude, MIN_MAGNITUDE)) / LOG_GAMMA).astype(np.int64)
+    prefix = np.where(values > 0, "p", "n")
+    keys = np.char.add(prefix, index.astype(str))
+    return np.where(magnitude < MIN_MAGNITUDE, "z", keys)
+
+
+def compute_sketches(df, freq):
+    """
+    Sketch rows (user_id, metric, bucket, count, bins) from raw rows (user_id, metric,
+    timestamp, value): one per (user_id, metric, bucket), plus a POPULATION row per
+    (metric, bucket) merging every user in the batch.
+    """
+    df = df[df["value"].notna()]
+    if df.empty:
+        return []
+    counts = (
+        df.assign(timestamp=df["timestamp"].dt.floor(freq), key=bin_keys(df["value"].to_numpy()))
+        .groupby(["user_id", "metric", "timestamp", "key"], sort=False, observed=True)
+        .size()
+    )
+    population = counts.groupby(level=["metric", "timestamp", "key"], sort=False, observed=True).sum()
+
+    sketches = {}
+    for (user_id, metric, bucket, key), n in counts.items():
+        sketches.setdefault((user_id, metric, bucket), {})[key] = int(n)
+    for (metric, bucket, key), n in population.items():
+        sketches.setdefault((POPULATION, metric, bucket), {})[key] = int(n)
+
+    return [
+        (user_id, metric, bucket.to_pydatetime(), sum(bins.values()), bins)
+        for (user_id, metric, bucket), bins in sketches.items()
+    ]
+
+
+def sketch_tables(cur):
+    """SKETCH_WINDOWS restricted to the tables that exist, i.e. once sketches.sql has been applied."""
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relname = ANY(%s) AND pg_table_is_visible(oid);",
+        (list(SKETCH_WINDOWS),),
+    )
+    existing = {row[0] for row in cur.fetchall()}
+    return {table: rule for table, rule in SKETCH_WINDOWS.items() if table in existing}
+
+
+def merge_sketches(cur, batch):
+    """
+    Merge a RecordBatch (with names) of rows new to raw_data into every sketch table;
+    returns the sketches merged per table. Every writer of raw_data calls this in the
+    transaction that inserted the rows, so each row is sketched exactly once.
+    """
+    if not len(batch):
+        return {}
+    df = batch.to_frame()
+    return {table: upsert_sketches(cur, table, compute_sketches(df, rule)) for table, rule in sketch_tables(cur).items()}
+
+
+def upsert_sql(table):
+    """Merge incoming sketches into existing buckets; sketch_merge is defined in sketches.sql."""
+    return f"""
+    INSERT INTO {table} (user_id, metric, timestamp, count_value, bins)
+    VALUES %s
+    ON CONFLICT (user_id, metric, timestamp) DO UPDATE SET
+        count_value = {table}.count_value + EXCLUDED.count_value,
+        bins = sketch_merge({table}.bins, EXCLUDED.bins);
+    """
+
+
+def upsert_sketches(cur, table, rows, page_size=10000):
+    # Imported here so the API can use the read-side helpers without psycopg2
+    from psycopg2.extras import execute_values
+
+    # Sorted so concurrent writers lock shared (e.g. population) rows in the same order
+    values = [(user_id, metric, bucket, count, json.dumps(bins))
+              for user_id, metric, bucket, count, bins in sorted(rows, key=lambda row: row[:3])]
+    if values:
+        execute_values(cur, upsert_sql(table), values, template="(%s, %s, %s, %s, %s::jsonb)", page_size=page_size)
+    return len(values)
+
+
+def merge_bins(*sketches):
+    merged = {}
+    for bins in sketches:
+        for key, n in bins.items():
+            merged[key] = merged.get(key, 0) + n
+    return merged
+
+
+def _bin_value(key):
+    """Representative value of a bin: within SKETCH_ALPHA of everything it holds."""
+    if key == "z":
+        return 0.0
+    value = 2 * GAMMA ** int(key[1:]) / (GAMMA + 1)
+    return value if key[0] == "p" else -value
+
+
+def _bin_order(key):
+    # Most negative first: negative bins by descending magnitude, then zero, then positive
+    if key == "z":
+        return (1, 0)
+    index = int(key[1:])
+    return (2, index) if key[0] == "p" else (0, -index)
+
+
+def quantiles(bins, qs):
+    """Approximate value at each quantile in `qs` (0..1), or None for an empty sketch."""
+    total = sum(bins.values())
+    if total == 0:
+        return [None for _ in qs]
+    ordered = sorted(bins, key=_bin_order)
+    results = []
+    for q in qs:
+        rank = q * (total - 1)
+        seen = 0
+        for key in ordered:
+            seen += bins[key]
+            if seen > rank:
+                results.append(_bin_value(key))
+                break
+    return results
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# common/ is imported from the repository root and the API as the `api` package from Task-2,
+# as in the Docker images
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "Task-2")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from api import cache as cache_module
+from api.cache import MemoryCache, cache_key
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DAY = timedelta(days=1)
+SERIES = ("u1", "hr")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def key(day):
+    return cache_key("data_1h", *SERIES, T0 + day * DAY, T0 + (day + 1) * DAY)
+
+
+async def put(cache, day, body=b"x" * 10, ttl=60, series=SERIES):
+    await cache.set(key(day), body, ttl, series, T0 + day * DAY, T0 + (day + 1) * DAY)
+
+
+def test_get_returns_what_was_set():
+    async def scenario():
+        cache = MemoryCache(1000)
+        await put(cache, 0, b"body")
+        return await cache.get(key(0)), await cache.get(key(1)), cache.size
+
+    assert run(scenario()) == (b"body", None, 4)
+
+
+def test_lru_eviction_by_bytes():
+    async def scenario():
+        cache = MemoryCache(30)
+        for day in range(3):
+            await put(cache, day)
+        # Touch day 0 so day 1 is the least recently used
+        await cache.get(key(0))
+        await put(cache, 3)
+        return [await cache.get(key(day)) is not None for day in range(4)], cache.size
+
+    assert run(scenario()) == ([True, False, True, True], 30)
+
+
+def test_oversized_body_is_not_cached():
+    async def scenario():
+        cache = MemoryCache(5)
+        await put(cache, 0, b"x" * 6)
+        return await cache.get(key(0)), cache.size
+
+    assert run(scenario()) == (None, 0)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        cache = MemoryCache(1000)
+        await put(cache, 0, ttl=30)
+        fresh = await cache.get(key(0))
+        now[0] += 31
+        return fresh, await cache.get(key(0)), cache.size
+
+    assert run(scenario()) == (b"x" * 10, None, 0)
+
+
+def test_overwrite_replaces_size():
+    async def scenario():
+        cache = MemoryCache(1000)
+        await put(cache, 0, b"x" * 10)
+        await put(cache, 0, b"y" * 4)
+        return await cache.get(key(0)), cache.size
+
+    assert run(scenario()) == (b"yyyy", 4)
+
+
+def test_invalidate_drops_only_overlapping_ranges_of_the_series():
+    other = cache_key("data_1h", "u2", "hr", T0 + DAY, T0 + 2 * DAY)
+
+    async def scenario():
+        cache = MemoryCache(1000)
+        for day in range(3):
+            await put(cache, day)
+        await cache.set(other, b"other", 60, ("u2", "hr"), T0 + DAY, T0 + 2 * DAY)
+        dropped = await cache.invalidate(SERIES, T0 + DAY + timedelta(hours=1), T0 + DAY + timedelta(hours=2))
+        present = [await cache.get(key(day)) is not None for day in range(3)]
+        return dropped, present, await cache.get(other)
+
+    assert run(scenario()) == (1, [True, False, True], b"other")
+
+
+def test_clear_empties_the_cache():
+    async def scenario():
+        cache = MemoryCache(1000)
+        await put(cache, 0)
+        await cache.clear()
+        return await cache.get(key(0)), cache.size
+
+    assert run(scenario()) == (None, 0)
@@ -0,0 +1,47 @@
+from common.checkpoint import ChunkTracker
+
+
+def test_in_order_commits_advance_the_offset():
+    tracker = ChunkTracker()
+    tracker.start("a.json", 0)
+
+    assert tracker.commit("a.json", 0, 100) == (100, False)
+    assert tracker.commit("a.json", 100, 200) == (200, False)
+    assert tracker.finish("a.json", 200) == (200, True)
+
+
+def test_out_of_order_commits_wait_for_the_gap():
+    tracker = ChunkTracker()
+    tracker.start("a.json", 0)
+
+    assert tracker.commit("a.json", 200, 300) == (0, False)
+    assert tracker.commit("a.json", 100, 200) == (0, False)
+    assert tracker.finish("a.json", 300) == (0, False)
+    # The first chunk lands last and releases everything behind it
+    assert tracker.commit("a.json", 0, 100) == (300, True)
+
+
+def test_resume_starts_from_the_saved_offset():
+    tracker = ChunkTracker()
+    tracker.start("a.json", 500)
+
+    assert tracker.commit("a.json", 600, 700) == (500, False)
+    assert tracker.commit("a.json", 500, 600) == (700, False)
+
+
+def test_files_are_tracked_independently():
+    tracker = ChunkTracker()
+    tracker.start("a.json", 0)
+    tracker.start("b.json", 0)
+
+    tracker.commit("a.json", 0, 10)
+    assert tracker.commit("b.json", 10, 20) == (0, False)
+    assert tracker.finish("a.json", 10) == (10, True)
+    assert tracker.finish("b.json", 20) == (0, False)
+
+
+def test_empty_file_is_done_once_finished():
+    tracker = ChunkTracker()
+    tracker.start("empty.json", 0)
+
+    assert tracker.finish("empty.json", 0) == (0, True)
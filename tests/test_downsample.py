@@ -0,0 +1,92 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from api.downsample import downsample, lttb, minmax
+from api.formats import encode_csv, encode_ndjson, json_value
+from api.main import reduce_rows
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(n, dtype=np.float64), rng.normal(size=n).cumsum()
+
+
+def test_lttb_keeps_endpoints_and_count():
+    x, y = series(1000)
+
+    index = lttb(x, y, 100)
+
+    assert len(index) == 100
+    assert index[0] == 0 and index[-1] == 999
+    assert np.all(np.diff(index) > 0)
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(500, dtype=np.float64)
+    y = np.zeros(500)
+    y[237] = 50.0
+
+    assert 237 in lttb(x, y, 20)
+
+
+def test_lttb_returns_everything_when_short():
+    x, y = series(10)
+    assert lttb(x, y, 50).tolist() == list(range(10))
+
+
+def test_minmax_keeps_each_bucket_extremes():
+    _, y = series(1000, seed=1)
+
+    index = minmax(y, 100)
+
+    assert len(index) <= 100
+    assert np.all(np.diff(index) > 0)
+    assert y.argmin() in index and y.argmax() in index
+    for bucket in np.array_split(np.arange(1000), 50):
+        assert bucket[y[bucket].argmin()] in index
+        assert bucket[y[bucket].argmax()] in index
+
+
+def test_downsample_dispatch():
+    x, y = series(300)
+
+    assert len(downsample(x, y, 30, "lttb")) == 30
+    assert len(downsample(x, y, 30, "minmax")) <= 30
+    assert downsample(x, y, 300).tolist() == list(range(300))
+
+
+def test_reduce_rows_drops_nulls_before_downsampling():
+    rows = [(T0 + timedelta(seconds=i), None if i % 4 == 0 else (math.nan if i % 7 == 0 else float(i)))
+            for i in range(200)]
+
+    reduced = reduce_rows(rows, 20, "lttb")
+
+    assert len(reduced) == 20
+    assert all(value is not None and not math.isnan(value) for _, value in reduced)
+    assert reduce_rows(rows, None, "lttb") is rows
+
+
+def test_reduce_rows_keeps_all_values_when_they_fit():
+    rows = [(T0 + timedelta(seconds=i), None if i % 2 else float(i)) for i in range(10)]
+
+    assert reduce_rows(rows, 8, "minmax") == [row for row in rows if row[1] is not None]
+
+
+def test_nulls_serialize_as_null():
+    rows = [(T0, None), (T0, math.nan), (T0, 1.5)]
+
+    assert [json_value(value) for _, value in rows] == [None, None, 1.5]
+    assert encode_ndjson(rows).decode().splitlines() == [
+        '{"timestamp":"2024-01-01T00:00:00+00:00","value":null}',
+        '{"timestamp":"2024-01-01T00:00:00+00:00","value":null}',
+        '{"timestamp":"2024-01-01T00:00:00+00:00","value":1.5}',
+    ]
+    assert encode_csv(rows).decode().splitlines() == [
+        "2024-01-01T00:00:00+00:00,",
+        "2024-01-01T00:00:00+00:00,",
+        "2024-01-01T00:00:00+00:00,1.5",
+    ]
@@ -0,0 +1,135 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from api import hot
+from api.hot import HotStore, SeriesBuffer, decode
+from common.record_batch import RecordBatch, to_epoch_us
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+T0_US = int(to_epoch_us([T0])[0])
+SECOND = 1_000_000
+Message = namedtuple("Message", "topic partition offset value")
+
+
+def seconds(*offsets):
+    return np.array([T0_US + s * SECOND for s in offsets], dtype=np.int64)
+
+
+def floats(*values):
+    return np.array(values, dtype=np.float64)
+
+
+def stream(store, user_id, metric, offsets, values):
+    store.extend(RecordBatch.from_columns(
+        user_id, metric, [T0 + timedelta(seconds=s) for s in offsets], list(values),
+    ))
+
+
+def test_buffer_appends_in_order_and_grows():
+    buffer = SeriesBuffer()
+    n = hot.INITIAL_CAPACITY * 3
+    for s in range(0, n, 100):
+        chunk = range(s, min(s + 100, n))
+        buffer.add(seconds(*chunk), floats(*chunk))
+
+    timestamps, values = buffer.slice(T0_US, T0_US + n * SECOND)
+    assert len(buffer) == n
+    assert timestamps.tolist() == seconds(*range(n)).tolist()
+    assert values.tolist() == list(range(n))
+    assert buffer.covered_from == T0_US
+
+
+def test_buffer_merges_late_points_and_keeps_first_values():
+    buffer = SeriesBuffer()
+    buffer.add(seconds(0, 2, 4), floats(0, 2, 4))
+    buffer.add(seconds(3, 2, 1, 3), floats(3, 20, 1, 30))
+
+    timestamps, values = buffer.slice(T0_US, T0_US + 10 * SECOND)
+    assert timestamps.tolist() == seconds(0, 1, 2, 3, 4).tolist()
+    assert values.tolist() == [0, 1, 2, 3, 4]
+
+
+def test_buffer_ignores_points_before_its_coverage():
+    buffer = SeriesBuffer()
+    buffer.add(seconds(10, 11), floats(10, 11))
+    buffer.add(seconds(5), floats(5))
+
+    assert buffer.covered_from == T0_US + 10 * SECOND
+    assert len(buffer) == 2
+
+
+def test_buffer_evicts_by_window_and_advances_coverage(monkeypatch):
+    monkeypatch.setattr(hot, "HOT_WINDOW_SECONDS", 10)
+    buffer = SeriesBuffer()
+    buffer.add(seconds(*range(5)), floats(*range(5)))
+    buffer.add(seconds(14, 15), floats(14, 15))
+
+    timestamps, _ = buffer.slice(T0_US, T0_US + 20 * SECOND)
+    assert timestamps.tolist() == seconds(14, 15).tolist()
+    # Everything from just after the last evicted point is held
+    assert buffer.covered_from == T0_US + 4 * SECOND + 1
+
+
+def test_buffer_evicts_by_point_cap(monkeypatch):
+    monkeypatch.setattr(hot, "HOT_MAX_POINTS", 3)
+    buffer = SeriesBuffer()
+    buffer.add(seconds(*range(5)), floats(*range(5)))
+
+    assert len(buffer) == 3
+    assert buffer.covered_from == T0_US + 1 * SECOND + 1
+    assert buffer.slice(T0_US, T0_US + 10 * SECOND)[1].tolist() == [2, 3, 4]
+
+
+def test_store_reads_raw_rows_only_when_covered():
+    store = HotStore()
+    stream(store, "u1", "hr", [10, 11, 12], [60.0, None, 62.0])
+
+    rows = store.read("u1", "hr", T0 + timedelta(seconds=10), T0 + timedelta(seconds=11))
+    assert rows == [(T0 + timedelta(seconds=10), 60.0), (T0 + timedelta(seconds=11), None)]
+    assert store.read("u1", "hr", T0, T0 + timedelta(seconds=12)) is None
+    assert store.read("u2", "hr", T0 + timedelta(seconds=10), T0 + timedelta(seconds=12)) is None
+    assert store.points == 3
+
+
+def test_store_reads_rollups_as_bucket_means():
+    store = HotStore()
+    stream(store, "u1", "hr", range(0, 180), [float(s // 60) for s in range(180)])
+
+    # Buckets starting in the range, each a full minute of points; NULLs would be skipped
+    rows = store.read("u1", "hr", T0, T0 + timedelta(seconds=90), table="data_1m")
+    assert rows == [(T0, 0.0), (T0 + timedelta(minutes=1), 1.0)]
+    # The first bucket starting in the range must be fully covered
+    assert store.read("u1", "hr", T0 - timedelta(seconds=30), T0 + timedelta(minutes=2), table="data_1m") == [
+        (T0, 0.0), (T0 + timedelta(minutes=1), 1.0), (T0 + timedelta(minutes=2), 2.0),
+    ]
+    stream(store, "u2", "hr", range(30, 180), [1.0] * 150)
+    assert store.read("u2", "hr", T0, T0 + timedelta(minutes=2), table="data_1m") is None
+
+
+def test_store_tail_returns_coverage_and_rows():
+    store = HotStore()
+    stream(store, "u1", "hr", [10, 11, 12], [1.0, 2.0, 3.0])
+
+    covered_from, rows = store.tail("u1", "hr", T0 + timedelta(seconds=11))
+    assert covered_from == T0 + timedelta(seconds=10)
+    assert rows == [(T0 + timedelta(seconds=10), 1.0), (T0 + timedelta(seconds=11), 2.0)]
+    assert store.tail("u1", "steps", T0) == (None, [])
+
+
+def test_decode_skips_malformed_messages():
+    messages = [
+        Message("t", 0, 0, b'{"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T00:00:00Z", "value": 60}'),
+        Message("t", 0, 1, b"not json"),
+        Message("t", 0, 2, b'{"user_id": "u1", "metric": "hr", "timestamp": "yesterday", "value": 61}'),
+        Message("t", 0, 3, b'{"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T00:00:01Z", "value": "high"}'),
+        Message("t", 0, 4, b'{"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T00:00:02Z"}'),
+        Message("t", 0, 5, b"[1, 2]"),
+        Message("t", 0, 6, b'{"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T02:00:03+02:00", "value": "62.5"}'),
+    ]
+
+    batch = decode(messages)
+    assert batch.timestamps.tolist() == [T0_US, T0_US + 3 * SECOND]
+    assert batch.values.tolist() == [60.0, 62.5]
+    assert len(decode([])) == 0
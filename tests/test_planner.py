@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+from api.planner import Planner
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DAY = timedelta(days=1)
+
+
+def test_finest_table_within_the_scan_budget():
+    planner = Planner(budget=5000)
+
+    # 1 Hz by default: 86,400 raw rows a day, 1,440 minutes, 24 hours
+    assert planner.choose("hr", T0, T0 + DAY) == "data_1m"
+    # A chart narrower than data_1m still reads data_1m and is downsampled afterwards
+    assert planner.choose("hr", T0, T0 + DAY, max_points=1400) == "data_1m"
+    assert planner.choose("hr", T0, T0 + 30 * DAY, max_points=1400) == "data_1h"
+    # A wider chart raises the budget
+    assert planner.choose("hr", T0, T0 + DAY, max_points=100000) == "raw_data"
+
+
+def test_density_statistics_drive_the_estimate():
+    planner = Planner(budget=5000)
+    planner.density[("breath_rate", "raw_data")] = 1.0
+
+    assert planner.choose("breath_rate", T0, T0 + 365 * DAY) == "raw_data"
+
+
+def test_coverage_is_judged_per_series():
+    planner = Planner(budget=5000)
+    planner.coverage = {
+        # data_1m was never written for this series: fall back to the next coarser table
+        (1, 1): {"raw_data": (T0, T0 + DAY), "data_1h": (T0, T0 + DAY), "data_1d": (T0, T0)},
+        (2, 1): {"raw_data": (T0, T0 + DAY), "data_1m": (T0, T0 + DAY)},
+    }
+
+    assert planner.choose("hr", T0, T0 + DAY, series=[(1, 1)]) == "data_1h"
+    assert planner.choose("hr", T0, T0 + DAY, series=[(2, 1)]) == "data_1m"
+    # Series without loaded coverage don't constrain the choice
+    assert planner.choose("hr", T0, T0 + DAY, series=[(3, 1)]) == "data_1m"
+    # Every series must be covered: only raw_data is complete for both
+    assert planner.choose("hr", T0, T0 + DAY, series=[(1, 1), (2, 1)]) == "raw_data"
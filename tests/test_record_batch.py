@@ -0,0 +1,128 @@
+import struct
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from common.record_batch import COPY_HEADER, COPY_TRAILER, PG_EPOCH_OFFSET_US, RecordBatch
+from common.rollups import compute_partials
+
+RECORDS = [
+    {"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T00:00:30", "value": 60},
+    {"user_id": "u1", "metric": "hr", "timestamp": "2024-01-01T00:00:45Z", "value": 70.5},
+    {"user_id": "u2", "metric": "hr", "timestamp": "2024-01-01T00:01:10+00:00", "value": None},
+    {"user_id": "u1", "metric": "spo2", "timestamp": "2024-01-01T01:00:00+01:00", "value": 97},
+    {"user_id": "u2", "metric": "hr", "timestamp": "2024-01-01T00:01:20", "value": 80},
+]
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def epoch_us(*args):
+    return int(utc(*args).timestamp()) * 1_000_000
+
+
+def read_copy(buf):
+    """Decode a binary COPY stream of (text, text, timestamptz, float8) rows."""
+    data = buf.getvalue()
+    assert data.startswith(COPY_HEADER) and data.endswith(COPY_TRAILER)
+    pos, rows = len(COPY_HEADER), []
+    while pos < len(data) - len(COPY_TRAILER):
+        (fields,), pos = struct.unpack_from("!h", data, pos), pos + 2
+        row = []
+        for _ in range(fields):
+            (length,), pos = struct.unpack_from("!i", data, pos), pos + 4
+            row.append(None if length == -1 else data[pos:pos + length])
+            pos += max(length, 0)
+        user, metric, ts, value = row
+        rows.append((
+            user.decode(), metric.decode(),
+            struct.unpack("!q", ts)[0] + PG_EPOCH_OFFSET_US,
+            None if value is None else struct.unpack("!d", value)[0],
+        ))
+    return rows
+
+
+def test_from_records_codes_and_normalizes():
+    batch = RecordBatch.from_records(RECORDS)
+
+    assert len(batch) == 5
+    assert batch.users == ["u1", "u2"]
+    assert batch.metrics == ["hr", "spo2"]
+    assert batch.user_codes.tolist() == [0, 0, 1, 0, 1]
+    assert batch.metric_codes.tolist() == [0, 0, 0, 1, 0]
+    assert batch.user_codes.dtype == np.int32 and batch.timestamps.dtype == np.int64
+    # Naive timestamps are UTC, offsets are applied, None becomes NaN
+    assert batch.timestamps[:4].tolist() == [
+        epoch_us(2024, 1, 1, 0, 0, 30), epoch_us(2024, 1, 1, 0, 0, 45),
+        epoch_us(2024, 1, 1, 0, 1, 10), epoch_us(2024, 1, 1),
+    ]
+    assert np.isnan(batch.values[2])
+    assert batch.records()[2]["value"] is None
+    assert batch.series_ranges()[("u2", "hr")] == (utc(2024, 1, 1, 0, 1, 10), utc(2024, 1, 1, 0, 1, 20))
+
+
+def test_from_rows_matches_from_records():
+    rows = [(rec["user_id"], rec["metric"], rec["timestamp"], rec["value"]) for rec in RECORDS]
+    assert RecordBatch.from_rows(rows).rows() == RecordBatch.from_records(RECORDS).rows()
+
+
+def test_concat_recodes_dictionaries():
+    first = RecordBatch.from_records(RECORDS[:2])
+    second = RecordBatch.from_records(RECORDS[2:])
+
+    merged = RecordBatch.concat([first, second])
+
+    assert merged.rows() == RecordBatch.from_records(RECORDS).rows()
+
+
+def test_partials_match_compute_partials():
+    batch = RecordBatch.from_records(RECORDS)
+    frame = batch.to_frame()
+
+    for width, freq in ((timedelta(minutes=1), "1min"), (timedelta(hours=1), "1h")):
+        expected = compute_partials(frame, freq)
+        expected = sorted(
+            (row.user_id, row.metric, row.timestamp.to_pydatetime(), row.sum_value, row.count_value,
+             row.min_value, row.max_value)
+            for row in expected.itertuples()
+        )
+        assert sorted(batch.partials(width)) == expected
+
+
+def test_partials_skip_null_only_buckets():
+    batch = RecordBatch.from_records([RECORDS[2]])
+    assert batch.partials(timedelta(minutes=1)) == []
+
+
+def test_copy_binary_round_trips():
+    batch = RecordBatch.from_records(RECORDS)
+
+    decoded = sorted(read_copy(batch.copy_binary()), key=lambda row: (row[0], row[1], row[2]))
+
+    expected = sorted(
+        (user, metric, int(pd.Timestamp(ts).value // 1000), value)
+        for user, metric, ts, value in batch.rows()
+    )
+    assert decoded == expected
+
+
+def test_copy_binary_writes_integer_keys():
+    batch = RecordBatch([7], [3], np.zeros(1, np.int32), np.zeros(1, np.int32),
+                        np.array([PG_EPOCH_OFFSET_US], np.int64), np.array([1.5]))
+
+    data = batch.copy_binary().getvalue()[len(COPY_HEADER):-len(COPY_TRAILER)]
+
+    assert data == (struct.pack("!h", 4) + struct.pack("!ii", 4, 7) + struct.pack("!ih", 2, 3)
+                    + struct.pack("!iq", 8, 0) + struct.pack("!id", 8, 1.5))
+
+
+def test_empty_batch():
+    batch = RecordBatch.from_records([])
+
+    assert len(batch) == 0
+    assert batch.partials(timedelta(minutes=1)) == []
+    assert batch.series_ranges() == {}
+    assert read_copy(batch.copy_binary()) == []
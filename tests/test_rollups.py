@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+
+from common.rollups import TumblingWindows, refresh_window
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+MINUTE = timedelta(minutes=1)
+
+
+def at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+def test_bucket_floors_to_the_window():
+    windows = TumblingWindows(MINUTE, timedelta(0))
+
+    assert windows.bucket(at(59.9)) == T0
+    assert windows.bucket(at(60)) == at(60)
+    assert TumblingWindows(timedelta(days=1), timedelta(0)).bucket(at(86399)) == T0
+
+
+def test_window_accumulates_partial_state():
+    windows = TumblingWindows(MINUTE, timedelta(0))
+    for offset, (seconds, value) in enumerate([(0, 5.0), (10, 1.0), (20, 9.0)]):
+        windows.add("u", "hr", at(seconds), value, 0, offset)
+
+    assert windows.close(force=True) == [("u", "hr", T0, 15.0, 3, 1.0, 9.0)]
+    assert windows.open == {}
+
+
+def test_windows_close_once_the_watermark_passes_lateness():
+    windows = TumblingWindows(MINUTE, timedelta(seconds=30))
+    windows.add("u", "hr", at(10), 1.0, 0, 0)
+    windows.add("u", "hr", at(70), 2.0, 0, 1)
+
+    # Watermark 70s: the first bucket ends at 60s and stays open until 90s
+    assert windows.close() == []
+    windows.add("u", "hr", at(95), 3.0, 0, 2)
+    assert windows.close() == [("u", "hr", T0, 1.0, 1, 1.0, 1.0)]
+    assert list(windows.open) == [("u", "hr", at(60))]
+
+
+def test_late_value_opens_a_fresh_partial():
+    windows = TumblingWindows(MINUTE, timedelta(0))
+    windows.add("u", "hr", at(10), 1.0, 0, 0)
+    windows.add("u", "hr", at(200), 2.0, 0, 1)
+    assert windows.close() == [("u", "hr", T0, 1.0, 1, 1.0, 1.0)]
+
+    windows.add("u", "hr", at(20), 4.0, 0, 2)
+
+    # The watermark doesn't move back, so it closes right away and merges downstream
+    assert windows.close() == [("u", "hr", T0, 4.0, 1, 4.0, 4.0)]
+
+
+def test_series_are_kept_apart():
+    windows = TumblingWindows(MINUTE, timedelta(0))
+    windows.add("u1", "hr", at(1), 1.0, 0, 0)
+    windows.add("u2", "hr", at(2), 2.0, 0, 1)
+    windows.add("u1", "spo2", at(3), 3.0, 0, 2)
+
+    assert sorted(windows.close(force=True)) == [
+        ("u1", "hr", T0, 1.0, 1, 1.0, 1.0),
+        ("u1", "spo2", T0, 3.0, 1, 3.0, 3.0),
+        ("u2", "hr", T0, 2.0, 1, 2.0, 2.0),
+    ]
+
+
+def test_min_open_offset_tracks_unflushed_positions():
+    windows = TumblingWindows(MINUTE, timedelta(0))
+    windows.add("u", "hr", at(10), 1.0, 0, 7)
+    windows.add("u", "hr", at(20), 1.0, 0, 3)
+    windows.add("u", "hr", at(30), 1.0, 1, 12)
+
+    assert windows.min_open_offset(0) == 3
+    assert windows.min_open_offset(1) == 12
+    assert windows.min_open_offset(2) is None
+
+    windows.close(force=True)
+    assert windows.min_open_offset(0) is None
+
+
+def test_refresh_window_aligns_to_buckets():
+    now = T0 + timedelta(days=30)
+
+    # No policy: the whole written range, widened to whole buckets
+    assert refresh_window(at(90), at(150), MINUTE, None, now) == (at(60), at(180))
+    assert refresh_window(at(60), at(60), MINUTE, None, now) == (at(60), at(120))
+    assert refresh_window(at(3600 * 5), at(3600 * 30), timedelta(days=1), None, now) == (T0, T0 + timedelta(days=2))
+
+
+def test_refresh_window_leaves_the_policy_range_to_the_policy():
+    now = T0 + timedelta(days=1, minutes=30)
+    policy = timedelta(hours=2)
+
+    # Old rows up to the bucket holding the policy's start
+    assert refresh_window(T0, now, MINUTE, policy, now) == (T0, now - policy + MINUTE)
+    # Rows the policy reaches on its own need no manual refresh
+    assert refresh_window(now - timedelta(minutes=10), now, MINUTE, policy, now) is None
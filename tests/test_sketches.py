@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from common.sketches import POPULATION, SKETCH_ALPHA, bin_keys, compute_sketches, merge_bins, quantiles
+
+
+def sketch(values):
+    keys, counts = np.unique(bin_keys(np.asarray(values, dtype=np.float64)), return_counts=True)
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
+def test_bin_keys_by_sign_and_magnitude():
+    keys = bin_keys(np.array([0.0, 1e-12, 1.005, 1.015, -1.005, 100.0, -100.0]))
+
+    assert keys[0] == "z" and keys[1] == "z"
+    assert keys[2].startswith("p") and keys[4].startswith("n")
+    # Values within one bin of each other, and equal magnitudes across signs, share an index
+    assert keys[2] == keys[3]
+    assert keys[2][1:] == keys[4][1:]
+    assert keys[5][1:] == keys[6][1:] != keys[2][1:]
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(mean=4, sigma=1, size=20000)
+    qs = [0.01, 0.25, 0.5, 0.9, 0.99]
+
+    estimates = quantiles(sketch(values), qs)
+
+    for estimate, exact in zip(estimates, np.quantile(values, qs, method="lower")):
+        assert abs(estimate - exact) <= 2 * SKETCH_ALPHA * exact
+
+
+def test_quantiles_order_negative_zero_positive():
+    bins = sketch([-50.0, -5.0, 0.0, 5.0, 50.0])
+
+    low, mid, high = quantiles(bins, [0.0, 0.5, 1.0])
+
+    assert low < -45 and mid == 0.0 and high > 45
+
+
+def test_quantiles_of_empty_sketch():
+    assert quantiles({}, [0.5, 0.9]) == [None, None]
+
+
+def test_merge_matches_sketching_everything_at_once():
+    rng = np.random.default_rng(1)
+    first, second = rng.normal(70, 10, 500), rng.normal(90, 5, 800)
+
+    merged = merge_bins(sketch(first), sketch(second))
+
+    assert merged == sketch(np.concatenate([first, second]))
+    assert quantiles(merged, [0.5]) == quantiles(sketch(np.concatenate([first, second])), [0.5])
+
+
+def test_compute_sketches_adds_population_rows():
+    df = pd.DataFrame({
+        "user_id": ["u1", "u1", "u2", "u2"],
+        "metric": ["hr"] * 4,
+        "timestamp": pd.to_datetime(["2024-01-01T00:10", "2024-01-01T00:20", "2024-01-01T00:30", "2024-01-01T01:05"],
+                                    utc=True),
+        "value": [60.0, 61.0, 80.0, None],
+    })
+
+    rows = {(user, metric, bucket): (count, bins) for user, metric, bucket, count, bins in compute_sketches(df, "1h")}
+
+    hour = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert set(rows) == {("u1", "hr", hour), ("u2", "hr", hour), (POPULATION, "hr", hour)}
+    assert rows[("u1", "hr", hour)][0] == 2
+    assert rows[(POPULATION, "hr", hour)] == (3, merge_bins(rows[("u1", "hr", hour)][1], rows[("u2", "hr", hour)][1]))